@@ -1,12 +1,22 @@
 import pandas as pd
 import numpy as np
+import matplotlib
+matplotlib.use("Agg") # 画面を使わずファイルに保存するだけなので、ヘッドレスで描画する
 import matplotlib.pyplot as plt
 import seaborn as sns
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error
+import argparse
+import concurrent.futures
+import joblib
+import os
+import tempfile
 import warnings
 import sys
+from data_cache import read_dataset
+from forest_engine import ForestEngine
+from instrumentation import profiler
 
 # 警告を非表示
 warnings.filterwarnings('ignore')
@@ -43,33 +53,486 @@ TARGET_VALUE = 200.0
 # (大きいほど計算時間がかかりますが、精度が上がります)
 GRID_POINTS = 10
 
+# 6. シミュレーションの分割と並列化
+# (組み合わせをこの件数ずつ生成・評価するため、使用メモリは総組み合わせ数に依存しません)
+SIM_CHUNK_SIZE = 200000
+# 並列に評価するプロセス数（1 なら1プロセスで順番に評価）
+SIM_WORKERS = 1
+# 結果として保持・出力する上位の件数（Score / Pred_Std それぞれ）
+SIM_TOP_K = 1000
+# トレードオフ図用に（全組み合わせから一様に）抽出する件数
+SIM_PLOT_SAMPLE = 2000
+# 全組み合わせの結果を列指向形式（Parquet）で保存するファイル名（None なら保存しない）
+# (pyarrow が必要です。数千万件でも CSV より高速・小容量に書き出せます)
+SIM_FULL_OUTPUT = None # 例: "simulation_results_full.parquet"
+
+# 7. シミュレーションの探索方法
+# "grid"     -> 全組み合わせ（GRID_POINTS ** 変数の数）を評価
+# "adaptive" -> 準乱数（Sobol列）で全体を粗く評価した後、Score / Pred_Std の良い領域の周辺を
+#               段階的に細かく評価する（変数が多くても評価回数が指数的に増えない）
+SIM_MODE = "grid"
+# (adaptive) 最初に全体から抽出する点数（2のべき乗が望ましい）
+ADAPTIVE_INITIAL_SAMPLES = 1024
+# (adaptive) 絞り込みの回数と、各回で周辺を調べる上位の点の数・1点あたりの追加点数
+ADAPTIVE_ROUNDS = 6
+ADAPTIVE_ELITES = 20
+ADAPTIVE_SAMPLES_PER_ELITE = 32
+# (adaptive) 周辺の探索幅（変数の範囲に対する割合）と、1回ごとの縮小率
+ADAPTIVE_INITIAL_RADIUS = 0.25
+ADAPTIVE_SHRINK = 0.5
+
+# 8. グラフの描画方法
+# "auto"   -> 行数が PLOT_ROW_THRESHOLD 以下なら "full"、超えたら "binned"
+# "full"   -> 従来どおり全行の散布図（ペアプロット）と KDE つきヒストグラム
+# "binned" -> 全行を集計したヒストグラム・2次元のビン集計（密度）で描く（行数が多くても描画時間が増えない）
+# "skip"   -> グラフを描かない
+PLOT_MODE = "auto"
+PLOT_ROW_THRESHOLD = 100000
+# (binned) ビンの数と、KDE の曲線を推定するために抽出する行数（抽出する行は乱数シードで決まる）
+PLOT_BINS = 50
+PLOT_SAMPLE_ROWS = 50000
+# グラフを描画するプロセス数（0 ならメインの処理の合間に順番に描画。1 以上なら計算と並行して描画）
+PLOT_WORKERS = 1
+
 # ----------------------------------------------------
 # ▲ ユーザー設定項目はここまで ▲
 # ----------------------------------------------------
 
 
+# シミュレーション結果の列（最後の列は組み合わせの通し番号）
+SIM_RESULT_COLS = ["Pred_Mean", "Pred_Std", "Target_Error", "Score"]
+
+# ワーカープロセスで使う変数
+g_engine = None
+g_ranges = None
+g_keep_rows = False
+
+
+class RunningStats:
+    """ 平均・分散・最小・最大を、全データを保持せずに集計する（Chan の並列アルゴリズム） """
+
+    def __init__(self, count=0, mean=0.0, m2=0.0, min_value=np.inf, max_value=-np.inf):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+        self.min = min_value
+        self.max = max_value
+
+    @classmethod
+    def from_values(cls, values):
+        if len(values) == 0:
+            return cls()
+        mean = float(np.mean(values))
+        return cls(len(values), mean, float(np.sum((values - mean) ** 2)),
+                   float(np.min(values)), float(np.max(values)))
+
+    def merge(self, other):
+        """ 別の集計結果を取り込む """
+        if other.count == 0:
+            return
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+        self.count = count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / self.count) if self.count else np.nan
+
+
+def select_top_k(rows, key_col, k):
+    """ key_col の小さい順に上位 k 行を返す（同値は通し番号順。全件のソートはしない） """
+    if len(rows) > k:
+        # argpartition は境界の同値を任意に選ぶため、境界値と等しい行は全て残してから絞り込む
+        kth_value = np.partition(rows[:, key_col], k - 1)[k - 1]
+        rows = rows[rows[:, key_col] <= kth_value]
+    order = np.lexsort((rows[:, -1], rows[:, key_col]))
+    return rows[order[:k]]
+
+
+def pareto_front(rows, x_col, y_col):
+    """
+    x_col と y_col をともに最小化するときの厳密なパレートフロント（O(n log n)）
+    x の小さい順に並べ、それまでの y の最小値を更新する行だけを残す
+    (目的値が全く同じ行は、通し番号が最も小さい1行で代表する)
+    """
+    if len(rows) == 0:
+        return rows
+    order = np.lexsort((rows[:, -1], rows[:, y_col], rows[:, x_col]))
+    rows = rows[order]
+    y = rows[:, y_col]
+    best_before = np.concatenate([[np.inf], np.minimum.accumulate(y)[:-1]])
+    return rows[y < best_before]
+
+
+def decode_grid_chunk(ranges, start, stop):
+    """ 通し番号 [start, stop) の組み合わせを (件数, 変数の数) の配列として生成する """
+    shape = [len(r) for r in ranges]
+    # np.meshgrid（indexing='xy'）の flatten と同じ並び順にするため、先頭2軸を入れ替えて番号を分解する
+    if len(shape) >= 2:
+        shape[0], shape[1] = shape[1], shape[0]
+    index = list(np.unravel_index(np.arange(start, stop), shape))
+    if len(index) >= 2:
+        index[0], index[1] = index[1], index[0]
+    return np.column_stack([r[i] for r, i in zip(ranges, index)])
+
+
+def score_points(engine, X_points, start):
+    """ 入力点を予測し、[入力値..., Pred_Mean, Pred_Std, Target_Error, Score, 通し番号] の行列を返す """
+    # まとまった点数はツリーごとの predict（scikit-learn の C言語の実装）で、少ない点数はエンジンで辿る
+    pred_mean, pred_std = engine.predict_mean_std(X_points)
+    target_error = np.abs(pred_mean - TARGET_VALUE)
+    score = target_error + pred_std
+    index = np.arange(start, start + len(X_points))
+    return np.column_stack([X_points, pred_mean, pred_std, target_error, score, index])
+
+
+def summarize_rows(rows, n_x, sample_seed, keep_rows=False):
+    """ 評価結果の行列を、集計値・上位の行・パレートフロント・図用サンプルに縮約する """
+    # 図のための一様サンプル: 行ごとに（シードから決まる）乱数キーを振り、小さい順に残す
+    rng = np.random.default_rng(sample_seed)
+    sample_rows = np.column_stack([rows[:, :-1], rng.random(len(rows))])
+
+    return {
+        "stats": {col: RunningStats.from_values(rows[:, n_x + j]) for j, col in enumerate(SIM_RESULT_COLS)},
+        "top_std": select_top_k(rows, n_x + 1, SIM_TOP_K),
+        "top_score": select_top_k(rows, n_x + 3, SIM_TOP_K),
+        "front": pareto_front(rows, n_x + 2, n_x + 1), # Target_Error vs Pred_Std
+        "sample": select_top_k(sample_rows, -1, SIM_PLOT_SAMPLE),
+        "rows": rows if keep_rows else None,
+    }
+
+
+class SimulationResult:
+    """ チャンクごとの縮約結果を取り込み、全体の集計値・上位の行・パレートフロントを保持する """
+
+    def __init__(self, n_x, full_output=None):
+        self.n_x = n_x
+        empty = np.empty((0, n_x + len(SIM_RESULT_COLS) + 1))
+        self.stats = {col: RunningStats() for col in SIM_RESULT_COLS}
+        self.top_std = empty
+        self.top_score = empty
+        self.front = empty
+        self.sample = empty
+        self.writer = None
+        self.full_output = full_output
+
+    def merge(self, summary):
+        n_x = self.n_x
+        for col in SIM_RESULT_COLS:
+            self.stats[col].merge(summary["stats"][col])
+        self.top_std = select_top_k(np.vstack([self.top_std, summary["top_std"]]), n_x + 1, SIM_TOP_K)
+        self.top_score = select_top_k(np.vstack([self.top_score, summary["top_score"]]), n_x + 3, SIM_TOP_K)
+        # 和集合のパレートフロントは、それぞれのフロントの和集合のフロントに等しい
+        self.front = pareto_front(np.vstack([self.front, summary["front"]]), n_x + 2, n_x + 1)
+        self.sample = select_top_k(np.vstack([self.sample, summary["sample"]]), -1, SIM_PLOT_SAMPLE)
+        if summary["rows"] is not None:
+            self.write_rows(summary["rows"])
+
+    def write_rows(self, rows):
+        """ 全組み合わせの結果を列指向形式（Parquet）に追記する """
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        columns = X_COLS + SIM_RESULT_COLS
+        table = pa.table({col: rows[:, j] for j, col in enumerate(columns)})
+        if self.writer is None:
+            self.writer = pq.ParquetWriter(self.full_output, table.schema)
+        self.writer.write_table(table)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+            print(f"全組み合わせの結果を '{self.full_output}' に保存しました。")
+
+
+def full_output_path():
+    """ 全件出力の保存先（pyarrow がなければ警告して None） """
+    if not SIM_FULL_OUTPUT:
+        return None
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        print("警告: pyarrow がインストールされていないため、全組み合わせの結果は保存しません。")
+        return None
+    return SIM_FULL_OUTPUT
+
+
+def init_sim_worker(model_path, ranges, keep_rows):
+    """ ワーカープロセスの初期化（ツリーごとの predict を使うため、学習済みモデルを読み込む） """
+    global g_engine, g_ranges, g_keep_rows
+    warnings.filterwarnings('ignore')
+    g_engine = ForestEngine.from_model(joblib.load(model_path))
+    g_ranges = ranges
+    g_keep_rows = keep_rows
+
+
+def evaluate_grid_chunk(bounds):
+    """ 1チャンク分の組み合わせを生成・予測し、集計値と上位の行だけを返す """
+    start, stop = bounds
+    X_chunk = decode_grid_chunk(g_ranges, start, stop)
+    rows = score_points(g_engine, X_chunk, start)
+    return summarize_rows(rows, X_chunk.shape[1], [42, start], keep_rows=g_keep_rows)
+
+
+def run_grid_simulation(model, engine, ranges, n_combinations):
+    """ 全組み合わせをチャンク単位で（必要なら並列に）評価し、結果を集約する """
+    global g_engine, g_ranges, g_keep_rows
+    chunks = [(start, min(start + SIM_CHUNK_SIZE, n_combinations))
+              for start in range(0, n_combinations, SIM_CHUNK_SIZE)]
+    full_output = full_output_path()
+    result = SimulationResult(len(ranges), full_output)
+
+    if SIM_WORKERS <= 1:
+        g_engine, g_ranges, g_keep_rows = engine, ranges, full_output is not None
+        for i, summary in enumerate(map(evaluate_grid_chunk, chunks)):
+            result.merge(summary)
+            print(f"  {chunks[i][1]} / {n_combinations} 件を評価しました")
+    else:
+        with tempfile.TemporaryDirectory() as model_dir:
+            model_path = os.path.join(model_dir, "model.joblib")
+            joblib.dump(model, model_path)
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=SIM_WORKERS, initializer=init_sim_worker,
+                initargs=(model_path, ranges, full_output is not None)
+            ) as executor:
+                # map は入力順に結果を返すため、集約結果はプロセス数に依存しない
+                for i, summary in enumerate(executor.map(evaluate_grid_chunk, chunks)):
+                    result.merge(summary)
+                    print(f"  {chunks[i][1]} / {n_combinations} 件を評価しました")
+
+    result.close()
+    return result
+
+
+def run_adaptive_search(engine, lower, upper):
+    """
+    準乱数（Sobol列）による粗い探索から始め、Score / Pred_Std の良い点の周辺を
+    段階的に細かく探索する。戻り値は run_grid_simulation() と同じ形式
+    """
+    from scipy.stats import qmc  # scikit-learn の依存ライブラリとして入っている
+
+    n_x = len(lower)
+    width = upper - lower
+    rng = np.random.default_rng(42)
+
+    # 1. 全体を準乱数で粗く評価
+    sobol = qmc.Sobol(d=n_x, scramble=True, seed=42)
+    X_points = lower + sobol.random(ADAPTIVE_INITIAL_SAMPLES) * width
+    rows = score_points(engine, X_points, 0)
+    print(f"  初期探索: {len(rows)} 点を評価しました (最良 Score {rows[:, n_x + 3].min():.4f})")
+
+    # 2. 良い点（Score 上位・Pred_Std 上位）の周辺を、探索幅を縮めながら評価
+    radius = ADAPTIVE_INITIAL_RADIUS
+    for round_i in range(ADAPTIVE_ROUNDS):
+        elites = np.vstack([select_top_k(rows, n_x + 3, ADAPTIVE_ELITES),
+                            select_top_k(rows, n_x + 1, ADAPTIVE_ELITES)])
+        elites = elites[np.unique(elites[:, -1], return_index=True)[1]]
+
+        offsets = rng.uniform(-radius, radius, size=(len(elites), ADAPTIVE_SAMPLES_PER_ELITE, n_x)) * width
+        X_points = np.clip(elites[:, None, :n_x] + offsets, lower, upper).reshape(-1, n_x)
+        rows = np.vstack([rows, score_points(engine, X_points, len(rows))])
+
+        print(f"  絞り込み {round_i + 1}/{ADAPTIVE_ROUNDS}: 探索幅 {radius:.3f}, 累計 {len(rows)} 点 "
+              f"(最良 Score {rows[:, n_x + 3].min():.4f}, 最小 Pred_Std {rows[:, n_x + 1].min():.4f})")
+        radius *= ADAPTIVE_SHRINK
+
+    full_output = full_output_path()
+    result = SimulationResult(n_x, full_output)
+    result.merge(summarize_rows(rows, n_x, [42, 0], keep_rows=full_output is not None))
+    result.close()
+    return result
+
+
+def resolve_plot_mode(plot_mode, n_rows):
+    """ "auto" を行数に応じて "full" / "binned" に置き換える """
+    if plot_mode == "auto":
+        return "binned" if n_rows > PLOT_ROW_THRESHOLD else "full"
+    return plot_mode
+
+
+def sample_rows(df, n_rows, seed=42):
+    """ 行数が n_rows を超える場合だけ、乱数シードで決まる行を元の並び順のまま抽出する """
+    if len(df) <= n_rows:
+        return df
+    index = np.sort(np.random.default_rng(seed).choice(len(df), n_rows, replace=False))
+    return df.iloc[index]
+
+
+def plot_distribution(values, path):
+    """ (full) 目的変数の分布（全行の KDE つきヒストグラム） """
+    plt.figure(figsize=(10, 5))
+    sns.histplot(values, kde=True, bins=30)
+    plt.title(f'目的変数 ({Y_COL}) の分布（現状のばらつき）')
+    plt.xlabel(Y_COL)
+    plt.ylabel('頻度')
+    plt.savefig(path)
+    plt.close()
+
+
+def plot_binned_distribution(counts, edges, kde_x, kde_y, path):
+    """ (binned) 目的変数の分布（集計済みのヒストグラム + 抽出した行から推定した KDE） """
+    plt.figure(figsize=(10, 5))
+    plt.stairs(counts, edges, fill=True, alpha=0.6)
+    plt.plot(kde_x, kde_y)
+    plt.title(f'目的変数 ({Y_COL}) の分布（現状のばらつき）')
+    plt.xlabel(Y_COL)
+    plt.ylabel('頻度')
+    plt.savefig(path)
+    plt.close()
+
+
+def plot_pairplot(plot_df, path):
+    """ (full) 変数間の関係（全行のペアプロット） """
+    grid = sns.pairplot(plot_df)
+    grid.figure.suptitle('変数間の関係（ペアプロット）', y=1.02)
+    grid.savefig(path)
+    plt.close(grid.figure)
+
+
+def plot_binned_pairs(columns, histograms, densities, path):
+    """
+    (binned) 変数間の関係（対角は集計済みのヒストグラム、それ以外は2次元のビン集計による密度）
+    histograms: {列名: (件数, ビン境界)}, densities: {(x列名, y列名): (件数の行列, x境界, y境界)}
+    """
+    n = len(columns)
+    fig, axes = plt.subplots(n, n, figsize=(2.5 * n, 2.5 * n), squeeze=False)
+    for i, y_col in enumerate(columns):
+        for j, x_col in enumerate(columns):
+            ax = axes[i, j]
+            if i == j:
+                counts, edges = histograms[x_col]
+                ax.stairs(counts, edges, fill=True)
+            else:
+                counts, x_edges, y_edges = densities[(x_col, y_col)]
+                # 件数は対数の色で表し、件数 0 のビンは塗らない
+                ax.pcolormesh(x_edges, y_edges, np.ma.masked_equal(counts.T, 0),
+                              norm=matplotlib.colors.LogNorm(), cmap="viridis")
+            if i == n - 1:
+                ax.set_xlabel(x_col)
+            if j == 0:
+                ax.set_ylabel(y_col)
+    fig.suptitle('変数間の関係（ビン集計による密度）', y=1.02)
+    fig.tight_layout()
+    fig.savefig(path, bbox_inches="tight")
+    plt.close(fig)
+
+
+def plot_feature_importance(feature_importance_df, path):
+    """ 特徴量の重要度の棒グラフ """
+    plt.figure(figsize=(10, max(5, len(X_COLS) * 0.5))) # 列数に応じて縦幅を調整
+    sns.barplot(x='Importance', y='Feature', data=feature_importance_df)
+    plt.title(f'特徴量の重要度（{Y_COL} の平均値への影響度）')
+    plt.savefig(path)
+    plt.close()
+
+
+def plot_tradeoff(sample_df, pareto_df, path):
+    """ トレードオフの可視化（厳密なパレートフロント + 全体の分布） """
+    plt.figure(figsize=(10, 6))
+    # 全点だと多すぎるため、全体の分布はシミュレーション中に一様に抽出した一部を使う
+    sns.scatterplot(data=sample_df, x='Target_Error', y='Pred_Std', alpha=0.3, label='全体（抽出）')
+    plt.plot(pareto_df['Target_Error'], pareto_df['Pred_Std'], 'r.-', drawstyle='steps-post', label='パレートフロント')
+    plt.legend()
+    plt.title(f'トレードオフ: 目標誤差 vs 予測ばらつき')
+    plt.xlabel(f'目標 {TARGET_VALUE} との誤差')
+    plt.ylabel('予測ばらつき (シグマの代理指標)')
+    plt.grid(True)
+    plt.savefig(path)
+    plt.close()
+
+
+def plot_factor_vs_std(sample_df, feature, path):
+    """ 指定した変数と予測ばらつきの関係 """
+    plt.figure(figsize=(10, 6))
+    sns.scatterplot(data=sample_df, x=feature, y='Pred_Std', alpha=0.5)
+    plt.title(f'要因分析: {feature} vs 予測ばらつき')
+    plt.xlabel(feature)
+    plt.ylabel('予測ばらつき (シグマの代理指標)')
+    plt.grid(True)
+    plt.savefig(path)
+    plt.close()
+
+
+class FigureRenderer:
+    """
+    グラフの描画を（必要なら別プロセスで計算と並行して）行う
+    描画関数には集計済みの小さなデータだけを渡し、描画が終わったものから完了メッセージを表示する
+    """
+
+    def __init__(self, n_workers):
+        self.executor = None
+        if n_workers > 0:
+            self.executor = concurrent.futures.ProcessPoolExecutor(max_workers=n_workers)
+        self.pending = []
+
+    def submit(self, description, func, *args):
+        """ description: 完了時に表示する説明（例: "'1_quality_distribution.png'"） """
+        if self.executor is None:
+            try:
+                func(*args)
+                print(f"グラフ {description} を保存しました。")
+            except Exception as e:
+                print(f"グラフの描画に失敗しました: {e}")
+            return
+        self.pending.append((description, self.executor.submit(func, *args)))
+        self.collect(wait=False)
+
+    def collect(self, wait):
+        """ 描画が終わったグラフの完了メッセージを表示する（wait=True なら全て終わるまで待つ） """
+        remaining = []
+        for description, future in self.pending:
+            if not wait and not future.done():
+                remaining.append((description, future))
+                continue
+            try:
+                future.result()
+                print(f"グラフ {description} を保存しました。")
+            except Exception as e:
+                print(f"グラフの描画に失敗しました: {e}")
+        self.pending = remaining
+
+    def close(self):
+        self.collect(wait=True)
+        if self.executor is not None:
+            self.executor.shutdown()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="分析とシミュレーション")
+    parser.add_argument("--plots", choices=["auto", "full", "binned", "skip"], default=PLOT_MODE,
+                        help="グラフの描画方法")
+    parser.add_argument("--plot-workers", type=int, default=PLOT_WORKERS,
+                        help="グラフを描画するプロセス数 (0 で順番に描画)")
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
     print("--- 分析プログラム開始 ---")
 
     # --- ステップ1: データの読み込みと確認 ---
     print(f"\n[ステップ1: データの読み込みと確認]")
+    profiler.stage("ステップ1: データの読み込みと確認")
     try:
-        df = pd.read_csv(CSV_FILE_PATH)
+        # 必要な列だけを、列指向キャッシュから読み込む（2回目以降はCSVを解析しない）
+        required_cols = X_COLS + [Y_COL]
+        df = read_dataset(CSV_FILE_PATH, columns=required_cols)
     except FileNotFoundError:
         print(f"エラー: ファイル '{CSV_FILE_PATH}' が見つかりません。")
         print("ファイル名が正しいか、スクリプトと同じフォルダにあるか確認してください。")
         sys.exit(1)
+    except KeyError as e:
+        # 必須列の存在チェック
+        print(f"エラー: CSVファイルに必要な列がありません: {e.args[0]}")
+        print("X_COLS と Y_COL の設定を確認してください。")
+        sys.exit(1)
     except Exception as e:
         print(f"エラー: ファイルの読み込みに失敗しました。 {e}")
         sys.exit(1)
-
-    # 必須列の存在チェック
-    required_cols = X_COLS + [Y_COL]
-    missing_cols = [col for col in required_cols if col not in df.columns]
-    if missing_cols:
-        print(f"エラー: CSVファイルに必要な列がありません: {missing_cols}")
-        print("X_COLS と Y_COL の設定を確認してください。")
-        sys.exit(1)
         
     # 設定がデフォルトのままかチェック
     if Y_COL == "Quality" and CSV_FILE_PATH == "your_data.csv":
@@ -77,6 +540,7 @@ def main():
         print("お手元のCSVファイル名と列名に合わせて設定を更新してください。")
 
     print(f"{CSV_FILE_PATH} を読み込みました。")
+    profiler.count("rows_loaded", len(df))
     print("データの先頭5行:")
     print(df.head())
     print("\nデータの基本統計量:")
@@ -85,28 +549,49 @@ def main():
 
     # --- ステップ2: データの可視化（現状把握） ---
     print(f"\n[ステップ2: データの可視化]")
-    try:
-        # 目的変数の分布
-        plt.figure(figsize=(10, 5))
-        sns.histplot(df[Y_COL], kde=True, bins=30)
-        plt.title(f'目的変数 ({Y_COL}) の分布（現状のばらつき）')
-        plt.xlabel(Y_COL)
-        plt.ylabel('頻度')
-        plt.savefig("1_quality_distribution.png")
-        print("グラフ '1_quality_distribution.png' を保存しました。")
-
-        # ペアプロットで全体像を把握
-        plot_df = df[X_COLS + [Y_COL]]
-        sns.pairplot(plot_df)
-        plt.suptitle('変数間の関係（ペアプロット）', y=1.02)
-        plt.savefig("2_pairplot.png")
-        print("グラフ '2_pairplot.png' を保存しました。")
-    except Exception as e:
-        print(f"グラフの描画に失敗しました: {e}")
+    profiler.stage("ステップ2: データの可視化")
+    plot_mode = resolve_plot_mode(args.plots, len(df))
+    # 描画は（PLOT_WORKERS が 1 以上なら）別プロセスで行い、その間に次のステップの計算を進める
+    renderer = None if plot_mode == "skip" else FigureRenderer(args.plot_workers)
+    plot_df = df[X_COLS + [Y_COL]].dropna()
+    if plot_mode == "skip":
+        print("グラフの描画は省略します。")
+    elif plot_mode == "full":
+        # 目的変数の分布と、ペアプロットで全体像を把握
+        renderer.submit("'1_quality_distribution.png'", plot_distribution, df[Y_COL], "1_quality_distribution.png")
+        # ペアプロットは行数が多いと特に時間がかかるため、別に計測する
+        profiler.stage("ステップ2: データの可視化 (ペアプロット)")
+        renderer.submit("'2_pairplot.png'", plot_pairplot, plot_df, "2_pairplot.png")
+    else:
+        print(f"{len(df)} 行を集計して描画します。(ビン数 {PLOT_BINS})")
+        from scipy.stats import gaussian_kde  # scikit-learn の依存ライブラリとして入っている
+
+        # 目的変数の分布: 全行のヒストグラム + 抽出した行から推定した KDE（全行の件数に合わせて拡大）
+        values = plot_df[Y_COL].to_numpy()
+        counts, edges = np.histogram(values, bins=PLOT_BINS)
+        kde_x = np.linspace(edges[0], edges[-1], 200)
+        kde_sample = sample_rows(plot_df, PLOT_SAMPLE_ROWS)[Y_COL].to_numpy()
+        kde_y = gaussian_kde(kde_sample)(kde_x) * len(values) * (edges[1] - edges[0])
+        renderer.submit("'1_quality_distribution.png'", plot_binned_distribution,
+                        counts, edges, kde_x, kde_y, "1_quality_distribution.png")
+
+        # ペアプロットの代わりに、全行を2次元のビンに集計した密度を描く（描画する点の数が行数によらない）
+        profiler.stage("ステップ2: データの可視化 (ペアプロット)")
+        plot_cols = X_COLS + [Y_COL]
+        histograms = {col: np.histogram(plot_df[col].to_numpy(), bins=PLOT_BINS) for col in plot_cols}
+        densities = {}
+        for x_col in plot_cols:
+            for y_col in plot_cols:
+                if x_col != y_col:
+                    densities[(x_col, y_col)] = np.histogram2d(
+                        plot_df[x_col].to_numpy(), plot_df[y_col].to_numpy(),
+                        bins=[histograms[x_col][1], histograms[y_col][1]])
+        renderer.submit("'2_pairplot.png'", plot_binned_pairs, plot_cols, histograms, densities, "2_pairplot.png")
 
 
     # --- ステップ3: 機械学習による「重要要因」の特定 ---
     print(f"\n[ステップ3: 機械学習による「重要要因」の特定]")
+    profiler.stage("ステップ3: 機械学習による「重要要因」の特定")
     
     X = df[X_COLS]
     y = df[Y_COL]
@@ -116,6 +601,7 @@ def main():
     # ランダムフォレストモデルを学習
     model_mean = RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=-1, max_features=1.0)
     model_mean.fit(X_train, y_train)
+    profiler.count("trees_trained", model_mean.n_estimators)
 
     # 予測精度の確認
     y_pred = model_mean.predict(X_test)
@@ -131,107 +617,104 @@ def main():
     print(feature_importance_df)
 
     # 特徴量の重要度をグラフ化
-    plt.figure(figsize=(10, max(5, len(X_COLS) * 0.5))) # 列数に応じて縦幅を調整
-    sns.barplot(x='Importance', y='Feature', data=feature_importance_df)
-    plt.title(f'特徴量の重要度（{Y_COL} の平均値への影響度）')
-    plt.savefig("3_feature_importance.png")
-    print("グラフ '3_feature_importance.png' を保存しました。")
+    if renderer is not None:
+        renderer.submit("'3_feature_importance.png'", plot_feature_importance,
+                        feature_importance_df, "3_feature_importance.png")
 
 
     # --- ステップ4: シミュレーションによる「基準テーブル（候補）」の作成 ---
     print(f"\n[ステップ4: シミュレーションによる「基準テーブル（候補）」の作成]")
+    profiler.stage("ステップ4: シミュレーションによる「基準テーブル（候補）」の作成")
     
     # 各変数の探索範囲（グリッド）を定義
     ranges = [np.linspace(df[col].min(), df[col].max(), GRID_POINTS) for col in X_COLS]
 
-    # グリッド（全組み合わせ）を作成
-    grids = np.meshgrid(*ranges)
-    
-    # グリッドをモデルが予測できる形式（DataFrame）に変換
-    grid_df_data = {col: grid.flatten() for col, grid in zip(X_COLS, grids)}
-    grid_df = pd.DataFrame(grid_df_data)
-
-    n_combinations = len(grid_df)
-    print(f"シミュレーションする総組み合わせ数: {n_combinations} 件")
-    if n_combinations > 100000:
-        print(f"警告: 組み合わせが多すぎます ({n_combinations}件)。")
-        print("GRID_POINTS を小さくするか、X_COLS の変数を減らすことを検討してください。")
-        if n_combinations > 1000000:
-            print("エラー: 組み合わせが100万件を超えました。計算を中止します。")
-            sys.exit(1)
-
-    print("シミュレーションを実行中...（組み合わせが多いと時間がかかります）")
-
-    # --- 全組み合わせに対して予測を実行 ---
-    all_trees = model_mean.estimators_
-    n_trees = len(all_trees)
-    X_grid_values = grid_df.values
-
-    # メモリ効率のため、予測値を保持する配列を直接作成
-    predictions_all_trees = np.zeros((n_combinations, n_trees))
-    
-    for i, tree in enumerate(all_trees):
-        predictions_all_trees[:, i] = tree.predict(X_grid_values)
-
-    # 各組み合わせの「予測平均値」と「予測ばらつき（標準偏差）」を計算
-    grid_df['Pred_Mean'] = np.mean(predictions_all_trees, axis=1)
-    grid_df['Pred_Std'] = np.std(predictions_all_trees, axis=1)
-
-    # 「目標値との誤差」も計算
-    grid_df['Target_Error'] = np.abs(grid_df['Pred_Mean'] - TARGET_VALUE)
-    
-    # スコア（誤差＋ばらつき）
-    grid_df['Score'] = grid_df['Target_Error'] + grid_df['Pred_Std']
+    # 組み合わせの総数（グリッド全体はメモリ上に作らず、チャンクごとに生成する）
+    n_combinations = int(np.prod([len(r) for r in ranges], dtype=object))
+    # 推論エンジン（まとまった点数はツリーごとの predict で計算）で、各組み合わせの
+    # 「予測平均値」と「予測ばらつき（標準偏差）」、「目標値との誤差」、スコア（誤差＋ばらつき）を計算
+    engine = ForestEngine.from_model(model_mean)
+
+    if SIM_MODE == "adaptive":
+        print(f"適応的探索（準乱数 + 絞り込み）でシミュレーションします。(全組み合わせの場合: {n_combinations} 件)")
+        lower = np.array([df[col].min() for col in X_COLS], dtype=np.float64)
+        upper = np.array([df[col].max() for col in X_COLS], dtype=np.float64)
+        result = run_adaptive_search(engine, lower, upper)
+        n_evaluations = result.stats["Score"].count
+        print(f"モデルの評価回数: {n_evaluations} 回 "
+              f"(全組み合わせ {n_combinations} 件の {n_evaluations / n_combinations:.2%})")
+    else:
+        print(f"シミュレーションする総組み合わせ数: {n_combinations} 件")
+        n_chunks = -(-n_combinations // SIM_CHUNK_SIZE)
+        print(f"{SIM_CHUNK_SIZE} 件ずつ {n_chunks} チャンクに分けて、{SIM_WORKERS} プロセスで評価します。")
+
+        print("シミュレーションを実行中...（組み合わせが多いと時間がかかります）")
+
+        # --- 全組み合わせに対して予測を実行 ---
+        result = run_grid_simulation(model_mean, engine, ranges, n_combinations)
+
+    result_columns = X_COLS + SIM_RESULT_COLS
+    best_std_table = pd.DataFrame(result.top_std[:, :-1], columns=result_columns)
+    best_balanced_table = pd.DataFrame(result.top_score[:, :-1], columns=result_columns)
+    pareto_df = pd.DataFrame(result.front[:, :-1], columns=result_columns)
+    sample_df = pd.DataFrame(result.sample[:, :-1], columns=result_columns)
+    profiler.count("model_evaluations", result.stats["Score"].count)
+    profiler.count("tree_evaluations", result.stats["Score"].count * engine.n_trees)
 
     print("シミュレーション完了。")
+    print("\n評価した全組み合わせの集計:")
+    for col in SIM_RESULT_COLS:
+        col_stats = result.stats[col]
+        print(f"  {col:>12}: 平均 {col_stats.mean:.4f}, 標準偏差 {col_stats.std:.4f}, "
+              f"最小 {col_stats.min:.4f}, 最大 {col_stats.max:.4f}")
 
 
     # --- ステップ5: 「基準テーブル（候補）」の抽出 ---
     print(f"\n[ステップ5: 「基準テーブル（候補）」の抽出]")
+    profiler.stage("ステップ5: 「基準テーブル（候補）」の抽出")
 
     # 例1: 「ばらつき（Pred_Std）」が最も小さい条件トップ10
     print(f"\n--- 基準テーブル候補 (ばらつき最小 Top 10) ---")
-    best_std_table = grid_df.sort_values(by='Pred_Std', ascending=True)
     print(best_std_table.head(10))
 
     # 例2: 「目標値 (TARGET_VALUE) に近く」かつ「ばらつきが小さい」条件
-    best_balanced_table = grid_df.sort_values(by='Score', ascending=True)
     print(f"\n--- 基準テーブル候補 (目標値 {TARGET_VALUE} とのバランス Top 10) ---")
     print(best_balanced_table.head(10))
 
-    # 基準テーブル（全シミュレーション結果）をCSVに保存
+    # 例3: 「目標誤差」と「ばらつき」のトレードオフ上で、どちらも改善できない条件（厳密なパレートフロント）
+    # (Score 最小・Pred_Std 最小の条件も必ずこの中に含まれる)
+    print(f"\n--- 基準テーブル候補 (パレート最適な条件 {len(pareto_df)} 件, 目標誤差の小さい順) ---")
+    print(pareto_df.head(10))
+    pareto_csv = "simulation_pareto_front.csv"
+    pareto_df.to_csv(pareto_csv, index=False, encoding='utf-8-sig')
+    print(f"パレート最適な条件を '{pareto_csv}' に保存しました。")
+
+    # 基準テーブル（スコア上位 SIM_TOP_K 件）をCSVに保存
     output_csv = "simulation_results_table.csv"
     best_balanced_table.to_csv(output_csv, index=False, encoding='utf-8-sig')
-    print(f"\nシミュレーション結果全体を '{output_csv}' に保存しました。")
+    print(f"\nシミュレーション結果（スコア上位 {len(best_balanced_table)} 件）を '{output_csv}' に保存しました。")
 
 
     # --- ステップ6: 最適化結果の可視化 ---
     print(f"\n[ステップ6: 最適化結果の可視化]")
-
-    # トレードオフの可視化（パレートフロントの簡易版）
-    plt.figure(figsize=(10, 6))
-    # 全点だと多すぎるため、一部をサンプリング
-    sample_df = grid_df.sample(min(2000, len(grid_df)))
-    sns.scatterplot(data=sample_df, x='Target_Error', y='Pred_Std', alpha=0.5)
-    plt.title(f'トレードオフ: 目標誤差 vs 予測ばらつき')
-    plt.xlabel(f'目標 {TARGET_VALUE} との誤差')
-    plt.ylabel('予測ばらつき (シグマの代理指標)')
-    plt.grid(True)
-    plt.savefig("4_tradeoff_plot.png")
-    print("グラフ '4_tradeoff_plot.png' を保存しました。")
-
-    # ばらつきに影響する要因の可視化
-    # (平均値への重要度が「最も低かった」変数が、ばらつきに影響しているか確認)
-    if not feature_importance_df.empty:
-        least_important_feature = feature_importance_df.iloc[-1]['Feature']
-        plt.figure(figsize=(10, 6))
-        sns.scatterplot(data=sample_df, x=least_important_feature, y='Pred_Std', alpha=0.5)
-        plt.title(f'要因分析: {least_important_feature} vs 予測ばらつき')
-        plt.xlabel(least_important_feature)
-        plt.ylabel('予測ばらつき (シグマの代理指標)')
-        plt.grid(True)
-        plt.savefig("5_factor_vs_std.png")
-        print(f"グラフ '5_factor_vs_std.png' (平均への寄与が最小だった変数とばらつきの関係) を保存しました。")
+    profiler.stage("ステップ6: 最適化結果の可視化")
+
+    if renderer is None:
+        print("グラフの描画は省略します。")
+    else:
+        # トレードオフの可視化（厳密なパレートフロント + 全体の分布）
+        renderer.submit("'4_tradeoff_plot.png'", plot_tradeoff, sample_df, pareto_df, "4_tradeoff_plot.png")
+
+        # ばらつきに影響する要因の可視化
+        # (平均値への重要度が「最も低かった」変数が、ばらつきに影響しているか確認)
+        if not feature_importance_df.empty:
+            least_important_feature = feature_importance_df.iloc[-1]['Feature']
+            renderer.submit("'5_factor_vs_std.png' (平均への寄与が最小だった変数とばらつきの関係)",
+                            plot_factor_vs_std, sample_df, least_important_feature, "5_factor_vs_std.png")
+
+        # 別プロセスで描画中のグラフが全て保存されるまで待つ
+        profiler.stage("グラフの描画待ち")
+        renderer.close()
 
     print("\n--- 分析プログラム終了 ---")
     print("生成されたCSVとPNG画像ファイルを確認してください。")
@@ -0,0 +1,370 @@
+import numpy as np
+import argparse
+import contextlib
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+import warnings
+
+warnings.filterwarnings('ignore')
+
+# ----------------------------------------------------
+# ベンチマーク（合成データによる性能測定）
+# ----------------------------------------------------
+# 実データと同じ列構成（Temp, Pressure, Pattern, Steel_Code, Casting_Speed）の合成データを
+# 乱数シードから決まる形で生成し、各プログラムの処理を同じ条件で計測する。
+#   train     -> trainmodel.py の学習（行数が多い場合はストリーミング学習）
+#   latency   -> 1件予測の所要時間（predict.py と同じ読み込み・変換・推論）
+#   batch     -> predict.py の一括予測のスループット
+#   grid      -> analyze.py のグリッドシミュレーション
+#   optimize  -> optimize_standards.py の鋼種ごとの最適化
+#   shap      -> predictshap.py の SHAP による解説
+# 結果は JSON に保存し、基準（baseline）の結果があれば比較して、遅くなった項目を表示する。
+# (analyze.py 用に Speed / Quality 列も合わせて生成します)
+
+# ----------------------------------------------------
+# ▼ ユーザー設定項目 ▼
+# ----------------------------------------------------
+
+# 1. 計測するデータの行数（--rows で上書き。1万〜1億行）
+BENCH_ROWS = [10000, 100000]
+
+# 2. 合成データの鋼種コード・操業パターンの種類数と、乱数シード
+BENCH_N_STEEL_CODES = 50
+BENCH_N_PATTERNS = 3
+BENCH_SEED = 42
+
+# 3. 合成データと作業ファイルを置くフォルダ（同じ条件のデータは再利用します）
+BENCH_DIR = "benchmark_data"
+# 合成データを一度に生成・書き出す行数
+BENCH_GEN_CHUNK_SIZE = 1000000
+
+# 4. 学習の設定（この行数を超えるデータはストリーミング学習で計測）
+BENCH_N_ESTIMATORS = 100
+BENCH_MEMORY_TRAIN_MAX_ROWS = 2000000
+
+# 5. 各計測の規模
+BENCH_LATENCY_REPEATS = 1000 # 1件予測を繰り返す回数
+BENCH_BATCH_ROWS = 100000 # 一括予測の件数
+BENCH_GRID_POINTS = 40 # グリッドシミュレーションの1変数あたりの点数（3変数なので 3乗の件数）
+BENCH_GRID_TRAIN_ROWS = 100000 # グリッドシミュレーション用モデルの学習に使う最大行数
+BENCH_OPT_CATEGORIES = 3 # 最適化する鋼種の数
+BENCH_OPT_TRIALS = 100 # 鋼種ごとの試行回数
+BENCH_SHAP_ROWS = 20 # SHAP で解説する件数（1件ごとの計算が重いため少なめ）
+
+# 6. 結果の保存先と、比較する基準の結果ファイル
+BENCH_RESULTS_DIR = "benchmark_results"
+BENCH_BASELINE = "benchmark_results/baseline.json"
+# 基準よりこの割合以上悪くなった項目を「性能低下」とする
+BENCH_REGRESSION_TOLERANCE = 0.2
+
+# ----------------------------------------------------
+# ▲ ユーザー設定項目はここまで ▲
+# ----------------------------------------------------
+
+# 計測項目 -> (表示名, 単位, 大きいほど良いか)
+METRICS = {
+    "train_sec": ("学習時間", "秒", False),
+    "model_load_ms": ("モデル読み込み", "ms", False),
+    "latency_p50_us": ("1件予測 (中央値)", "µs", False),
+    "latency_p99_us": ("1件予測 (99%点)", "µs", False),
+    "batch_rows_per_sec": ("一括予測", "件/秒", True),
+    "grid_points_per_sec": ("グリッドシミュレーション", "件/秒", True),
+    "optimize_trials_per_sec": ("鋼種ごとの最適化", "試行/秒", True),
+    "shap_rows_per_sec": ("SHAP 解説", "件/秒", True),
+}
+STAGES = ["train", "latency", "batch", "grid", "optimize", "shap"]
+
+
+def generate_casting_data(path, n_rows, n_steel_codes, n_patterns, seed, chunk_size):
+    """
+    鋳造データと同じ列構成の合成データを CSV に書き出す（メモリ使用量はチャンクの大きさで決まる）
+    鋼種・パターンごとの効果と、温度・圧力への非線形な依存を持たせ、乱数はシードとチャンク番号から決める
+    """
+    import pandas as pd
+
+    effects = np.random.default_rng([seed, 0])
+    code_width = len(str(n_steel_codes - 1))
+    steel_codes = np.array([f"S{i:0{code_width}d}" for i in range(n_steel_codes)])
+    patterns = np.array([f"P{i + 1}" for i in range(n_patterns)])
+    code_effect = effects.normal(0.0, 0.05, n_steel_codes)
+    pattern_effect = effects.normal(0.0, 0.08, n_patterns)
+    code_weights = effects.dirichlet(np.full(n_steel_codes, 2.0)) # 鋼種ごとの行数に偏りを持たせる
+
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8", newline="") as f:
+        for i, start in enumerate(range(0, n_rows, chunk_size)):
+            n = min(chunk_size, n_rows - start)
+            rng = np.random.default_rng([seed, 1, i])
+            temp = np.round(rng.normal(1550.0, 8.0, n), 1)
+            pressure = np.round(rng.uniform(1.5, 3.0, n), 2)
+            code = rng.choice(n_steel_codes, n, p=code_weights)
+            pattern = rng.integers(0, n_patterns, n)
+            speed = (1.35 + 0.006 * (temp - 1550.0) - 0.15 * (pressure - 2.2) ** 2
+                     + code_effect[code] + pattern_effect[pattern] + rng.normal(0.0, 0.05, n))
+            quality = 200.0 - 40.0 * (speed - 1.35) ** 2 - 0.05 * np.abs(temp - 1550.0) + rng.normal(0.0, 2.0, n)
+            pd.DataFrame({
+                "Temp": temp, "Pressure": pressure, "Pattern": patterns[pattern], "Steel_Code": steel_codes[code],
+                "Casting_Speed": speed, "Quality": quality, "Speed": speed,
+            }).to_csv(f, index=False, header=(i == 0))
+    os.replace(tmp_path, path)
+
+
+def dataset_dir(n_rows):
+    """ 行数・種類数・シードごとの作業フォルダ """
+    return os.path.join(BENCH_DIR, f"rows{n_rows}_codes{BENCH_N_STEEL_CODES}_seed{BENCH_SEED}")
+
+
+@contextlib.contextmanager
+def quiet():
+    """ 計測対象のプログラムの進捗表示を止める """
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+        yield
+
+
+def bench_train(work_dir, n_rows):
+    """ trainmodel.py の学習（データの読み込みから保存まで） """
+    import data_cache
+    import trainmodel
+
+    trainmodel.CSV_FILE_PATH = os.path.join(work_dir, "data.csv")
+    trainmodel.MODEL_FILE_NAME = os.path.join(work_dir, "model.joblib")
+    trainmodel.N_ESTIMATORS = BENCH_N_ESTIMATORS
+    # 毎回同じ条件（CSV の解析から）で計るため、列指向キャッシュは作り直す
+    data_cache.DATA_CACHE_DIR = os.path.join(work_dir, ".data_cache")
+    shutil.rmtree(data_cache.DATA_CACHE_DIR, ignore_errors=True)
+
+    streaming = n_rows > BENCH_MEMORY_TRAIN_MAX_ROWS
+    start = time.perf_counter()
+    with quiet():
+        if streaming:
+            trainmodel.train_streaming()
+        else:
+            trainmodel.train_in_memory()
+    return {"train_sec": time.perf_counter() - start, "train_mode": "streaming" if streaming else "memory"}
+
+
+def bench_latency(model_path, orders):
+    """ 1件ずつの予測（モデルの読み込み時間と、変換 + 推論の所要時間の分布） """
+    from model_artifact import load_model
+
+    start = time.perf_counter()
+    model_data = load_model(model_path)
+    load_ms = (time.perf_counter() - start) * 1000
+    engine, encoder = model_data["engine"], model_data["encoder"]
+    cols = model_data["original_cols_numeric"] + model_data["original_cols_categorical"]
+
+    rows = [{col: [orders[col].iloc[i]] for col in cols} for i in range(min(BENCH_LATENCY_REPEATS, len(orders)))]
+    timings = np.empty(len(rows))
+    for i, row in enumerate(rows):
+        start = time.perf_counter()
+        X, _ = encoder.transform(row)
+        engine.predict_mean_std(X)
+        timings[i] = time.perf_counter() - start
+    return {"model_load_ms": load_ms,
+            "latency_p50_us": float(np.percentile(timings, 50) * 1e6),
+            "latency_p99_us": float(np.percentile(timings, 99) * 1e6)}
+
+
+def bench_batch(model_path, orders_path, n_orders):
+    """ predict.py の一括予測（CSV の読み込みから書き出しまで） """
+    import predict
+    from model_artifact import load_model
+
+    model_data = load_model(model_path)
+    start = time.perf_counter()
+    with quiet():
+        predict.predict_batch(model_data["engine"], model_data["encoder"], model_data["original_cols_numeric"],
+                              model_data["original_cols_categorical"], orders_path, os.devnull, "csv",
+                              predict.BATCH_CHUNK_SIZE)
+    return {"batch_rows_per_sec": n_orders / (time.perf_counter() - start)}
+
+
+def bench_grid(work_dir):
+    """ analyze.py のグリッドシミュレーション（モデルの学習は計測に含めない） """
+    import analyze
+    from data_cache import read_dataset
+    from forest_engine import ForestEngine
+    from sklearn.ensemble import RandomForestRegressor
+
+    df = read_dataset(os.path.join(work_dir, "data.csv"), columns=analyze.X_COLS + [analyze.Y_COL])
+    df = df.sample(min(len(df), BENCH_GRID_TRAIN_ROWS), random_state=BENCH_SEED)
+    model = RandomForestRegressor(n_estimators=BENCH_N_ESTIMATORS, random_state=42, n_jobs=-1, max_features=1.0)
+    model.fit(df[analyze.X_COLS].to_numpy(), df[analyze.Y_COL].to_numpy())
+    engine = ForestEngine.from_model(model)
+
+    ranges = [np.linspace(df[col].min(), df[col].max(), BENCH_GRID_POINTS) for col in analyze.X_COLS]
+    n_combinations = BENCH_GRID_POINTS ** len(ranges)
+    start = time.perf_counter()
+    with quiet():
+        analyze.run_grid_simulation(model, engine, ranges, n_combinations)
+    return {"grid_points_per_sec": n_combinations / (time.perf_counter() - start)}
+
+
+def bench_optimize(model_path):
+    """ optimize_standards.py の鋼種ごとの最適化（途中経過の保存なし） """
+    import optimize_standards as opt
+    from model_artifact import load_model
+
+    opt.g_model_data = load_model(model_path)
+    opt.g_engine = opt.g_model_data["engine"]
+    opt.g_encoder = opt.g_model_data["encoder"]
+    opt.g_cache = opt.make_cache(opt.g_engine)
+    opt.STUDY_STORAGE = None
+    opt.N_TRIALS_PER_CATEGORY = BENCH_OPT_TRIALS
+    categories = opt.g_model_data["param_ranges"][opt.MAIN_CATEGORY_COL]["values"][:BENCH_OPT_CATEGORIES]
+
+    start = time.perf_counter()
+    for category_value in categories:
+        opt.optimize_category(category_value)
+    return {"optimize_trials_per_sec": len(categories) * BENCH_OPT_TRIALS / (time.perf_counter() - start)}
+
+
+def bench_shap(model_path, orders):
+    """ predictshap.py の SHAP による解説（Explainer の初期化は計測に含めない） """
+    import joblib
+    import predictshap
+
+    model_data = joblib.load(model_path)
+    predictshap.init_explainer(model_data)
+    X, _ = model_data["encoder"].transform(orders.iloc[:BENCH_SHAP_ROWS])
+    start = time.perf_counter()
+    predictshap.explain_rows(X)
+    return {"shap_rows_per_sec": len(X) / (time.perf_counter() - start)}
+
+
+def run_size(n_rows, stages):
+    """ 1つのデータ量について、合成データを用意して各項目を計測する """
+    import pandas as pd
+
+    work_dir = dataset_dir(n_rows)
+    os.makedirs(work_dir, exist_ok=True)
+    data_path = os.path.join(work_dir, "data.csv")
+    orders_path = os.path.join(work_dir, "orders.csv")
+    model_path = os.path.join(work_dir, "model.joblib")
+
+    if not os.path.exists(data_path):
+        print(f"  合成データ ({n_rows} 行) を生成中...")
+        generate_casting_data(data_path, n_rows, BENCH_N_STEEL_CODES, BENCH_N_PATTERNS, BENCH_SEED,
+                              BENCH_GEN_CHUNK_SIZE)
+    n_orders = BENCH_BATCH_ROWS
+    if not os.path.exists(orders_path):
+        # 操業命令は学習データとは別のシードで生成する
+        generate_casting_data(orders_path, n_orders, BENCH_N_STEEL_CODES, BENCH_N_PATTERNS, BENCH_SEED + 1,
+                              BENCH_GEN_CHUNK_SIZE)
+    orders = pd.read_csv(orders_path, nrows=max(BENCH_LATENCY_REPEATS, BENCH_SHAP_ROWS),
+                         dtype={"Pattern": str, "Steel_Code": str})
+
+    result = {"n_rows": n_rows}
+    # 学習以外の計測にはモデルが必要なため、学習を省略してもモデルがなければ学習する
+    if "train" in stages or not os.path.exists(model_path):
+        result.update(bench_train(work_dir, n_rows))
+        print(f"  学習: {result['train_sec']:.2f} 秒 ({result['train_mode']})")
+    if "latency" in stages:
+        result.update(bench_latency(model_path, orders))
+        print(f"  1件予測: 中央値 {result['latency_p50_us']:.0f} µs, 99%点 {result['latency_p99_us']:.0f} µs"
+              f" (モデル読み込み {result['model_load_ms']:.1f} ms)")
+    if "batch" in stages:
+        result.update(bench_batch(model_path, orders_path, n_orders))
+        print(f"  一括予測: {result['batch_rows_per_sec']:.0f} 件/秒")
+    if "grid" in stages:
+        result.update(bench_grid(work_dir))
+        print(f"  グリッドシミュレーション: {result['grid_points_per_sec']:.0f} 件/秒")
+    if "optimize" in stages:
+        result.update(bench_optimize(model_path))
+        print(f"  最適化: {result['optimize_trials_per_sec']:.0f} 試行/秒")
+    if "shap" in stages:
+        result.update(bench_shap(model_path, orders))
+        print(f"  SHAP 解説: {result['shap_rows_per_sec']:.1f} 件/秒")
+    return result
+
+
+def environment_info():
+    """ 結果を比べるときに確認する実行環境の情報 """
+    import sklearn
+
+    return {"python": platform.python_version(), "numpy": np.__version__, "sklearn": sklearn.__version__,
+            "platform": platform.platform(), "cpu_count": os.cpu_count()}
+
+
+def compare_results(current, baseline):
+    """ 基準の結果と比べ、性能低下した項目のリストを返す（同じ行数の結果どうしで比べる） """
+    regressions = []
+    baseline_by_rows = {r["n_rows"]: r for r in baseline["results"]}
+    print(f"\n  {'行数':>10}  {'項目':<22} {'基準':>12} {'今回':>12} {'変化':>8}")
+    for result in current["results"]:
+        base = baseline_by_rows.get(result["n_rows"])
+        if base is None:
+            continue
+        for key, (label, unit, higher_is_better) in METRICS.items():
+            if key not in result or key not in base:
+                continue
+            ratio = result[key] / base[key] if base[key] else np.nan
+            # 「良くなった」方向を正として変化率を表示する
+            change = ratio - 1.0 if higher_is_better else 1.0 - ratio
+            mark = ""
+            if change < -BENCH_REGRESSION_TOLERANCE:
+                mark = " <- 性能低下"
+                regressions.append((result["n_rows"], key))
+            print(f"  {result['n_rows']:>10}  {label:<22} {base[key]:>12.4g} {result[key]:>12.4g}"
+                  f" {change:>+8.1%}{mark}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="合成データによるベンチマーク")
+    parser.add_argument("--rows", type=int, nargs="+", default=BENCH_ROWS, help="計測するデータの行数")
+    parser.add_argument("--skip", nargs="+", choices=STAGES, default=[], help="計測しない項目")
+    parser.add_argument("--output", help="結果の JSON ファイル (省略時は結果フォルダに日時つきで保存)")
+    parser.add_argument("--baseline", default=BENCH_BASELINE, help="比較する基準の結果ファイル")
+    parser.add_argument("--save-baseline", action="store_true", help="今回の結果を基準として保存する")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    stages = [stage for stage in STAGES if stage not in args.skip]
+
+    print("--- ベンチマーク開始 ---")
+    print(f"  行数: {args.rows}, 鋼種コード: {BENCH_N_STEEL_CODES} 種類, シード: {BENCH_SEED}")
+    print(f"  計測項目: {stages}")
+
+    results = []
+    for n_rows in args.rows:
+        print(f"\n[{n_rows} 行]")
+        results.append(run_size(n_rows, stages))
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "environment": environment_info(),
+        "settings": {key: value for key, value in globals().items() if key.startswith("BENCH_")},
+        "results": results,
+    }
+
+    os.makedirs(BENCH_RESULTS_DIR, exist_ok=True)
+    output_path = args.output or os.path.join(BENCH_RESULTS_DIR, time.strftime("benchmark_%Y%m%d_%H%M%S.json"))
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n結果を '{output_path}' に保存しました。")
+
+    if args.save_baseline:
+        shutil.copyfile(output_path, args.baseline)
+        print(f"基準の結果として '{args.baseline}' に保存しました。")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\n[基準 '{args.baseline}' ({baseline['created_at']}) との比較]")
+        regressions = compare_results(report, baseline)
+        if regressions:
+            print(f"エラー: 基準より {BENCH_REGRESSION_TOLERANCE:.0%} 以上遅くなった項目があります: {regressions}")
+            sys.exit(1)
+        print("性能低下はありません。")
+
+    print("\n--- ベンチマーク終了 ---")
+
+
+if __name__ == "__main__":
+    main()
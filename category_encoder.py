@@ -0,0 +1,123 @@
+import numpy as np
+
+# ----------------------------------------------------
+# カテゴリ変数エンコーダー（ダミー変数化の事前コンパイル版）
+# ----------------------------------------------------
+# 学習時に `pd.get_dummies` で作られた列構成（model_columns）に合わせて、
+# 「カテゴリ値 → 列番号」の対応表を事前に作っておき、
+# 1行でもバッチでも、確保済みの NumPy 配列へ直接書き込む。
+# 学習時に存在しなかったカテゴリ値は「未知」として明示的に数える。
+
+
+class CategoryEncoder:
+    """ 操業命令を学習時と同じ列構成の数値行列に変換する """
+
+    def __init__(self, model_columns, numeric_cols, categorical_cols, categories, handle_unknown="ignore"):
+        """
+        categories: {カテゴリ列名: 学習時に出現した値のリスト}
+        handle_unknown: 未知のカテゴリ値の扱い
+            "ignore" -> 全ダミー列を 0 のまま（件数は unknown_counts に記録）
+            "error"  -> ValueError を送出
+        """
+        self.model_columns = list(model_columns)
+        self.numeric_cols = list(numeric_cols)
+        self.categorical_cols = list(categorical_cols)
+        self.handle_unknown = handle_unknown
+
+        column_index = {col: i for i, col in enumerate(self.model_columns)}
+        self.numeric_index = [column_index[col] for col in self.numeric_cols]
+
+        # カテゴリ列ごとに「値（文字列）のソート済み配列」と「対応する列番号」を持つ
+        # (np.searchsorted で一括検索できるようにするため)
+        self.category_keys = {}
+        self.category_index = {}
+        for col in self.categorical_cols:
+            pairs = sorted(
+                (str(value), column_index[f"{col}_{value}"])
+                for value in categories[col]
+                if f"{col}_{value}" in column_index
+            )
+            self.category_keys[col] = np.array([key for key, _ in pairs], dtype=str)
+            self.category_index[col] = np.array([index for _, index in pairs], dtype=np.intp)
+
+        self.reset_counts()
+
+    @property
+    def n_columns(self):
+        return len(self.model_columns)
+
+    @classmethod
+    def fit(cls, df, model_columns, numeric_cols, categorical_cols):
+        """ 学習データから、各カテゴリ列に出現した値を記録して作る """
+        categories = {col: df[col].dropna().unique().tolist() for col in categorical_cols}
+        return cls(model_columns, numeric_cols, categorical_cols, categories)
+
+    @classmethod
+    def from_model_data(cls, model_data):
+        """ モデルファイルの辞書から取り出す（古いモデルファイルは列名から復元する） """
+        if "encoder" in model_data:
+            return model_data["encoder"]
+
+        model_columns = model_data["model_columns"]
+        categorical_cols = model_data["original_cols_categorical"]
+        categories = {col: [] for col in categorical_cols}
+        for column in model_columns:
+            # 接頭辞が最も長く一致するカテゴリ列に割り当てる（"Pattern" と "Pattern_X" の混同を防ぐ）
+            owners = [col for col in categorical_cols if column.startswith(f"{col}_")]
+            if owners:
+                owner = max(owners, key=len)
+                categories[owner].append(column[len(owner) + 1:])
+        return cls(model_columns, model_data["original_cols_numeric"], categorical_cols, categories)
+
+    def aggregation_matrix(self):
+        """
+        ダミー変数ごとの値（SHAP値など）を、元の特徴量（数値列 + カテゴリ列の順）ごとに合計する行列
+        (n_columns, 元の特徴量の数) の 0/1 行列で、`values @ 行列` で一括集約できる
+        (列名の前方一致ではなく列番号で対応づけるため、名前の似た特徴量を取り違えない)
+        """
+        n_numeric = len(self.numeric_cols)
+        matrix = np.zeros((self.n_columns, n_numeric + len(self.categorical_cols)), dtype=np.float64)
+        matrix[self.numeric_index, np.arange(n_numeric)] = 1.0
+        for k, col in enumerate(self.categorical_cols, start=n_numeric):
+            matrix[self.category_index[col], k] = 1.0
+        return matrix
+
+    def reset_counts(self):
+        """ 未知カテゴリの集計をリセットする """
+        self.unknown_counts = {col: 0 for col in self.categorical_cols}
+
+    def transform(self, data):
+        """
+        data: 列名 -> 値の配列 を持つ辞書または DataFrame
+        戻り値: (X, unknown)
+            X       -> (n_rows, n_columns) の float64 行列
+            unknown -> 未知のカテゴリ値を含む行を示す bool 配列
+        """
+        n_rows = len(data[self.numeric_cols[0]] if self.numeric_cols else data[self.categorical_cols[0]])
+        X = np.zeros((n_rows, self.n_columns), dtype=np.float64)
+        unknown = np.zeros(n_rows, dtype=bool)
+        rows = np.arange(n_rows)
+
+        for col, index in zip(self.numeric_cols, self.numeric_index):
+            X[:, index] = np.asarray(data[col], dtype=np.float64)
+
+        for col in self.categorical_cols:
+            keys = self.category_keys[col]
+            values = np.asarray(data[col]).astype(str)
+            if len(keys):
+                pos = np.minimum(np.searchsorted(keys, values), len(keys) - 1)
+                found = keys[pos] == values
+            else:
+                pos = np.zeros(n_rows, dtype=np.intp)
+                found = np.zeros(n_rows, dtype=bool)
+
+            n_unknown = int(n_rows - found.sum())
+            if n_unknown:
+                if self.handle_unknown == "error":
+                    raise ValueError(f"'{col}' に学習時に存在しない値があります: {sorted(set(values[~found]))[:5]}")
+                self.unknown_counts[col] += n_unknown
+                unknown |= ~found
+
+            X[rows[found], self.category_index[col][pos[found]]] = 1.0
+
+        return X, unknown
@@ -0,0 +1,129 @@
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+
+# ----------------------------------------------------
+# 統合コマンド（起動の速いエントリーポイント）
+# ----------------------------------------------------
+# 使い方: python cli.py <サブコマンド> [各プログラムの引数...]
+#   train     -> trainmodel.py           （モデルの学習）
+#   update    -> update_model.py         （新しい操業データによるモデルの差分更新）
+#   predict   -> predict.py              （鋳造速度の予測。--compact ならコンパクト形式のモデルと NumPy だけで動く）
+#   explain   -> predictshap.py          （SHAP による予測の解説）
+#   optimize  -> optimize_standards.py   （最適基準テーブルの作成）
+#   table     -> response_table.py       （予測値の応答曲面テーブルの作成。predict が自動的に使う）
+#   simulate  -> analyze.py              （分析とシミュレーション）
+#   bench     -> benchmark.py            （合成データによるベンチマーク）
+#   startup   -> 各サブコマンドの起動時間と、読み込まれた重いライブラリの一覧
+# サブコマンドが使うモジュールだけを、選ばれたときに初めて読み込む。
+# (このファイル自体は標準ライブラリしか読み込まない)
+
+# ----------------------------------------------------
+# ▼ ユーザー設定項目 ▼
+# ----------------------------------------------------
+
+# 1. 起動時間の上限（ミリ秒）。startup で超えたサブコマンドがあれば終了コード 1 で終わる
+STARTUP_BUDGET_MS = {"predict": 500}
+
+# 2. サブコマンドごとに「読み込まれてはいけない」ライブラリ
+# (予測の起動が遅くならないよう、重いライブラリが紛れ込んだら startup で検出する)
+FORBIDDEN_IMPORTS = {"predict": ["pandas", "sklearn", "scipy", "joblib", "shap", "matplotlib", "optuna"]}
+
+# ----------------------------------------------------
+# ▲ ユーザー設定項目はここまで ▲
+# ----------------------------------------------------
+
+# サブコマンド -> (モジュール名, 説明)
+SUBCOMMANDS = {
+    "train": ("trainmodel", "モデルを学習する"),
+    "update": ("update_model", "新しい操業データでモデルを差分更新する"),
+    "predict": ("predict", "鋳造速度を予測する"),
+    "explain": ("predictshap", "予測の根拠を SHAP で解説する"),
+    "optimize": ("optimize_standards", "鋼種ごとの最適基準テーブルを作る"),
+    "table": ("response_table", "予測値の応答曲面テーブルを作る"),
+    "simulate": ("analyze", "分析とグリッドシミュレーションを行う"),
+    "bench": ("benchmark", "合成データで各処理の性能を計測する"),
+}
+
+# startup で読み込みの有無を報告するライブラリ
+HEAVY_MODULES = ["numpy", "pandas", "sklearn", "scipy", "joblib", "shap", "matplotlib", "seaborn", "optuna"]
+
+
+def print_usage():
+    print("使い方: python cli.py <サブコマンド> [引数...]")
+    for name, (module_name, description) in SUBCOMMANDS.items():
+        print(f"  {name:<9} {description} ({module_name}.py)")
+    print(f"  {'startup':<9} 各サブコマンドの起動時間を計測する")
+
+
+def measure_import(command):
+    """ サブコマンドのモジュールを読み込む時間と、読み込まれた重いライブラリを返す（子プロセスで実行） """
+    start = time.perf_counter()
+    importlib.import_module(SUBCOMMANDS[command][0])
+    import_ms = (time.perf_counter() - start) * 1000
+    return {"import_ms": import_ms, "modules": [name for name in HEAVY_MODULES if name in sys.modules]}
+
+
+def startup_report():
+    """ 各サブコマンドを新しいプロセスで読み込み、起動時間と読み込まれたライブラリを表示する """
+    print("--- 起動時間の計測 ---")
+    here = os.path.dirname(os.path.abspath(__file__))
+    failures = []
+
+    for command in SUBCOMMANDS:
+        # インタプリタ自体の起動も含めた時間を測るため、子プロセスの開始から終了までを計る
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-c", f"import json, cli; print(json.dumps(cli.measure_import({command!r})))"],
+            cwd=here, capture_output=True, text=True,
+        )
+        total_ms = (time.perf_counter() - start) * 1000
+        if result.returncode != 0:
+            print(f"  {command:<9} 読み込みに失敗しました: {result.stderr.strip().splitlines()[-1:]}")
+            failures.append(command)
+            continue
+
+        measured = json.loads(result.stdout.strip().splitlines()[-1])
+        print(f"  {command:<9} 読み込み {measured['import_ms']:7.1f} ms / プロセス全体 {total_ms:7.1f} ms"
+              f"  [{', '.join(measured['modules'])}]")
+
+        budget = STARTUP_BUDGET_MS.get(command)
+        if budget is not None and total_ms > budget:
+            print(f"    -> 上限 {budget} ms を超えています。")
+            failures.append(command)
+        forbidden = [name for name in FORBIDDEN_IMPORTS.get(command, []) if name in measured["modules"]]
+        if forbidden:
+            print(f"    -> 読み込まれてはいけないライブラリが読み込まれています: {forbidden}")
+            failures.append(command)
+
+    if failures:
+        print(f"エラー: 起動時間の確認に失敗したサブコマンドがあります: {sorted(set(failures))}")
+        sys.exit(1)
+    print("全てのサブコマンドが確認を通過しました。")
+
+
+def main():
+    if len(sys.argv) < 2 or sys.argv[1] in ("-h", "--help"):
+        print_usage()
+        return
+    command = sys.argv[1]
+
+    if command == "startup":
+        startup_report()
+        return
+    if command not in SUBCOMMANDS:
+        print(f"エラー: サブコマンド '{command}' は存在しません。")
+        print_usage()
+        sys.exit(1)
+
+    # 選ばれたサブコマンドのモジュールだけを読み込み、残りの引数をそのまま渡す
+    module = importlib.import_module(SUBCOMMANDS[command][0])
+    sys.argv = [f"{sys.argv[0]} {command}"] + sys.argv[2:]
+    module.main()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import hashlib
+import json
+import operator
+import os
+
+import numpy as np
+import pandas as pd
+
+# ----------------------------------------------------
+# 元データ（CSV）の列指向キャッシュ
+# ----------------------------------------------------
+# 初回だけ CSV を読み込み、型付きの列指向ファイルとして保存しておく。
+# 2回目以降は CSV を解析せず、必要な列・必要な行だけを読み込む。
+# (pyarrow があれば Parquet、なければ列ごとの .npy ファイルをメモリマップで読む)
+
+# ----------------------------------------------------
+# ▼ ユーザー設定項目 ▼
+# ----------------------------------------------------
+
+# 1. キャッシュを置くフォルダ
+DATA_CACHE_DIR = ".data_cache"
+
+# 2. CSV が更新されたかの判定方法
+# "mtime" -> ファイルサイズと更新日時（高速）
+# "hash"  -> ファイル内容のハッシュ値（確実だが、毎回ファイル全体を読む）
+DATA_CACHE_KEY = "mtime"
+
+# ----------------------------------------------------
+# ▲ ユーザー設定項目はここまで ▲
+# ----------------------------------------------------
+
+# 行の絞り込み条件で使える演算子（pyarrow の filters と同じ書式）
+FILTER_OPERATORS = {
+    "==": operator.eq, "=": operator.eq, "!=": operator.ne,
+    "<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge,
+    "in": lambda values, items: np.isin(values, list(items)),
+    "not in": lambda values, items: ~np.isin(values, list(items)),
+}
+
+
+def has_pyarrow():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def source_key(csv_path):
+    """ CSV の「版」を表す文字列（これが変わったらキャッシュを作り直す） """
+    if DATA_CACHE_KEY == "hash":
+        h = hashlib.sha256()
+        with open(csv_path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return f"sha256:{h.hexdigest()}"
+    st = os.stat(csv_path)
+    return f"mtime:{st.st_size}:{st.st_mtime_ns}"
+
+
+def cache_paths(csv_path):
+    name = os.path.basename(os.path.abspath(csv_path))
+    base = os.path.join(DATA_CACHE_DIR, name)
+    return base + ".meta.json", base + ".parquet", base + ".npy.d"
+
+
+def build_cache(csv_path, key):
+    """ CSV を読み込み、文字列の列をカテゴリ型にしてキャッシュに保存する """
+    meta_path, parquet_path, npy_dir = cache_paths(csv_path)
+    os.makedirs(DATA_CACHE_DIR, exist_ok=True)
+
+    df = pd.read_csv(csv_path)
+    categorical_cols = [col for col in df.columns
+                        if pd.api.types.is_object_dtype(df[col]) or pd.api.types.is_string_dtype(df[col])]
+    for col in categorical_cols:
+        df[col] = df[col].astype("category")
+
+    meta = {"key": key, "columns": list(df.columns), "categorical": categorical_cols, "n_rows": len(df)}
+    if has_pyarrow():
+        df.to_parquet(parquet_path, index=False)
+        meta["format"] = "parquet"
+    else:
+        os.makedirs(npy_dir, exist_ok=True)
+        meta["format"] = "npy"
+        meta["categories"] = {}
+        for i, col in enumerate(df.columns):
+            if col in categorical_cols:
+                values = df[col].cat.codes.to_numpy()
+                meta["categories"][col] = [str(c) for c in df[col].cat.categories]
+            else:
+                values = df[col].to_numpy()
+            np.save(os.path.join(npy_dir, f"{i}.npy"), values)
+
+    # メタ情報は最後に書く（途中で中断しても、壊れたキャッシュを使わないようにする）
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return meta
+
+
+def load_meta(csv_path):
+    """ 最新のキャッシュのメタ情報を返す（なければ作る） """
+    if not os.path.exists(csv_path):
+        raise FileNotFoundError(csv_path)
+
+    meta_path, _, _ = cache_paths(csv_path)
+    key = source_key(csv_path)
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("key") == key and (meta.get("format") != "parquet" or has_pyarrow()):
+            return meta
+    print(f"  '{csv_path}' の列指向キャッシュを作成しています（CSVが更新されたときだけ行います）...")
+    return build_cache(csv_path, key)
+
+
+def read_dataset(csv_path, columns=None, filters=None):
+    """
+    CSV の内容を、キャッシュから DataFrame として読み込む
+    columns: 読み込む列名のリスト（None なら全列）。存在しない列があれば KeyError（列名のリスト）
+    filters: 行の絞り込み条件のリスト 例: [("quality_score", ">", 0.8)]（全条件の AND）
+    """
+    meta = load_meta(csv_path)
+    columns = list(meta["columns"]) if columns is None else list(columns)
+    filters = list(filters or [])
+
+    missing_cols = [col for col in columns + [f[0] for f in filters] if col not in meta["columns"]]
+    if missing_cols:
+        raise KeyError(missing_cols)
+    read_cols = columns + [f[0] for f in filters if f[0] not in columns]
+
+    _, parquet_path, npy_dir = cache_paths(csv_path)
+    if meta["format"] == "parquet":
+        import pyarrow.parquet as pq
+        table = pq.read_table(parquet_path, columns=read_cols, filters=filters or None)
+        df = table.to_pandas()
+    else:
+        data = {}
+        mask = np.ones(meta["n_rows"], dtype=bool)
+        for col in read_cols:
+            values = np.load(os.path.join(npy_dir, f"{meta['columns'].index(col)}.npy"), mmap_mode="r")
+            if col in meta["categorical"]:
+                values = pd.Categorical.from_codes(values, categories=meta["categories"][col])
+            data[col] = values
+        for col, op, value in filters:
+            mask &= np.asarray(FILTER_OPERATORS[op](np.asarray(data[col]), value))
+        df = pd.DataFrame({col: np.asarray(values)[mask] if col not in meta["categorical"] else values[mask]
+                           for col, values in data.items()})
+
+    df = df[columns]
+    # 絞り込みで出現しなくなったカテゴリは除く（ダミー変数化で空の列が作られないようにする）
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].cat.remove_unused_categories()
+    return df.reset_index(drop=True)
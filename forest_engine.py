@@ -0,0 +1,276 @@
+import json
+import os
+
+import numpy as np
+
+# ----------------------------------------------------
+# ランダムフォレスト 一括推論エンジン
+# ----------------------------------------------------
+# 学習済み RandomForestRegressor の全ツリーのノードを1組のフラット配列に詰め、
+# 「入力行 × ツリー」を同時に辿ることで、各行の予測平均とシグマを
+# 1回のベクトル演算で求める。
+# (従来の `[tree.predict(X_input)[0] for tree in all_trees]` と同じ値を返す)
+# scikit-learn のモデルから作った場合、まとまった行数の予測はツリーごとの predict に任せる
+# (深いツリーを NumPy で1段ずつ辿るより、C言語の実装のほうが速いため)
+
+# save_compact() で書き出す1ファイル形式の識別子と版
+COMPACT_MAGIC = b"RFENGINE"
+COMPACT_VERSION = 1
+# 各配列の先頭位置をそろえる境界（バイト）
+COMPACT_ALIGN = 64
+
+# scikit-learn のモデルから作ったエンジンで、この行数以上をまとめて予測するときは
+# ツリーごとの predict（C言語の実装）を使う（深いツリーでは、数十行を超えるとそちらが速い）
+SKLEARN_MIN_ROWS = 32
+
+
+class ForestEngine:
+    """ 全ツリーのノード配列をまとめて保持し、バッチ単位で予測する """
+
+    # save() / load() で書き出すノード配列の名前
+    ARRAY_NAMES = ("feature", "threshold", "left", "right", "value", "missing_left", "roots")
+
+    def __init__(self, feature, threshold, left, right, value, missing_left, roots, max_depth, estimators=None):
+        self.feature = feature            # 各ノードの分割特徴量の列番号 (葉は 0)
+        self.threshold = threshold        # 各ノードのしきい値 (float64)
+        self.left = left                  # 左の子ノード番号 (葉は自分自身)
+        self.right = right                # 右の子ノード番号 (葉は自分自身)
+        self.value = value                # 各ノードの予測値 (葉の値を使う)
+        self.missing_left = missing_left  # 欠損値(NaN)を左に送るかどうか
+        self.roots = roots                # 各ツリーの根ノード番号
+        self.max_depth = int(max_depth)   # 全ツリー中の最大の深さ（辿る回数）
+        self.estimators = estimators      # scikit-learn のツリーのリスト (from_model で作った場合のみ)
+        self.has_missing = bool(np.any(missing_left))
+        self._split_points = None
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @classmethod
+    def from_model(cls, model):
+        """ 学習済み RandomForestRegressor からエンジンを作る """
+        features, thresholds, lefts, rights, values, missing = [], [], [], [], [], []
+        roots = []
+        max_depth = 0
+        offset = 0
+
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            n_nodes = tree.node_count
+            node_ids = np.arange(n_nodes)
+            is_leaf = tree.children_left == -1
+
+            # 葉は「自分自身に遷移する」ようにしておくと、
+            # 深さの違うツリーも同じ回数だけ辿れば全て葉に到達する
+            lefts.append(np.where(is_leaf, node_ids, tree.children_left) + offset)
+            rights.append(np.where(is_leaf, node_ids, tree.children_right) + offset)
+            features.append(np.where(is_leaf, 0, tree.feature))
+            thresholds.append(tree.threshold)
+            values.append(tree.value[:, 0, 0])
+            if hasattr(tree, "missing_go_to_left"):
+                missing.append(tree.missing_go_to_left.astype(bool))
+            else:
+                missing.append(np.zeros(n_nodes, dtype=bool))
+
+            roots.append(offset)
+            max_depth = max(max_depth, tree.max_depth)
+            offset += n_nodes
+
+        return cls(
+            feature=np.concatenate(features).astype(np.intp),
+            threshold=np.concatenate(thresholds).astype(np.float64),
+            left=np.concatenate(lefts).astype(np.intp),
+            right=np.concatenate(rights).astype(np.intp),
+            value=np.concatenate(values).astype(np.float64),
+            missing_left=np.concatenate(missing),
+            roots=np.asarray(roots, dtype=np.intp),
+            max_depth=max_depth,
+            estimators=list(model.estimators_),
+        )
+
+    def save(self, directory):
+        """ ノード配列を .npy ファイルとしてディレクトリに書き出す """
+        os.makedirs(directory, exist_ok=True)
+        for name in self.ARRAY_NAMES:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+        np.save(os.path.join(directory, "max_depth.npy"), np.int64(self.max_depth))
+
+    @classmethod
+    def load(cls, directory, mmap_mode="r"):
+        """
+        save() で書き出したノード配列を読み込む
+        mmap_mode="r" ではメモリマップで開くため、複数プロセスから読み込んでも
+        OSのページキャッシュ上の1つのコピーを共有する（読み取り専用）
+        directory がファイルの場合は save_compact() の形式として開く
+        """
+        if os.path.isfile(directory):
+            return cls.load_compact(directory)[0]
+        arrays = {name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode=mmap_mode)
+                  for name in cls.ARRAY_NAMES}
+        max_depth = int(np.load(os.path.join(directory, "max_depth.npy")))
+        return cls(max_depth=max_depth, **arrays)
+
+    def save_compact(self, path, metadata=None):
+        """
+        ノード配列を、メモリマップで直接読める1つのファイルに書き出す
+        - しきい値と予測値は float32、ノード番号・列番号は必要最小の幅の整数
+        - 先頭に配列の位置と型を記した小さなヘッダ（JSON）と、任意のメタ情報を置く
+        しきい値は float32 に切り下げて丸めるため、float32 の入力に対する分岐は元のツリーと一致する
+        （予測値は float32 の精度に丸められる）
+        """
+        threshold = self.threshold.astype(np.float32)
+        rounded_up = threshold.astype(np.float64) > self.threshold
+        threshold[rounded_up] = np.nextafter(threshold[rounded_up], np.float32(-np.inf))
+
+        node_dtype = np.min_scalar_type(max(len(self.left) - 1, 0))
+        arrays = {
+            "feature": self.feature.astype(np.min_scalar_type(max(int(self.feature.max()), 0))),
+            "threshold": threshold,
+            "left": self.left.astype(node_dtype),
+            "right": self.right.astype(node_dtype),
+            "value": self.value.astype(np.float32),
+            "missing_left": self.missing_left.astype(bool),
+            "roots": self.roots.astype(node_dtype),
+        }
+
+        layout = {}
+        offset = 0
+        for name in self.ARRAY_NAMES:
+            array = np.ascontiguousarray(arrays[name])
+            layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset += -(-array.nbytes // COMPACT_ALIGN) * COMPACT_ALIGN
+        header = json.dumps({
+            "version": COMPACT_VERSION,
+            "max_depth": self.max_depth,
+            "arrays": layout,
+            "metadata": metadata or {},
+        }, ensure_ascii=False).encode("utf-8")
+
+        # 書き込み途中のファイルを読まれないよう、一時ファイルに書いてから置き換える
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(COMPACT_MAGIC + np.uint64(len(header)).tobytes() + header)
+            f.write(b"\0" * (-f.tell() % COMPACT_ALIGN))
+            data_start = f.tell()
+            for name in self.ARRAY_NAMES:
+                f.write(b"\0" * (data_start + layout[name]["offset"] - f.tell()))
+                f.write(np.ascontiguousarray(arrays[name]).tobytes())
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def read_compact_header(path):
+        """ save_compact() のファイルのヘッダ（JSON）と、配列データの開始位置を返す """
+        with open(path, "rb") as f:
+            if f.read(len(COMPACT_MAGIC)) != COMPACT_MAGIC:
+                raise ValueError(f"'{path}' はコンパクト形式のモデルファイルではありません")
+            header_len = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            header = json.loads(f.read(header_len).decode("utf-8"))
+        if header.get("version") != COMPACT_VERSION:
+            raise ValueError(f"'{path}' の形式の版 ({header.get('version')}) には対応していません")
+        data_start = -(-(len(COMPACT_MAGIC) + 8 + header_len) // COMPACT_ALIGN) * COMPACT_ALIGN
+        return header, data_start
+
+    @classmethod
+    def load_compact(cls, path):
+        """
+        save_compact() のファイルをメモリマップで開く（ファイル全体は読み込まない）
+        戻り値: (エンジン, メタ情報の辞書)
+        """
+        header, data_start = cls.read_compact_header(path)
+        buffer = np.memmap(path, dtype=np.uint8, mode="r")
+        arrays = {}
+        for name, info in header["arrays"].items():
+            dtype = np.dtype(info["dtype"])
+            start = data_start + info["offset"]
+            n_bytes = int(np.prod(info["shape"], dtype=np.int64)) * dtype.itemsize
+            arrays[name] = buffer[start:start + n_bytes].view(dtype).reshape(info["shape"])
+        return cls(max_depth=header["max_depth"], **arrays), header["metadata"]
+
+    def apply(self, X):
+        """ 各行が各ツリーで到達する葉ノード番号 (n_rows, n_trees) を返す """
+        # scikit-learn のツリーは入力を float32 に変換してから比較するため、それに合わせる
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+
+        node = np.broadcast_to(self.roots, (X.shape[0], self.n_trees)).ravel().copy()
+
+        # まだ葉に着いていない (行, ツリー) の組だけを辿る
+        # (深いツリーでも、多くの組は最大の深さよりずっと手前で葉に着くため)
+        active = np.arange(len(node))
+        active = active[self.left[node] != node]
+        rows = active // self.n_trees
+        current = node[active]
+        while len(active):
+            x = X[rows, self.feature[current]]
+            go_left = x <= self.threshold[current]
+            if self.has_missing:
+                go_left |= np.isnan(x) & self.missing_left[current]
+            current = np.where(go_left, self.left[current], self.right[current])
+            at_leaf = self.left[current] == current
+            node[active[at_leaf]] = current[at_leaf]
+            active, rows, current = active[~at_leaf], rows[~at_leaf], current[~at_leaf]
+
+        return node.reshape(X.shape[0], self.n_trees)
+
+    def split_points(self):
+        """ {特徴量の列番号: その特徴量の全しきい値（昇順・重複なし）}（初回だけ計算する） """
+        if self._split_points is None:
+            internal = self.left != np.arange(len(self.left))
+            features = self.feature[internal]
+            thresholds = self.threshold[internal]
+            self._split_points = {int(f): np.unique(thresholds[features == f]) for f in np.unique(features)}
+        return self._split_points
+
+    def cell_codes(self, X):
+        """
+        各行の「各特徴量がどのしきい値の間にあるか」の番号 (n_rows, n_features) を返す（欠損値は -1）
+        番号が全て同じ2行は、全ツリーで同じ葉に到達する（ツリーを辿らずに同じ予測になると分かる）
+        """
+        X = np.asarray(X, dtype=np.float32) # apply() と同じ精度で比較する
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        codes = np.zeros(X.shape, dtype=np.int32)
+        for f, thresholds in self.split_points().items():
+            # 「x <= しきい値」の判定はすべて「x より小さいしきい値の個数」で決まる
+            codes[:, f] = np.searchsorted(thresholds, X[:, f], side="left")
+            codes[np.isnan(X[:, f]), f] = -1
+        return codes
+
+    def predict_all_trees(self, X, chunk_size=4096):
+        """ 全ツリーの予測値 (n_rows, n_trees) を返す """
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+
+        out = np.empty((X.shape[0], self.n_trees), dtype=np.float64)
+        for start in range(0, X.shape[0], chunk_size):
+            stop = start + chunk_size
+            out[start:stop] = self.tree_predictions(X[start:stop])
+        return out
+
+    def tree_predictions(self, X):
+        """ 1チャンク分の全ツリーの予測値 (n_rows, n_trees)（float64）を返す """
+        if self.estimators is not None and X.shape[0] >= SKLEARN_MIN_ROWS:
+            # ツリーと同じく float32 の入力で、入力の検査を省いて呼ぶ（RandomForestRegressor.predict と同じ）
+            X = np.ascontiguousarray(X, dtype=np.float32)
+            return np.column_stack([estimator.predict(X, check_input=False) for estimator in self.estimators])
+        # コンパクト形式では予測値が float32 のため、平均・シグマは float64 で計算する
+        return self.value[self.apply(X)].astype(np.float64, copy=False)
+
+    def predict_mean_std(self, X, chunk_size=4096):
+        """ 各行の予測平均（速度）と標準偏差（シグマ）を返す """
+        X = np.asarray(X)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+
+        # 全行×全ツリーの行列は作らず、チャンクごとに平均とシグマへ縮約する
+        pred_mean = np.empty(X.shape[0], dtype=np.float64)
+        pred_std = np.empty(X.shape[0], dtype=np.float64)
+        for start in range(0, X.shape[0], chunk_size):
+            stop = start + chunk_size
+            predictions = self.tree_predictions(X[start:stop])
+            pred_mean[start:stop] = np.mean(predictions, axis=1)
+            pred_std[start:stop] = np.std(predictions, axis=1)
+        return pred_mean, pred_std
@@ -0,0 +1,172 @@
+import atexit
+import json
+import os
+import sys
+import time
+
+# ----------------------------------------------------
+# ステップごとの時間・メモリの計測（実行レポート）
+# ----------------------------------------------------
+# 各プログラムの「[ステップN: ...]」の区切りで profiler.stage() を呼び、
+# ステップごとの経過時間・CPU時間・常駐メモリ（RSS）・最大常駐メモリと、
+# profiler.count() で数えた件数（処理した行数・評価したツリー数・試行回数など）を記録する。
+# プログラムの終了時（sys.exit を含む）に JSON の実行レポートを書き出し、標準エラーに要約を表示する。
+# 環境変数 CASTING_PROFILE_DIR が設定されていなければ何もしない（各呼び出しは即座に戻る）。
+# (並列処理のワーカープロセスのメモリは含みません。件数は親プロセスで数えた分です)
+#
+# 使い方:  CASTING_PROFILE_DIR=profiles python trainmodel.py
+#          (tracemalloc による Python オブジェクトの最大使用量も測るなら CASTING_PROFILE_TRACEMALLOC=1)
+
+# ----------------------------------------------------
+# ▼ ユーザー設定項目 ▼
+# ----------------------------------------------------
+
+# 1. 実行レポートの出力先フォルダ（None なら計測しない）
+PROFILE_DIR = os.environ.get("CASTING_PROFILE_DIR") or None
+
+# 2. tracemalloc で Python が確保したメモリの最大値も測るか
+# (メモリ確保のたびに記録するため、有効にすると処理が遅くなります)
+PROFILE_TRACEMALLOC = os.environ.get("CASTING_PROFILE_TRACEMALLOC") == "1"
+
+# ----------------------------------------------------
+# ▲ ユーザー設定項目はここまで ▲
+# ----------------------------------------------------
+
+
+def peak_rss_mb():
+    """ このプロセスの最大常駐メモリ（MB）。測れない環境では None """
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+            return psutil.Process().memory_info().peak_wset / 2**20 # Windows
+        except (ImportError, AttributeError):
+            return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def current_rss_mb():
+    """
+    このプロセスの現在の常駐メモリ（MB）と、その値の種類 ("current" / "peak") を返す
+    psutil も /proc もない環境では最大常駐メモリで代用する（種類は "peak"。ステップ間の差は最大値の増加分だけを表す）
+    """
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 2**20, "current"
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / 2**20, "current"
+    except (OSError, ValueError, AttributeError):
+        return peak_rss_mb(), "peak"
+
+
+class RunProfiler:
+    """ ステップごとの経過時間・メモリ・件数を記録し、終了時に実行レポートを書き出す """
+
+    def __init__(self, output_dir, trace_malloc=False):
+        self.enabled = output_dir is not None
+        self.output_dir = output_dir
+        self.trace_malloc = trace_malloc
+        self.stages = []
+        self.counters = {}
+        self.current = None
+        self.started = False
+
+    def _start(self):
+        """ 最初の stage() で計測を始める（計測しないときはモジュールを読み込むだけで何もしない） """
+        self.started = True
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.process_time()
+        self.started_at = time.strftime("%Y-%m-%d %H:%M:%S")
+        if self.trace_malloc:
+            import tracemalloc
+            tracemalloc.start()
+        atexit.register(self.finish)
+
+    def _snapshot(self):
+        rss_mb, rss_kind = current_rss_mb()
+        return {"wall": time.perf_counter(), "cpu": time.process_time(), "rss_mb": rss_mb, "rss_kind": rss_kind}
+
+    def _close_stage(self):
+        if self.current is None:
+            return
+        stage, begin = self.current
+        end = self._snapshot()
+        stage.update({
+            "wall_sec": end["wall"] - begin["wall"],
+            "cpu_sec": end["cpu"] - begin["cpu"],
+            "rss_start_mb": begin["rss_mb"],
+            "rss_end_mb": end["rss_mb"],
+            "rss_kind": end["rss_kind"],
+            "peak_rss_mb": peak_rss_mb(),
+        })
+        if self.trace_malloc:
+            import tracemalloc
+            stage["tracemalloc_peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+        self.stages.append(stage)
+        self.current = None
+
+    def stage(self, name):
+        """ 前のステップを締めて、新しいステップの計測を始める """
+        if not self.enabled:
+            return
+        if not self.started:
+            self._start()
+        self._close_stage()
+        if self.trace_malloc:
+            import tracemalloc
+            tracemalloc.reset_peak()
+        self.current = ({"name": name, "counters": {}}, self._snapshot())
+
+    def count(self, name, n=1):
+        """ 件数を足し込む（全体と、現在のステップの両方に記録する） """
+        if not self.enabled:
+            return
+        self.counters[name] = self.counters.get(name, 0) + n
+        if self.current is not None:
+            counters = self.current[0]["counters"]
+            counters[name] = counters.get(name, 0) + n
+
+    def finish(self):
+        """ 最後のステップを締めて、実行レポートを書き出す（終了時に自動で呼ばれる。2回目以降は何もしない） """
+        if not self.started:
+            return
+        self._close_stage()
+        self.started = False
+        script = os.path.splitext(os.path.basename(sys.argv[0]))[0] or "python"
+        report = {
+            "script": script,
+            "argv": sys.argv[1:],
+            "started_at": self.started_at,
+            "wall_sec": time.perf_counter() - self.start_wall,
+            "cpu_sec": time.process_time() - self.start_cpu,
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": self.stages,
+            "counters": self.counters,
+        }
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, f"{script}_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+        # 予測結果を標準出力に書くプログラムもあるため、要約は標準エラーに出す
+        log = sys.stderr
+        print(f"\n--- 実行レポート ({report['wall_sec']:.2f} 秒) ---", file=log)
+        for stage in self.stages:
+            peak = "-" if stage["peak_rss_mb"] is None else f"{stage['peak_rss_mb']:.0f}"
+            rss = "-" if stage["rss_end_mb"] is None else f"{stage['rss_end_mb']:.0f}"
+            # 現在の常駐メモリを測れない環境では、最大常駐メモリで代用したことを示す
+            rss_label = "RSS" if stage["rss_kind"] == "current" else "RSS(最大値で代用)"
+            counters = ", ".join(f"{k}={v}" for k, v in stage["counters"].items())
+            print(f"  {stage['wall_sec']:8.2f} 秒  {rss_label} {rss:>7} MB (最大 {peak} MB)  "
+                  f"{stage['name']}" + (f"  [{counters}]" if counters else ""), file=log)
+        print(f"実行レポートを '{path}' に保存しました。", file=log)
+
+
+profiler = RunProfiler(PROFILE_DIR, PROFILE_TRACEMALLOC)
@@ -1,7 +1,16 @@
 import pandas as pd
+import numpy as np
 from sklearn.tree import DecisionTreeRegressor, export_text
+import argparse
+import concurrent.futures
+import itertools
+import os
+import tempfile
+import time
 import warnings
 import sys
+from data_cache import read_dataset
+from rule_table import RuleTable
 
 # 警告を非表示
 warnings.filterwarnings('ignore')
@@ -27,29 +36,216 @@ X_COLS_CATEGORICAL = ["Pattern", "Steel_Code"] # 例: ["操業パターン", "
 # (3〜5程度が推奨)
 TREE_MAX_DEPTH = 4
 
+# 5. 学習に使う行の絞り込み条件（読み込み時に適用されます。空なら全件）
+# 例: [("quality_score", ">", 0.8)]
+ROW_FILTERS = []
+
+# 6. 説明変数の組み合わせ探索（`--combo` で実行）
+# 候補列の全ての組み合わせで決定木を作り、葉ごとの速度の分散が最小になる組み合わせを探します
+COMBO_CANDIDATE_COLS = X_COLS_NUMERIC + X_COLS_CATEGORICAL
+# 組み合わせに含める列数の範囲（None なら候補列の数まで）
+COMBO_MIN_SIZE = 1
+COMBO_MAX_SIZE = None
+# 並列に決定木を学習するプロセス数（1 なら1プロセスで順番に実行）
+COMBO_N_WORKERS = 1
+# 葉ごとの平均品質を集計する列（None またはCSVにない場合は集計しない）
+QUALITY_COL = "quality_score"
+# 出力先フォルダ
+OUTPUT_DIR = "output"
+
+# 7. 決定木を変換した基準速度ルールテーブル（1ルール1行）の出力ファイル名（OUTPUT_DIR に保存）
+# (`python rule_table.py --table ... --input 操業命令.csv` で大量の操業命令を一括で割り当てられます)
+RULE_TABLE_CSV = "standard_rule_table.csv"
+
 # ----------------------------------------------------
 # ▲ ユーザー設定項目はここまで ▲
 # ----------------------------------------------------
 
 
+# 決定木の設定（単体の学習と組み合わせ探索で共通）
+TREE_PARAMS = {
+    "max_depth": TREE_MAX_DEPTH,
+    "random_state": 42,
+    "min_samples_leaf": 10, # 少なくとも10件の実績が該当するルールのみ作成（過学習防止）
+}
+
+# ワーカープロセスが共有する、エンコード済みのデータ
+g_X = None
+g_y = None
+g_quality = None
+
+
+def encode_candidates(df, candidate_cols):
+    """
+    候補列を1回だけ数値行列に変換する（組み合わせごとには列を選ぶだけで済むようにする）
+    戻り値: (X, 列名のリスト, {候補列: X の列番号のリスト})
+    X は float32（決定木が内部で使う型）の列優先配列で、列の取り出しが連続したメモリの読み出しになる
+    """
+    names, blocks, column_groups = [], [], {}
+    for col in candidate_cols:
+        if col in X_COLS_CATEGORICAL:
+            block = pd.get_dummies(df[col], prefix=col, dtype=np.float32)
+        else:
+            block = df[[col]].astype(np.float32)
+        column_groups[col] = list(range(len(names), len(names) + block.shape[1]))
+        names += list(block.columns)
+        blocks.append(block.to_numpy(dtype=np.float32))
+    return np.asfortranarray(np.hstack(blocks)), names, column_groups
+
+
+def leaf_statistics(leaves, y, quality=None):
+    """ 葉ごとの件数・平均・分散（と平均品質）を、葉番号の bincount で一括計算する """
+    leaf_ids, codes = np.unique(leaves, return_inverse=True)
+    counts = np.bincount(codes)
+    means = np.bincount(codes, weights=y) / counts
+    variances = np.bincount(codes, weights=(y - means[codes]) ** 2) / counts
+    stats = {"leaf_ids": leaf_ids, "counts": counts, "means": means, "variances": variances}
+    if quality is not None:
+        stats["quality"] = np.bincount(codes, weights=quality) / counts
+    return stats
+
+
+def init_combo_worker(data_dir):
+    """ ワーカープロセスの初期化（エンコード済みのデータはメモリマップで共有する） """
+    global g_X, g_y, g_quality
+    warnings.filterwarnings('ignore')
+    g_X = np.load(os.path.join(data_dir, "X.npy"), mmap_mode="r")
+    g_y = np.load(os.path.join(data_dir, "y.npy"), mmap_mode="r")
+    quality_path = os.path.join(data_dir, "quality.npy")
+    g_quality = np.load(quality_path, mmap_mode="r") if os.path.exists(quality_path) else None
+
+
+def evaluate_combo(column_index):
+    """ 列番号の組で決定木を学習し、葉ごとの分散などの指標を返す（ワーカーで実行） """
+    start = time.perf_counter()
+    X = g_X[:, column_index]
+    tree_model = DecisionTreeRegressor(**TREE_PARAMS).fit(X, g_y)
+    fit_sec = time.perf_counter() - start
+
+    stats = leaf_statistics(tree_model.apply(X), np.asarray(g_y),
+                            None if g_quality is None else np.asarray(g_quality))
+    result = {
+        "N_Leaves": len(stats["counts"]),
+        "Mean_Leaf_Variance": float(stats["variances"].mean()),
+        "Weighted_Leaf_Variance": float(np.average(stats["variances"], weights=stats["counts"])),
+        "Mean_Leaf_Std": float(np.sqrt(stats["variances"]).mean()),
+    }
+    if "quality" in stats:
+        result["Mean_Quality"] = float(stats["quality"].mean())
+    result["Fit_Sec"] = fit_sec
+    result["Total_Sec"] = time.perf_counter() - start
+    return result
+
+
+def run_combo_search(df, n_workers):
+    """ 候補列の全組み合わせで決定木を学習し、葉ごとの分散が最小の組み合わせで基準テーブルを作る """
+    candidate_cols = [col for col in COMBO_CANDIDATE_COLS if col in df.columns]
+    max_size = COMBO_MAX_SIZE or len(candidate_cols)
+    combos = [combo for size in range(COMBO_MIN_SIZE, max_size + 1)
+              for combo in itertools.combinations(candidate_cols, size)]
+
+    # --- ステップ2: 候補列のエンコード（全組み合わせで共通、1回だけ） ---
+    X, names, column_groups = encode_candidates(df, candidate_cols)
+    y = df[Y_COL].to_numpy(dtype=np.float64)
+    quality = None
+    if QUALITY_COL and QUALITY_COL in df.columns:
+        quality = df[QUALITY_COL].to_numpy(dtype=np.float64)
+    print(f"候補列 {len(candidate_cols)} 個 (エンコード後 {len(names)} 列) の組み合わせ {len(combos)} 通りを探索します。")
+
+    # 組み合わせに含まれる列を、単体の学習と同じく列名順に並べる（同じ組み合わせなら同じ木になる）
+    combo_indexes = [sorted((i for col in combo for i in column_groups[col]), key=lambda i: names[i])
+                     for combo in combos]
+
+    # --- ステップ3: 全組み合わせの決定木を学習 ---
+    print(f"\n[ステップ3: 組み合わせごとの決定木の学習 ({n_workers} プロセス, max_depth={TREE_MAX_DEPTH})]")
+    start_time = time.perf_counter()
+    with tempfile.TemporaryDirectory() as data_dir:
+        np.save(os.path.join(data_dir, "X.npy"), X)
+        np.save(os.path.join(data_dir, "y.npy"), y)
+        if quality is not None:
+            np.save(os.path.join(data_dir, "quality.npy"), quality)
+
+        if n_workers <= 1:
+            init_combo_worker(data_dir)
+            results = [evaluate_combo(index) for index in combo_indexes]
+        else:
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=n_workers, initializer=init_combo_worker, initargs=(data_dir,)
+            ) as executor:
+                # map は入力順に結果を返すため、出力の並びもプロセス数に依存しない
+                results = list(executor.map(evaluate_combo, combo_indexes,
+                                            chunksize=max(1, len(combo_indexes) // (n_workers * 4))))
+    elapsed = time.perf_counter() - start_time
+    print(f"  完了: {len(combos)} 通り, {elapsed:.2f} 秒 ({len(combos) / max(elapsed, 1e-9):.1f} 通り/秒)")
+
+    # --- ステップ4: 組み合わせごとの集計結果の保存 ---
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    summary = pd.DataFrame(results)
+    summary.insert(0, "Combo", [" + ".join(combo) for combo in combos])
+    summary.insert(1, "N_Features", [len(combo) for combo in combos])
+    # 分散が同じなら列数の少ない組み合わせを優先する
+    summary = summary.sort_values(["Mean_Leaf_Variance", "N_Features"], kind="stable")
+    best_i = summary.index[0]
+    summary = summary.reset_index(drop=True)
+    summary_path = os.path.join(OUTPUT_DIR, "combo_summary.csv")
+    summary.to_csv(summary_path, index=False, encoding='utf-8-sig')
+    print(f"\n[ステップ4: 組み合わせの比較結果を '{summary_path}' に保存しました]")
+    print(summary.head(10).to_string(index=False))
+
+    # --- ステップ5: 最小分散の組み合わせで基準テーブルを作成 ---
+    best_combo, best_index = combos[best_i], combo_indexes[best_i]
+    best_names = [names[i] for i in best_index]
+    print(f"\n[ステップ5: 最小分散の組み合わせ ({' + '.join(best_combo)}) で基準テーブルを作成]")
+
+    X_best = X[:, best_index]
+    tree_model = DecisionTreeRegressor(**TREE_PARAMS).fit(X_best, y)
+    stats = leaf_statistics(tree_model.apply(X_best), y, quality)
+
+    # 葉ごとのルール（数値の区間・カテゴリの集合）と基準速度・シグマの表
+    rule_table = RuleTable.from_tree(tree_model, best_names, X_COLS_NUMERIC, X_COLS_CATEGORICAL)
+    table_path = os.path.join(OUTPUT_DIR, "optimal_baseline_table.csv")
+    table = rule_table.to_csv(table_path, {"Mean_Quality": stats["quality"]} if "quality" in stats else None)
+    print(f"基準テーブル ({len(table)} ルール) を '{table_path}' に保存しました。")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="最適分割ルール（決定木）探索プログラム")
+    parser.add_argument("--combo", action="store_true", help="説明変数の全組み合わせを探索する")
+    parser.add_argument("--workers", type=int, default=COMBO_N_WORKERS, help="組み合わせ探索の並列プロセス数")
+    return parser.parse_args()
+
+
 def main():
+    args = parse_args()
     print("--- 最適分割ルール（決定木）探索プログラム ---")
 
     # --- ステップ1: データの読み込み ---
     try:
-        df = pd.read_csv(CSV_FILE_PATH)
+        # 必要な列だけを、列指向キャッシュから読み込む（2回目以降はCSVを解析しない）
+        required_cols = X_COLS_NUMERIC + X_COLS_CATEGORICAL + [Y_COL]
+        if args.combo:
+            required_cols = list(dict.fromkeys(COMBO_CANDIDATE_COLS + [Y_COL]))
+        df = read_dataset(CSV_FILE_PATH, columns=required_cols, filters=ROW_FILTERS)
     except FileNotFoundError:
         print(f"エラー: ファイル '{CSV_FILE_PATH}' が見つかりません。")
         sys.exit(1)
-    
-    required_cols = X_COLS_NUMERIC + X_COLS_CATEGORICAL + [Y_COL]
-    missing_cols = [col for col in required_cols if col not in df.columns]
-    if missing_cols:
-        print(f"エラー: CSVファイルに必要な列がありません: {missing_cols}")
+    except KeyError as e:
+        print(f"エラー: CSVファイルに必要な列がありません: {e.args[0]}")
         sys.exit(1)
-    
+
     print(f"{CSV_FILE_PATH} (全 {len(df)} 件) を読み込みました。")
 
+    if args.combo:
+        if QUALITY_COL:
+            # 品質の列は任意（CSVになければ品質の集計を省く）
+            try:
+                df[QUALITY_COL] = read_dataset(CSV_FILE_PATH, columns=[QUALITY_COL], filters=ROW_FILTERS)[QUALITY_COL]
+            except KeyError:
+                pass
+        run_combo_search(df, args.workers)
+        print("\nプログラム終了。")
+        return
+
     # --- ステップ2: カテゴリカル変数の前処理 (One-Hotエンコーディング) ---
     df_processed = df.copy()
     if X_COLS_CATEGORICAL:
@@ -68,11 +264,7 @@ def main():
     print(f"\n[ステップ3: 決定木モデルの学習 (max_depth={TREE_MAX_DEPTH})]")
     
     # 決定木回帰モデル（深さ制限付き）
-    tree_model = DecisionTreeRegressor(
-        max_depth=TREE_MAX_DEPTH, 
-        random_state=42,
-        min_samples_leaf=10 # 少なくとも10件の実績が該当するルールのみ作成（過学習防止）
-    )
+    tree_model = DecisionTreeRegressor(**TREE_PARAMS)
     tree_model.fit(X, y)
     
     print("モデルの学習が完了しました。")
@@ -87,6 +279,13 @@ def main():
     except Exception as e:
         print(f"ルールの出力に失敗しました: {e}")
         
+    # 構造化したルールテーブル（1ルール1行）として保存
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    rule_table_path = os.path.join(OUTPUT_DIR, RULE_TABLE_CSV)
+    rule_table = RuleTable.from_tree(tree_model, all_x_cols_processed, X_COLS_NUMERIC, X_COLS_CATEGORICAL)
+    rule_table.to_csv(rule_table_path)
+    print(f"\nルールテーブル ({rule_table.n_rules} ルール) を '{rule_table_path}' に保存しました。")
+
     print("\n--- ルールの見方 ---")
     print("  `|--- Feature <= X.XX` : 分割条件（この特徴量で分割するとシグマが小さくなる）")
     print("  `|   |--- ...` : さらに次の条件")
@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+from forest_engine import ForestEngine
+from category_encoder import CategoryEncoder
+from instrumentation import current_rss_mb
+
+# ----------------------------------------------------
+# コンパクト形式のモデルファイル（推論専用）
+# ----------------------------------------------------
+# trainmodel.py は joblib のモデルファイルと同時に、同じ名前で拡張子 ".forest" のファイルを書き出す。
+# 中身は全ツリーのフラットなノード配列（float32 / 最小幅の整数）と、
+# 予測に必要な列構成・カテゴリ値・学習範囲を記したヘッダだけで、scikit-learn も pickle も使わない。
+# メモリマップで開くため起動は一瞬で、複数のプロセスが同時に開いても
+# OSのページキャッシュ上の1つのコピーを共有する。
+# (SHAP による解説には学習済みモデル本体が必要なため、joblib のファイルを使う)
+
+# ----------------------------------------------------
+# ▼ ユーザー設定項目 ▼
+# ----------------------------------------------------
+
+# 1. 比較する joblib のモデルファイル名（コンパクト形式はこれの拡張子を ".forest" にしたもの）
+MODEL_FILE_NAME = "casting_speed_model.joblib"
+
+# ----------------------------------------------------
+# ▲ ユーザー設定項目はここまで ▲
+# ----------------------------------------------------
+
+
+def compact_model_path(model_file_name):
+    """ joblib のモデルファイル名に対応するコンパクト形式のファイル名 """
+    return os.path.splitext(model_file_name)[0] + ".forest"
+
+
+def save_compact_model(path, model, model_columns, numeric_cols, categorical_cols, encoder, param_ranges):
+    """ 学習済みモデルと予測に必要な情報を、コンパクト形式で保存する """
+    metadata = {
+        "model_columns": list(model_columns),
+        "original_cols_numeric": list(numeric_cols),
+        "original_cols_categorical": list(categorical_cols),
+        "categories": {col: encoder.category_keys[col].tolist() for col in categorical_cols},
+        "param_ranges": param_ranges,
+    }
+    ForestEngine.from_model(model).save_compact(path, metadata)
+
+
+def load_compact_model(path):
+    """ コンパクト形式のファイルをメモリマップで開き、model_data と同じキーの辞書で返す（"model" は含まない） """
+    engine, metadata = ForestEngine.load_compact(path)
+    encoder = CategoryEncoder(metadata["model_columns"], metadata["original_cols_numeric"],
+                              metadata["original_cols_categorical"], metadata["categories"])
+    return {
+        "model_columns": metadata["model_columns"],
+        "original_cols_numeric": metadata["original_cols_numeric"],
+        "original_cols_categorical": metadata["original_cols_categorical"],
+        "encoder": encoder,
+        "param_ranges": metadata["param_ranges"],
+        "engine": engine,
+        "source": path,
+    }
+
+
+def load_model(model_file_name, prefer_compact=False):
+    """
+    予測用にモデルを読み込む
+    prefer_compact=True で、コンパクト形式のファイルがあり joblib のファイルより新しければ、そちらをメモリマップで開く
+    (予測値が float32 に丸められるため、joblib のモデルの予測とは、予測値の大きさの 1e-7 倍程度の相対誤差で異なる)。
+    それ以外は joblib のファイルを読み込み、推論エンジンを作る（学習済みモデルの予測と浮動小数点の丸め誤差の範囲で一致する）。
+    戻り値: model_data と同じキーの辞書 + "engine"（推論エンジン）, "source"（読み込んだファイル）
+    どちらのファイルもなければ FileNotFoundError
+    """
+    compact_path = compact_model_path(model_file_name)
+    if prefer_compact and os.path.exists(compact_path) and (
+            not os.path.exists(model_file_name)
+            or os.path.getmtime(compact_path) >= os.path.getmtime(model_file_name)):
+        return load_compact_model(compact_path)
+
+    import joblib  # joblib（と scikit-learn）はコンパクト形式がないときだけ読み込む
+    model_data = dict(joblib.load(model_file_name))
+    model_data["encoder"] = CategoryEncoder.from_model_data(model_data)
+    model_data["engine"] = ForestEngine.from_model(model_data["model"])
+    model_data["source"] = model_file_name
+    return model_data
+
+
+def measure_load(model_format):
+    """ 1つの形式について、読み込み時間・常駐メモリの増分・初回予測の時間を測る（子プロセスで実行） """
+    rss_before = current_rss_mb()[0]
+    start = time.perf_counter()
+    if model_format == "joblib":
+        import joblib
+        model_data = joblib.load(MODEL_FILE_NAME)
+        engine = ForestEngine.from_model(model_data["model"])
+        n_columns = len(model_data["model_columns"])
+    else:
+        engine, metadata = ForestEngine.load_compact(compact_model_path(MODEL_FILE_NAME))
+        n_columns = len(metadata["model_columns"])
+    load_sec = time.perf_counter() - start
+    rss_loaded = current_rss_mb()[0]
+
+    start = time.perf_counter()
+    engine.predict_mean_std(np.zeros((1, n_columns)))
+    first_predict_sec = time.perf_counter() - start
+
+    return {
+        "load_sec": load_sec,
+        "rss_delta_mb": rss_loaded - rss_before,
+        "rss_after_predict_mb": current_rss_mb()[0],
+        "first_predict_sec": first_predict_sec,
+    }
+
+
+def compare_predictions(n_rows=1000, seed=0):
+    """ 学習範囲内のランダムな入力で、2つの形式の予測値の最大差を返す """
+    import joblib
+    model_data = joblib.load(MODEL_FILE_NAME)
+    compact = load_compact_model(compact_model_path(MODEL_FILE_NAME))
+
+    rng = np.random.default_rng(seed)
+    orders = {}
+    for col, spec in compact["param_ranges"].items():
+        if "values" in spec:
+            orders[col] = rng.choice(np.asarray(spec["values"], dtype=str), n_rows)
+        else:
+            orders[col] = rng.uniform(spec["min"], spec["max"], n_rows)
+    X, _ = compact["encoder"].transform(orders)
+    mean_joblib, std_joblib = ForestEngine.from_model(model_data["model"]).predict_mean_std(X)
+    mean_compact, std_compact = compact["engine"].predict_mean_std(X)
+    return (float(np.max(np.abs(mean_joblib - mean_compact))),
+            float(np.max(np.abs(std_joblib - std_compact))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="モデルファイル（joblib / コンパクト形式）の読み込み性能の比較")
+    parser.add_argument("--measure", choices=["joblib", "compact"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        print(json.dumps(measure_load(args.measure)))
+        return
+
+    print("--- モデルファイル 読み込み性能の比較 ---")
+    paths = {"joblib": MODEL_FILE_NAME, "compact": compact_model_path(MODEL_FILE_NAME)}
+    for path in paths.values():
+        if not os.path.exists(path):
+            print(f"エラー: モデルファイル '{path}' が見つかりません。")
+            print("先に `trainmodel.py` を実行してモデルを生成してください。")
+            sys.exit(1)
+
+    # 各形式を新しいプロセスで読み込み、他方の読み込みの影響を受けないようにする
+    for model_format, path in paths.items():
+        output = subprocess.run([sys.executable, os.path.abspath(__file__), "--measure", model_format],
+                                capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"\n[{model_format}] {path} ({os.path.getsize(path) / 2**20:.2f} MB)")
+        print(f"  読み込み時間: {result['load_sec'] * 1000:.1f} ミリ秒")
+        print(f"  常駐メモリの増分: {result['rss_delta_mb']:.1f} MB "
+              f"(初回予測後のプロセス全体: {result['rss_after_predict_mb']:.1f} MB)")
+        print(f"  初回予測: {result['first_predict_sec'] * 1000:.2f} ミリ秒")
+
+    mean_diff, std_diff = compare_predictions()
+    print(f"\n  2形式の予測値の最大差: 平均 {mean_diff:.2e}, シグマ {std_diff:.2e} (予測値の float32 化による)")
+
+
+if __name__ == "__main__":
+    main()
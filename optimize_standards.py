@@ -1,9 +1,21 @@
-import joblib
 import pandas as pd
 import numpy as np
 import optuna
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
 import sys
+import tempfile
+import time
 import warnings
+import zlib
+from collections import OrderedDict
+from forest_engine import ForestEngine
+from category_encoder import CategoryEncoder
+from model_artifact import load_model
+from instrumentation import profiler
 
 # Optunaのログ出力を抑制
 optuna.logging.set_verbosity(optuna.logging.WARNING)
@@ -29,48 +41,130 @@ OPTIMIZE_COLS_CATEGORICAL = ["Pattern"] # 例: ["操業パターン"]
 # 4. 最適化の試行回数（多いほど高精度だが時間がかかる）
 N_TRIALS_PER_CATEGORY = 100
 
+# 4b. 1回の予測でまとめて評価する試行の数（ask/tell によるバッチ評価）
+# (NSGA-II の1世代の個体数 = 50 に合わせると、世代単位でまとめて評価されます。1 なら従来どおり1件ずつ)
+TRIAL_BATCH_SIZE = 50
+
 # 5. 出力する基準テーブルのファイル名
 OUTPUT_TABLE_CSV = "optimal_standards_table.csv"
 
+# 6. 並列に最適化するプロセス数（1 なら従来どおり1プロセスで順番に実行）
+N_WORKERS = 1
+
+# 7. 乱数シード（鋼種ごとのシードはこの値と鋼種コードから決まるため、
+#    プロセス数を変えても同じ結果になります）
+RANDOM_SEED = 42
+
+# 8. 最適化の途中経過を保存するファイル（None なら保存せず、毎回ゼロから最適化）
+# (中断した実行の再開や、モデルと設定が前回と同じ鋼種の再利用に使います)
+# (ファイル名なら追記型のジャーナルファイル、"sqlite:///xxx.db" のようなURLならデータベースに保存します)
+STUDY_STORAGE = "optimize_standards_studies.log"
+
+# 8b. 鋼種ごとに残しておく「以前のモデル」の研究（study）の数
+# (最新のものは次回の最適化の初期値に使います。それより古いものは起動時に削除し、
+#  ジャーナルファイルは残す研究だけを書き出し直して小さくします)
+KEEP_PREVIOUS_STUDIES = 1
+
+# 9. 予測結果を覚えておく件数（0 なら覚えない）
+# (ランダムフォレストの予測は、全ツリーで同じ葉に到達する入力どうしなら完全に同じになるため、
+#  「各変数がどのしきい値の間にあるか」が同じ提案はツリーを辿らずに前回の結果を返します。
+#  上限を超えたら、最も長く使われていない結果から捨てます)
+PREDICTION_CACHE_SIZE = 100000
+
 # ----------------------------------------------------
 # ▲ ユーザー設定項目はここまで ▲
 # ----------------------------------------------------
 
 # グローバル変数（Optunaの目的関数に渡すため）
 g_model_data = None
+g_engine = None
+g_encoder = None
 g_current_main_category_value = None
+g_model_version = None
+g_cache = None
+g_storage = None
+g_study_index = {}
 
 
-def get_prediction(params_dict):
-    """ 入力辞書から予測平均とシグマを返す """
-    global g_model_data
-    
-    # 1. 入力データをDataFrameに
-    df_input = pd.DataFrame([params_dict])
-    
-    # 2. ダミー変数化
-    categorical_cols = g_model_data["original_cols_categorical"]
-    df_input_processed = pd.get_dummies(df_input, columns=categorical_cols, dummy_na=False)
-    
-    # 3. 学習時の列構成に合わせる
-    model_columns = g_model_data["model_columns"]
-    df_input_processed = df_input_processed.reindex(columns=model_columns, fill_value=0)
-    
-    X_input = df_input_processed.values
-    
-    # 4. 予測の実行
-    model = g_model_data["model"]
-    all_trees = model.estimators_
-    predictions = [tree.predict(X_input)[0] for tree in all_trees]
+class PredictionCache:
+    """ 予測平均とシグマを「到達する葉の組み合わせ」ごとに覚えておく（上限付き・LRU） """
+
+    def __init__(self, engine, max_size):
+        self.engine = engine
+        self.max_size = max_size
+        self.entries = OrderedDict() # キー -> (予測平均, シグマ)。末尾ほど最近使った結果
+        self.hits = 0
+        self.lookups = 0
+
+    def predict_mean_std(self, X):
+        """ engine.predict_mean_std と同じ結果を返す（覚えていない行だけをまとめて予測する） """
+        X = np.asarray(X)
+        # しきい値との大小関係が全て同じ行は、全ツリーで同じ葉に到達する
+        keys = [row.tobytes() for row in self.engine.cell_codes(X)]
+        pred_mean = np.empty(len(keys), dtype=np.float64)
+        pred_std = np.empty(len(keys), dtype=np.float64)
+
+        missing = {} # 覚えていないキー -> そのキーを持つ行番号のリスト
+        for i, key in enumerate(keys):
+            cached = self.entries.get(key)
+            if cached is None:
+                missing.setdefault(key, []).append(i)
+            else:
+                self.entries.move_to_end(key)
+                pred_mean[i], pred_std[i] = cached
+
+        if missing:
+            # 同じキーの行は1回だけ予測する
+            first_rows = [rows[0] for rows in missing.values()]
+            new_means, new_stds = self.engine.predict_mean_std(X[first_rows])
+            for (key, rows), mean, std in zip(missing.items(), new_means, new_stds):
+                pred_mean[rows] = mean
+                pred_std[rows] = std
+                self.entries[key] = (mean, std)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+        self.lookups += len(keys)
+        self.hits += len(keys) - len(missing)
+        return pred_mean, pred_std
+
+    def stats(self):
+        """ (ヒット数, 参照数) """
+        return self.hits, self.lookups
+
+
+def make_cache(engine):
+    """ 設定に応じて予測キャッシュを作る（PREDICTION_CACHE_SIZE が 0 なら None） """
+    return PredictionCache(engine, PREDICTION_CACHE_SIZE) if PREDICTION_CACHE_SIZE > 0 else None
+
+
+def hit_rate_text(hits, lookups):
+    """ キャッシュのヒット率の表示用文字列 """
+    return f"{hits}/{lookups} ({hits / max(lookups, 1):.1%})"
+
+
+def get_predictions(params_list):
+    """ 入力辞書のリストから、予測平均とシグマの配列を返す（全件を1回で評価） """
+    global g_engine, g_encoder, g_cache
     
-    pred_mean = np.mean(predictions)
-    pred_std = np.std(predictions)
+    # 1-3. 学習時と同じ列構成の数値行列に変換（カテゴリ値は対応する列に直接 1 を立てる）
+    data = {col: [params[col] for params in params_list] for col in params_list[0]}
+    X_input, _ = g_encoder.transform(data)
     
-    return pred_mean, pred_std
+    # 4. 予測の実行（全行×全ツリーを一括で評価。以前と同じ葉に到達する行はキャッシュから返す）
+    if g_cache is not None:
+        return g_cache.predict_mean_std(X_input)
+    return g_engine.predict_mean_std(X_input)
 
 
-def objective(trial):
-    """ Optunaが最適化（試行錯誤）するための関数 """
+def get_prediction(params_dict):
+    """ 入力辞書から予測平均とシグマを返す """
+    pred_means, pred_stds = get_predictions([params_dict])
+    return pred_means[0], pred_stds[0]
+
+
+def suggest_params(trial):
+    """ 最適化対象の変数を Optuna に「提案」させ、予測用の入力辞書を返す """
     global g_model_data, g_current_main_category_value
     
     param_ranges = g_model_data["param_ranges"]
@@ -87,6 +181,12 @@ def objective(trial):
 
     # 2. メインのカテゴリ（鋼種コード）は固定
     input_params[MAIN_CATEGORY_COL] = g_current_main_category_value
+    return input_params
+
+
+def objective(trial):
+    """ Optunaが最適化（試行錯誤）するための関数 """
+    input_params = suggest_params(trial)
     
     # 3. 予測を実行
     pred_mean, pred_std = get_prediction(input_params)
@@ -97,19 +197,289 @@ def objective(trial):
     return pred_std, -pred_mean
 
 
+def optimize_batched(study, n_trials, batch_size):
+    """ ask/tell で試行をまとめて提案させ、1回の予測で全件を評価する """
+    for start in range(0, n_trials, batch_size):
+        trials = [study.ask() for _ in range(min(batch_size, n_trials - start))]
+        params_list = [suggest_params(trial) for trial in trials]
+
+        pred_means, pred_stds = get_predictions(params_list)
+
+        # 目的は objective() と同じ [std, -mean]
+        for trial, pred_mean, pred_std in zip(trials, pred_means, pred_stds):
+            study.tell(trial, [pred_std, -pred_mean])
+
+
+def category_seed(category_value):
+    """ 鋼種コードから決まる（実行順やプロセス数に依存しない）乱数シード """
+    return (RANDOM_SEED + zlib.crc32(str(category_value).encode("utf-8"))) % (2 ** 32)
+
+
+def file_sha256(path):
+    """ ファイル内容のハッシュ値（モデルのバージョンとして使う） """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def open_storage(storage_spec):
+    """ 途中経過の保存先を開く（URLならデータベース、それ以外はジャーナルファイル） """
+    if "://" in storage_spec:
+        return optuna.storages.RDBStorage(storage_spec)
+    # ジャーナルファイルは1試行ごとの書き込みが SQLite より1桁程度速い
+    return optuna.storages.JournalStorage(optuna.storages.journal.JournalFileBackend(storage_spec))
+
+
+def build_study_index(storage):
+    """ 保存済みの研究を1回だけ読み、{鋼種: [研究の情報の辞書, ...]} にまとめる """
+    index = {}
+    for summary in optuna.get_all_study_summaries(storage, include_best_trial=False):
+        category = summary.user_attrs.get("category")
+        if category is None:
+            continue
+        index.setdefault(category, []).append({
+            "study_name": summary.study_name,
+            "fingerprint": summary.user_attrs.get("fingerprint"),
+            "result_row": summary.user_attrs.get("result_row"),
+            "datetime_start": summary.datetime_start,
+            "n_trials": summary.n_trials,
+        })
+    return index
+
+
+def prune_studies(storage_spec, storage, index, model_version):
+    """
+    現在のモデルの研究と、鋼種ごとに新しい順で KEEP_PREVIOUS_STUDIES 個の以前のモデルの研究だけを残す
+    (ジャーナルファイルは削除の記録も追記されるだけで小さくならないため、残す研究を新しいファイルに写して置き換える)
+    戻り値: (保存先, 研究の索引, 削除した研究の数)
+    """
+    prefix = f"{model_version[:12]}/"
+    keep, drop = [], []
+    for studies in index.values():
+        previous = sorted((s for s in studies if not s["study_name"].startswith(prefix) and s["n_trials"]),
+                          key=lambda s: s["datetime_start"], reverse=True)
+        kept = set(s["study_name"] for s in previous[:KEEP_PREVIOUS_STUDIES])
+        for s in studies:
+            (keep if s["study_name"].startswith(prefix) or s["study_name"] in kept else drop).append(s["study_name"])
+    if not drop:
+        return storage, index, 0
+
+    if "://" in storage_spec:
+        for study_name in drop:
+            optuna.delete_study(study_name=study_name, storage=storage)
+    else:
+        tmp_path = f"{storage_spec}.tmp"
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        compacted = open_storage(tmp_path)
+        for study_name in keep:
+            optuna.copy_study(from_study_name=study_name, from_storage=storage, to_storage=compacted)
+        os.replace(tmp_path, storage_spec)
+        storage = open_storage(storage_spec)
+    return storage, build_study_index(storage), len(drop)
+
+
+def category_fingerprint(category_value):
+    """
+    鋼種の最適化結果を左右する「入力」のハッシュ値
+    (モデルファイルの内容のハッシュ値 + 最適化の設定・探索範囲。モデルを再学習すれば必ず変わる)
+    """
+    param_ranges = g_model_data["param_ranges"]
+    cols = OPTIMIZE_COLS_NUMERIC + OPTIMIZE_COLS_CATEGORICAL
+    settings = {
+        "model_version": g_model_version,
+        "category": category_value,
+        "optimize_cols": cols,
+        "param_ranges": {col: param_ranges[col] for col in cols},
+        "n_trials": N_TRIALS_PER_CATEGORY,
+        "batch_size": TRIAL_BATCH_SIZE,
+        "seed": category_seed(category_value),
+    }
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def warm_start(study, previous_study_name, storage):
+    """ 前回の同じ鋼種のパレート解（best_trials）を、最初の試行として登録する """
+    param_ranges = g_model_data["param_ranges"]
+    previous = optuna.load_study(study_name=previous_study_name, storage=storage)
+    n_enqueued = 0
+    for trial in previous.best_trials:
+        params = {}
+        for col in OPTIMIZE_COLS_NUMERIC:
+            r = param_ranges[col]
+            # 探索範囲が変わっていても範囲内に収める
+            params[col] = float(np.clip(trial.params[col], r["min"], r["max"]))
+        for col in OPTIMIZE_COLS_CATEGORICAL:
+            if trial.params[col] not in param_ranges[col]["values"]:
+                break
+            params[col] = trial.params[col]
+        else:
+            study.enqueue_trial(params)
+            n_enqueued += 1
+    return n_enqueued
+
+
+def run_study(study, n_trials):
+    """ 指定回数だけ試行を実行し、実行した試行の数を返す """
+    if n_trials <= 0:
+        return 0
+    if TRIAL_BATCH_SIZE > 1:
+        optimize_batched(study, n_trials, TRIAL_BATCH_SIZE)
+    else:
+        study.optimize(objective, n_trials=n_trials)
+    return n_trials
+
+
+def optimize_category(category_value):
+    """
+    1つの鋼種について最適化を実行し、
+    (基準テーブルの1行, 状態, この実行で行った試行の数, キャッシュの (ヒット数, 参照数)) を返す
+    状態: "reused"（前回の結果を再利用）/ "resumed"（中断した実行を再開）/ "recomputed"
+    """
+    global g_current_main_category_value
+    g_current_main_category_value = category_value # グローバル変数を設定
+    hits_before, lookups_before = g_cache.stats() if g_cache is not None else (0, 0)
+
+    def cache_stats():
+        hits, lookups = g_cache.stats() if g_cache is not None else (0, 0)
+        return hits - hits_before, lookups - lookups_before
+
+    sampler = optuna.samplers.NSGAIISampler(seed=category_seed(category_value))
+    status = "recomputed"
+
+    if STUDY_STORAGE:
+        # 保存先はプロセスごとに1回だけ開き、保存済みの研究の一覧も起動時に作った索引を使う
+        # (ジャーナルファイルは開くたびに全体を読み直すため、鋼種ごとに開くと鋼種数の2乗で遅くなる)
+        storage = g_storage
+        fingerprint = category_fingerprint(category_value)
+        studies = g_study_index.get(str(category_value), [])
+
+        # 入力が前回と同じで、最適化が完了していれば結果をそのまま使う
+        for info in studies:
+            if info["fingerprint"] == fingerprint and info["result_row"]:
+                return info["result_row"], "reused", 0, cache_stats()
+
+        # 保存先の研究（study）は「モデルのバージョン + 鋼種」で決まる
+        study_name = f"{g_model_version[:12]}/{MAIN_CATEGORY_COL}={category_value}"
+        study = optuna.create_study(directions=["minimize", "minimize"], sampler=sampler,
+                                    storage=storage, study_name=study_name, load_if_exists=True)
+
+        # 中断時に評価されないまま残った試行は失敗扱いにする
+        for trial in study.get_trials(deepcopy=False, states=(optuna.trial.TrialState.RUNNING,)):
+            study.tell(trial.number, state=optuna.trial.TrialState.FAIL)
+
+        n_done = len(study.get_trials(deepcopy=False, states=(optuna.trial.TrialState.COMPLETE,)))
+        if n_done:
+            status = "resumed"
+        else:
+            study.set_user_attr("category", str(category_value))
+            # 前回（別のモデル・設定）の同じ鋼種のパレート解から探索を始める
+            previous = [s for s in studies if s["study_name"] != study_name and s["n_trials"]]
+            if previous:
+                latest = max(previous, key=lambda s: s["datetime_start"])
+                warm_start(study, latest["study_name"], storage)
+        # 完了するまでは再利用されないよう、前回の結果を消してから入力のハッシュ値を更新する
+        study.set_user_attr("result_row", None)
+        study.set_user_attr("fingerprint", fingerprint)
+
+        n_run = run_study(study, N_TRIALS_PER_CATEGORY - n_done)
+    else:
+        # 2a. Optunaで多目的最適化（安定性↓、速度↑）を実行
+        study = optuna.create_study(directions=["minimize", "minimize"], sampler=sampler) # [std, -mean]
+        n_run = run_study(study, N_TRIALS_PER_CATEGORY)
+
+    # 2b. 最適化結果（パレート解）から「ベスト」を選ぶ
+    # ここでは「最も速度が速い（-meanが最小）」解を「最適」として採用する
+    best_trial = min(study.best_trials, key=lambda t: t.values[1])
+    
+    optimal_params = best_trial.params
+    optimal_std, optimal_negative_mean = best_trial.values
+    
+    result_row = {
+        MAIN_CATEGORY_COL: category_value,
+        "Predicted_Speed": -optimal_negative_mean,
+        "Predicted_Sigma": optimal_std
+    }
+    # 最適と判断されたパラメータも追加
+    result_row.update(optimal_params)
+
+    if STUDY_STORAGE:
+        # 完了の印として結果を保存（次回、入力が同じなら再利用される）
+        study.set_user_attr("result_row", result_row)
+    return result_row, status, n_run, cache_stats()
+
+
+def init_worker(engine_path, model_info, settings):
+    """ ワーカープロセスの初期化（モデル本体は pickle せず、メモリマップで共有する） """
+    global g_model_data, g_engine, g_encoder, g_cache, g_storage
+    # コマンドライン引数で上書きされた設定値をワーカーにも反映する
+    globals().update(settings)
+    optuna.logging.set_verbosity(optuna.logging.WARNING)
+    warnings.filterwarnings('ignore')
+
+    g_model_data = model_info
+    g_engine = ForestEngine.load(engine_path, mmap_mode="r")
+    g_encoder = CategoryEncoder.from_model_data(model_info)
+    g_cache = make_cache(g_engine)
+    g_storage = open_storage(STUDY_STORAGE) if STUDY_STORAGE else None
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="最適基準テーブル自動生成プログラム")
+    parser.add_argument("--workers", type=int, default=N_WORKERS, help="並列に最適化するプロセス数")
+    parser.add_argument("--trials", type=int, default=N_TRIALS_PER_CATEGORY, help="鋼種ごとの試行回数")
+    parser.add_argument("--batch-size", type=int, default=TRIAL_BATCH_SIZE, help="まとめて評価する試行の数")
+    parser.add_argument("--storage", default=STUDY_STORAGE,
+                        help="途中経過を保存するファイル名またはデータベースURL (空文字で保存しない)")
+    parser.add_argument("--cache-size", type=int, default=PREDICTION_CACHE_SIZE,
+                        help="予測結果を覚えておく件数 (0 で覚えない)")
+    return parser.parse_args()
+
+
 def main():
-    global g_model_data, g_current_main_category_value
+    global g_model_data, g_engine, g_encoder, g_model_version, g_cache, g_storage, g_study_index
+
+    args = parse_args()
+    # 設定値をコマンドライン引数で上書き（ワーカーへは initializer 経由で渡す）
+    settings = {
+        "N_TRIALS_PER_CATEGORY": args.trials,
+        "TRIAL_BATCH_SIZE": args.batch_size,
+        "STUDY_STORAGE": args.storage or None,
+        "PREDICTION_CACHE_SIZE": args.cache_size,
+    }
+    globals().update(settings)
 
     print("--- 最適基準テーブル自動生成プログラム 開始 ---")
     
     # --- 1. 最新モデルとパラメータ範囲の読み込み ---
     print(f"\n[ステップ1: 最新モデル '{MODEL_FILE_NAME}' を読み込み中...]")
+    profiler.stage("ステップ1: 最新モデルの読み込み")
     try:
-        g_model_data = joblib.load(MODEL_FILE_NAME)
+        # 全ツリーをフラット配列にまとめた推論エンジン（コンパクト形式ならメモリマップで開くだけ）
+        g_model_data = load_model(MODEL_FILE_NAME)
     except FileNotFoundError:
         print(f"エラー: モデルファイル '{MODEL_FILE_NAME}' が見つかりません。")
         print("先に `train_model.py` (修正版) を実行してください。")
         sys.exit(1)
+
+    g_engine = g_model_data["engine"]
+    g_encoder = g_model_data["encoder"]
+    g_cache = make_cache(g_engine)
+    g_model_version = file_sha256(g_model_data["source"])
+    settings["g_model_version"] = g_model_version
+
+    if STUDY_STORAGE:
+        # 保存先を先に作成しておく（複数のワーカーが同時に作成しようとして衝突するのを防ぐ）
+        g_storage = open_storage(STUDY_STORAGE)
+        g_storage, g_study_index, n_pruned = prune_studies(
+            STUDY_STORAGE, g_storage, build_study_index(g_storage), g_model_version)
+        # ワーカーには索引を渡す（各ワーカーは保存先を1回だけ開き、研究の一覧は読み直さない）
+        settings["g_study_index"] = g_study_index
+        print(f"途中経過の保存先: {STUDY_STORAGE}")
+        if n_pruned:
+            print(f"  以前のモデルの古い研究 {n_pruned} 件を削除しました。")
     
     param_ranges = g_model_data["param_ranges"]
     
@@ -123,43 +493,81 @@ def main():
     print(f"モデル読み込み完了。'{MAIN_CATEGORY_COL}' の全 {len(main_categories_list)} 種類について最適化を開始します。")
 
     # --- 2. 鋼種ごとに最適化ループを実行 ---
+    profiler.stage("ステップ2: 鋼種ごとの最適化")
     optimal_results = []
+    status_counts = {"reused": 0, "resumed": 0, "recomputed": 0}
+    cache_hits = cache_lookups = 0
+    # この実行で実際に行った試行の数（再利用した鋼種・再開前に済んでいた試行は含めない）
+    n_total_trials = 0
+    n_categories = len(main_categories_list)
+    start_time = time.perf_counter()
     
-    for i, category_value in enumerate(main_categories_list):
-        g_current_main_category_value = category_value # グローバル変数を設定
-        
-        print(f"\n[{i+1}/{len(main_categories_list)}] '{category_value}' の最適条件を探索中 (試行 {N_TRIALS_PER_CATEGORY} 回)...")
-        
-        # 2a. Optunaで多目的最適化（安定性↓、速度↑）を実行
-        study = optuna.create_study(directions=["minimize", "minimize"]) # [std, -mean]
-        study.optimize(objective, n_trials=N_TRIALS_PER_CATEGORY)
-
-        # 2b. 最適化結果（パレート解）から「ベスト」を選ぶ
-        # ここでは「最も速度が速い（-meanが最小）」解を「最適」として採用する
-        best_trial = min(study.best_trials, key=lambda t: t.values[1])
-        
-        optimal_params = best_trial.params
-        optimal_std, optimal_negative_mean = best_trial.values
-        
-        result_row = {
-            MAIN_CATEGORY_COL: category_value,
-            "Predicted_Speed": -optimal_negative_mean,
-            "Predicted_Sigma": optimal_std
-        }
-        # 最適と判断されたパラメータも追加
-        result_row.update(optimal_params)
-        optimal_results.append(result_row)
+    if args.workers <= 1:
+        for i, category_value in enumerate(main_categories_list):
+            print(f"\n[{i+1}/{n_categories}] '{category_value}' の最適条件を探索中 (試行 {N_TRIALS_PER_CATEGORY} 回)...")
+            category_start = time.perf_counter()
+            result_row, status, n_run, (hits, lookups) = optimize_category(category_value)
+            optimal_results.append(result_row)
+            status_counts[status] += 1
+            n_total_trials += n_run
+            cache_hits += hits
+            cache_lookups += lookups
+            category_elapsed = time.perf_counter() - category_start
+            if status == "reused":
+                print("  モデルと設定が前回と同じため、前回の結果を再利用しました。")
+            else:
+                print(f"  完了: {n_run} 試行, {category_elapsed:.2f} 秒 ({n_run / max(category_elapsed, 1e-9):.0f} 試行/秒)")
+            if g_cache is not None:
+                print(f"  予測キャッシュのヒット: {hit_rate_text(hits, lookups)}")
+    else:
+        print(f"{args.workers} プロセスで並列に最適化します (各 {N_TRIALS_PER_CATEGORY} 回の試行)...")
+        # ワーカーに渡すのは小さな情報だけ（学習済みモデル本体は渡さない）
+        model_info = {key: value for key, value in g_model_data.items() if key not in ("model", "engine")}
+        with tempfile.TemporaryDirectory() as engine_dir:
+            # ノード配列をファイルに書き出し、全ワーカーから読み取り専用でメモリマップする
+            # (コンパクト形式から読み込んだ場合は、そのファイルをそのまま共有する)
+            if "model" in g_model_data:
+                g_engine.save(engine_dir)
+                engine_path = engine_dir
+            else:
+                engine_path = g_model_data["source"]
+            with concurrent.futures.ProcessPoolExecutor(
+                max_workers=args.workers, initializer=init_worker,
+                initargs=(engine_path, model_info, settings)
+            ) as executor:
+                # map は入力順に結果を返すため、出力の並びもプロセス数に依存しない
+                for i, (result_row, status, n_run, (hits, lookups)) in enumerate(
+                        executor.map(optimize_category, main_categories_list)):
+                    print(f"[{i+1}/{n_categories}] '{result_row[MAIN_CATEGORY_COL]}' の最適化が完了しました。"
+                          f"({status}, {n_run} 試行)")
+                    optimal_results.append(result_row)
+                    status_counts[status] += 1
+                    n_total_trials += n_run
+                    cache_hits += hits
+                    cache_lookups += lookups
 
+    elapsed = time.perf_counter() - start_time
     print("\n--- 全ての最適化が完了しました ---")
+    print(f"  全 {n_total_trials} 試行, {elapsed:.2f} 秒 ({n_total_trials / max(elapsed, 1e-9):.0f} 試行/秒)")
+    print(f"  再利用: {status_counts['reused']} 種類, 再開: {status_counts['resumed']} 種類, "
+          f"再計算: {status_counts['recomputed']} 種類")
+    if g_cache is not None:
+        print(f"  予測キャッシュのヒット: {hit_rate_text(cache_hits, cache_lookups)}")
+    profiler.count("trials", n_total_trials)
+    profiler.count("cache_hits", cache_hits)
+    profiler.count("cache_lookups", cache_lookups)
+    for status, count in status_counts.items():
+        profiler.count(f"categories_{status}", count)
 
     # --- 3. 最適基準テーブルをCSVに保存 ---
+    profiler.stage("ステップ3: 基準テーブルの保存")
     optimal_df = pd.DataFrame(optimal_results)
     
     # 列順を整理
     cols_order = [MAIN_CATEGORY_COL, "Predicted_Speed", "Predicted_Sigma"] + \
                  OPTIMIZE_COLS_NUMERIC + OPTIMIZE_COLS_CATEGORICAL
     optimal_df = optimal_df[cols_order]
-    optimal_df = optimal_df.sort_values(by="Predicted_Speed", ascending=False)
+    optimal_df = optimal_df.sort_values(by="Predicted_Speed", ascending=False, kind="stable")
     
     optimal_df.to_csv(OUTPUT_TABLE_CSV, index=False, encoding='utf-8-sig')
     
@@ -169,4 +577,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
@@ -1,7 +1,12 @@
-import joblib
-import pandas as pd
 import numpy as np
+import argparse
+import functools
+import os
 import sys
+import time
+from model_artifact import load_model
+from response_table import ResponseTable, response_table_path
+from instrumentation import profiler
 
 # ----------------------------------------------------
 # ▼ ユーザー設定項目 ▼
@@ -10,12 +15,65 @@ import sys
 # 1. 読み込むモデルファイル名
 MODEL_FILE_NAME = "casting_speed_model.joblib"
 
+# 1b. 同じ名前で拡張子 ".forest" のコンパクト形式があれば、そちらをメモリマップで開くか（--compact でも指定できます）
+# (起動が速く scikit-learn も不要ですが、予測値は float32 に丸められるため、
+#  joblib のモデルの予測とは予測値の大きさの 1e-7 倍程度の相対誤差で異なります。
+#  False なら joblib のモデルを使い、学習したモデルの予測と浮動小数点の丸め誤差の範囲で一致します)
+USE_COMPACT_MODEL = False
+
+# 2. バッチ予測モードで一度に読み込む行数
+# (大きいほど高速ですが、その分メモリを使います。入力全体の大きさには依存しません)
+BATCH_CHUNK_SIZE = 10000
+
+# 3. 応答曲面テーブル（`response_table.py` で作成、拡張子 ".surface"）があれば、ツリーを辿らずに表から予測するか
+# (表の予測はモデルの予測と浮動小数点の丸め誤差の範囲で一致します。モデルより古い表は使いません)
+USE_RESPONSE_TABLE = True
+
 # ----------------------------------------------------
 # ▲ ユーザー設定項目はここまで ▲
 # ----------------------------------------------------
 
 
-def predict_speed(model, model_columns, numeric_cols, categorical_cols):
+def open_response_table(model_data, log):
+    """ モデルに対応する応答曲面テーブルをメモリマップで開く（ない・古い場合は None） """
+    path = response_table_path(MODEL_FILE_NAME)
+    if not os.path.exists(path):
+        return None
+    try:
+        table = ResponseTable.load(path)
+    except (OSError, ValueError) as e:
+        log(f"警告: 応答曲面テーブルを読み込めないため使いません。 {e}")
+        return None
+    if os.path.getmtime(path) < os.path.getmtime(model_data["source"]) or not table.matches(model_data):
+        log(f"警告: 応答曲面テーブル '{path}' がモデルより古いため使いません。(`response_table.py` で作り直してください)")
+        return None
+    return table
+
+
+def predict_rows(engine, table, X_input):
+    """ 各行の予測平均とシグマ（表があれば表から引き、表にない行だけツリーを辿る） """
+    if table is None:
+        profiler.count("tree_evaluations", len(X_input) * engine.n_trees)
+        return engine.predict_mean_std(X_input)
+
+    pred_mean, pred_std, found = table.lookup(X_input)
+    profiler.count("table_lookups", int(found.sum()))
+    if not found.all():
+        # 学習時に存在しなかったカテゴリ値・欠損値を含む行
+        pred_mean[~found], pred_std[~found] = engine.predict_mean_std(X_input[~found])
+        profiler.count("tree_evaluations", int((~found).sum()) * engine.n_trees)
+    return pred_mean, pred_std
+
+
+def outside_ranges(X_input, encoder, param_ranges):
+    """ 数値の項目が学習範囲（param_ranges）の外にあるかの bool 行列 (n_rows, 数値の項目数) """
+    values = X_input[:, encoder.numeric_index]
+    lower = np.array([param_ranges[col]["min"] for col in encoder.numeric_cols])
+    upper = np.array([param_ranges[col]["max"] for col in encoder.numeric_cols])
+    return (values < lower) | (values > upper)
+
+
+def predict_speed(engine, encoder, numeric_cols, categorical_cols, table=None, param_ranges=None):
     """ 対話的に入力を受け取り、予測を実行する関数 """
     
     print("\n--- 鋳造速度 予測 ---")
@@ -42,27 +100,25 @@ def predict_speed(model, model_columns, numeric_cols, categorical_cols):
             return False # 終了フラグ
         input_data[col] = [val]
 
-    # 3. 入力データをDataFrameに変換
-    df_input = pd.DataFrame(input_data)
-    
-    # 4. 学習時と同様にダミー変数化
-    df_input_processed = pd.get_dummies(df_input, columns=categorical_cols, dummy_na=False)
-    
-    # 5. 学習時の列構成に合わせる (入力になかったダミー列は 0 で埋める)
-    df_input_processed = df_input_processed.reindex(columns=model_columns, fill_value=0)
-    
-    X_input = df_input_processed.values
+    # 3-5. 学習時と同じ列構成の数値行列に変換（カテゴリ値は対応する列に直接 1 を立てる）
+    X_input, unknown = encoder.transform(input_data)
+    if unknown[0]:
+        unknown_cols = [col for col in categorical_cols if input_data[col][0] not in encoder.category_keys[col]]
+        print(f"警告: 学習データに存在しない値が入力されました: {unknown_cols} (この項目の影響は考慮されません)")
+    if param_ranges is not None:
+        outside = outside_ranges(X_input, encoder, param_ranges)[0]
+        for col, is_outside in zip(encoder.numeric_cols, outside):
+            if is_outside:
+                r = param_ranges[col]
+                print(f"警告: {col} が学習範囲 ({r['min']} 〜 {r['max']}) の外です (予測の信頼性が下がります)")
     
     # 6. 予測の実行（平均とシグマ）
-    all_trees = model.estimators_
-    
-    # 予測値（全ツリー分）を計算
-    predictions = [tree.predict(X_input)[0] for tree in all_trees]
-    
-    # 平均値（予測速度）
-    pred_mean = np.mean(predictions)
-    # 標準偏差（予測の安定性・シグマ）
-    pred_std = np.std(predictions)
+    # 全ツリーの予測値を一括で計算し（応答曲面テーブルがあれば表から引き）、
+    # 平均値（予測速度）と標準偏差（予測の安定性・シグマ）を求める
+    pred_means, pred_stds = predict_rows(engine, table, X_input)
+    profiler.count("rows_predicted", 1)
+    pred_mean = pred_means[0]
+    pred_std = pred_stds[0]
 
     print("\n--- 予測結果 ---")
     print(f"  予測 鋳造速度   : {pred_mean:.4f}")
@@ -72,28 +128,150 @@ def predict_speed(model, model_columns, numeric_cols, categorical_cols):
     return True # 継続フラグ
 
 
+def predict_order(engine, encoder, numeric_cols, categorical_cols, order_items, table=None, param_ranges=None):
+    """ コマンドラインで渡された1件の操業命令（列名=値）を予測し、CSV の1行として出力する関数 """
+    order = dict(item.split("=", 1) for item in order_items if "=" in item)
+    missing_cols = [col for col in numeric_cols + categorical_cols if col not in order]
+    if missing_cols:
+        print(f"エラー: 操業命令に必要な項目がありません: {missing_cols}", file=sys.stderr)
+        sys.exit(1)
+
+    try:
+        input_data = {col: [float(order[col])] for col in numeric_cols}
+    except ValueError:
+        print("エラー: 数値の項目には数値を指定してください。", file=sys.stderr)
+        sys.exit(1)
+    input_data.update({col: [order[col]] for col in categorical_cols})
+
+    X_input, unknown = encoder.transform(input_data)
+    pred_mean, pred_std = predict_rows(engine, table, X_input)
+    profiler.count("rows_predicted", 1)
+    outside = param_ranges is not None and bool(outside_ranges(X_input, encoder, param_ranges)[0].any())
+    print("pred_mean,pred_std,unknown_category,out_of_range")
+    print(f"{pred_mean[0]},{pred_std[0]},{bool(unknown[0])},{outside}")
+
+
+def read_order_chunks(input_path, input_format, categorical_cols, chunk_size):
+    """ 操業命令ファイル（CSV / JSONL、'-' は標準入力）をチャンク単位で読み込む """
+    import pandas as pd  # pandas は一括予測のときだけ読み込む（対話・1件予測は NumPy だけで動く）
+
+    source = sys.stdin if input_path == "-" else input_path
+    if input_format == "jsonl":
+        return pd.read_json(source, lines=True, chunksize=chunk_size, dtype={col: str for col in categorical_cols})
+    # カテゴリ変数は対話モードと同じく「文字列」として扱う
+    return pd.read_csv(source, chunksize=chunk_size, dtype={col: str for col in categorical_cols})
+
+
+def predict_batch(engine, encoder, numeric_cols, categorical_cols,
+                  input_path, output_path, input_format, chunk_size, table=None, param_ranges=None):
+    """ ファイルの操業命令を一括で予測し、pred_mean / pred_std を逐次書き出す関数 """
+    log = functools.partial(print, file=sys.stderr)
+
+    required_cols = numeric_cols + categorical_cols
+    out = sys.stdout if output_path == "-" else open(output_path, "w", encoding="utf-8", newline="")
+
+    n_rows = 0
+    n_outside = 0
+    start_time = time.perf_counter()
+    try:
+        for i, df_chunk in enumerate(read_order_chunks(input_path, input_format, categorical_cols, chunk_size)):
+            missing_cols = [col for col in required_cols if col not in df_chunk.columns]
+            if missing_cols:
+                log(f"エラー: 入力ファイルに必要な列がありません: {missing_cols}")
+                sys.exit(1)
+
+            X_input, unknown = encoder.transform(df_chunk)
+            pred_mean, pred_std = predict_rows(engine, table, X_input)
+            profiler.count("rows_predicted", len(X_input))
+
+            df_chunk = df_chunk.assign(pred_mean=pred_mean, pred_std=pred_std, unknown_category=unknown)
+            if param_ranges is not None:
+                outside = outside_ranges(X_input, encoder, param_ranges).any(axis=1)
+                n_outside += int(outside.sum())
+                df_chunk = df_chunk.assign(out_of_range=outside)
+            df_chunk.to_csv(out, index=False, header=(i == 0))
+
+            n_rows += len(df_chunk)
+            elapsed = time.perf_counter() - start_time
+            log(f"  {n_rows} 件を予測しました ({n_rows / max(elapsed, 1e-9):.0f} 件/秒)")
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - start_time
+    log(f"バッチ予測完了: 全 {n_rows} 件, {elapsed:.2f} 秒 ({n_rows / max(elapsed, 1e-9):.0f} 件/秒)")
+    for col, count in encoder.unknown_counts.items():
+        if count:
+            log(f"  警告: '{col}' に学習データに存在しない値が {count} 件ありました (unknown_category 列を参照)")
+    if n_outside:
+        log(f"  警告: 数値の項目が学習範囲の外にある行が {n_outside} 件ありました (out_of_range 列を参照)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="鋳造速度 予測プログラム（引数なしで対話モード）")
+    parser.add_argument("--input", "-i", help="一括予測する操業命令ファイル (CSV / JSONL, '-' で標準入力)")
+    parser.add_argument("--output", "-o", default="-", help="予測結果の出力先 CSV ('-' で標準出力, 既定値)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="入力形式 (省略時は拡張子から判定, 標準入力は csv)")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE, help="一度に読み込む行数")
+    parser.add_argument("--order", nargs="+", metavar="列名=値",
+                        help="1件だけ予測して終了する (例: --order Temp=1550 Pressure=2.1 Pattern=P1 Steel_Code=S03)")
+    parser.add_argument("--no-table", action="store_true", help="応答曲面テーブルを使わず、常にツリーを辿って予測する")
+    parser.add_argument("--compact", action="store_true", default=USE_COMPACT_MODEL,
+                        help="コンパクト形式のモデル (.forest) があれば使う (起動が速いが、予測値は float32 精度)")
+    return parser.parse_args()
+
+
 def main():
-    print("... 予測モデルを読み込み中 ...")
+    args = parse_args()
+    # バッチモード・1件予測では標準出力を予測結果に使うため、進捗は標準エラーに出す
+    log = functools.partial(print, file=sys.stderr) if args.input or args.order else print
+
+    log("... 予測モデルを読み込み中 ...")
+    profiler.stage("モデルの読み込み")
     try:
-        model_data = joblib.load(MODEL_FILE_NAME)
+        # --compact でコンパクト形式があれば、全ツリーのフラット配列をメモリマップで開くだけで済む
+        # (それ以外は joblib のモデルから推論エンジンを作る)
+        model_data = load_model(MODEL_FILE_NAME, prefer_compact=args.compact)
     except FileNotFoundError:
-        print(f"エラー: モデルファイル '{MODEL_FILE_NAME}' が見つかりません。")
-        print("先に `train_model.py` を実行してモデルを生成してください。")
+        log(f"エラー: モデルファイル '{MODEL_FILE_NAME}' が見つかりません。")
+        log("先に `train_model.py` を実行してモデルを生成してください。")
         sys.exit(1)
     except Exception as e:
-        print(f"エラー: モデルの読み込みに失敗しました。 {e}")
+        log(f"エラー: モデルの読み込みに失敗しました。 {e}")
         sys.exit(1)
 
-    model = model_data["model"]
-    model_columns = model_data["model_columns"]
+    engine = model_data["engine"]
+    encoder = model_data["encoder"]
     numeric_cols = model_data["original_cols_numeric"]
     categorical_cols = model_data["original_cols_categorical"]
+    param_ranges = model_data["param_ranges"]
     
-    print("モデルの読み込み完了。")
+    log(f"モデルの読み込み完了。({model_data['source']})")
+    if "model" not in model_data:
+        log("  コンパクト形式のため、予測値は float32 精度です (joblib のモデルとは予測値の 1e-7 倍程度異なります)")
+    table = open_response_table(model_data, log) if USE_RESPONSE_TABLE and not args.no_table else None
+    if table is not None:
+        log(f"応答曲面テーブルから予測します。({response_table_path(MODEL_FILE_NAME)})")
+    profiler.stage("予測")
+
+    # 1件予測（シェルスクリプトから操業命令ごとに呼び出す用途）
+    if args.order:
+        predict_order(engine, encoder, numeric_cols, categorical_cols, args.order, table, param_ranges)
+        return
+
+    # バッチ（非対話）モード
+    if args.input:
+        input_format = args.format
+        if input_format is None:
+            ext = os.path.splitext(args.input)[1].lower()
+            input_format = "jsonl" if ext in (".jsonl", ".ndjson") else "csv"
+        predict_batch(engine, encoder, numeric_cols, categorical_cols,
+                      args.input, args.output, input_format, args.chunk_size, table, param_ranges)
+        return
 
     # 予測ループ開始
     while True:
-        if not predict_speed(model, model_columns, numeric_cols, categorical_cols):
+        if not predict_speed(engine, encoder, numeric_cols, categorical_cols, table, param_ranges):
             break
             
     print("予測プログラムを終了します。")
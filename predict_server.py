@@ -0,0 +1,341 @@
+import asyncio
+import collections
+import http
+import json
+import sys
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from forest_engine import ForestEngine
+from category_encoder import CategoryEncoder
+from predict import outside_ranges
+
+# ----------------------------------------------------
+# ▼ ユーザー設定項目 ▼
+# ----------------------------------------------------
+
+# 1. 読み込むモデルファイル名
+MODEL_FILE_NAME = "casting_speed_model.joblib"
+
+# 2. 待ち受けるホストとポート
+HOST = "127.0.0.1"
+PORT = 8765
+
+# 3. マイクロバッチの待ち時間（ミリ秒）
+# (この時間内に届いたリクエストをまとめて1回の森の評価で処理します)
+BATCH_WINDOW_MS = 5
+
+# 4. 1回のバッチでまとめる最大行数
+MAX_BATCH_ROWS = 4096
+
+# 5. SHAP解説で返す寄与度の件数
+EXPLAIN_TOP_N = 3
+
+# 6. リクエスト本文の最大バイト数（超える場合は本文を読まずに 413 を返します）
+MAX_BODY_BYTES = 10 * 2**20
+
+# ----------------------------------------------------
+# ▲ ユーザー設定項目はここまで ▲
+# ----------------------------------------------------
+
+# レイテンシ統計として保持する直近のリクエスト数
+LATENCY_WINDOW = 10000
+
+
+class MicroBatcher:
+    """ 短時間に届いたリクエストを1つのバッチにまとめて評価する """
+
+    def __init__(self, batch_fn, window_ms, max_rows):
+        self.batch_fn = batch_fn    # (行列 X) -> 行ごとの結果リスト
+        self.window = window_ms / 1000.0
+        self.max_rows = max_rows
+        self.queue = asyncio.Queue()
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+        self.n_requests = 0
+        self.n_batches = 0
+        self.n_rows = 0
+
+    async def submit(self, X):
+        """ 行列 X をキューに入れ、バッチ評価の結果を待つ """
+        start = time.perf_counter()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((X, future))
+        result = await future
+        self.latencies.append(time.perf_counter() - start)
+        self.n_requests += 1
+        return result
+
+    async def run(self):
+        """ キューからリクエストを取り出し、まとめて評価し続ける """
+        loop = asyncio.get_running_loop()
+        while True:
+            items = [await self.queue.get()]
+            n_rows = len(items[0][0])
+            deadline = loop.time() + self.window
+
+            # 待ち時間内に届いたリクエストを上限行数まで追加
+            while n_rows < self.max_rows:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                items.append(item)
+                n_rows += len(item[0])
+
+            X = np.concatenate([X for X, _ in items])
+            try:
+                # 森の評価はイベントループを止めないよう別スレッドで行う
+                results = await loop.run_in_executor(None, self.batch_fn, X)
+            except Exception as e:
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.n_batches += 1
+            self.n_rows += n_rows
+            offset = 0
+            for X_item, future in items:
+                if not future.done():
+                    future.set_result(results[offset:offset + len(X_item)])
+                offset += len(X_item)
+
+    def stats(self):
+        """ p50/p99 レイテンシとキューの深さを返す """
+        latencies_ms = np.array(self.latencies) * 1000.0
+        return {
+            "requests": self.n_requests,
+            "batches": self.n_batches,
+            "rows": self.n_rows,
+            "avg_batch_rows": self.n_rows / self.n_batches if self.n_batches else 0.0,
+            "queue_depth": self.queue.qsize(),
+            "latency_p50_ms": float(np.percentile(latencies_ms, 50)) if len(latencies_ms) else None,
+            "latency_p99_ms": float(np.percentile(latencies_ms, 99)) if len(latencies_ms) else None,
+        }
+
+
+class PredictionService:
+    """ モデルを1回だけ読み込み、予測と解説のバッチ関数を提供する """
+
+    def __init__(self, model_data):
+        self.model = model_data["model"]
+        self.model_columns = model_data["model_columns"]
+        self.numeric_cols = model_data["original_cols_numeric"]
+        self.categorical_cols = model_data["original_cols_categorical"]
+        self.engine = ForestEngine.from_model(self.model)
+        self.encoder = CategoryEncoder.from_model_data(model_data)
+        self.param_ranges = model_data.get("param_ranges")
+        # ダミー変数ごとのSHAP値を元の特徴量に集約する行列（列番号で対応づけ、起動時に1回だけ作る）
+        self.original_features = self.numeric_cols + self.categorical_cols
+        self.aggregation = self.encoder.aggregation_matrix()
+        self.explainer = None
+
+    def encode(self, orders):
+        """
+        操業命令（辞書のリスト）をモデルの入力行列に変換する
+        戻り値: (行列 X, 行ごとの注意情報 {"unknown_category", "out_of_range"} のリスト)
+        形式が正しくない・必要な項目がない場合は ValueError
+        """
+        if not isinstance(orders, list) or not all(isinstance(order, dict) for order in orders):
+            raise ValueError("操業命令は項目名と値の辞書、またはそのリストで指定してください")
+        required_cols = self.numeric_cols + self.categorical_cols
+        for i, order in enumerate(orders):
+            missing_cols = [col for col in required_cols if col not in order]
+            if missing_cols:
+                raise ValueError(f"{i} 件目の操業命令に必要な項目がありません: {missing_cols}")
+
+        X, unknown = self.encoder.transform(pd.DataFrame(orders))
+        if self.param_ranges is not None:
+            outside = outside_ranges(X, self.encoder, self.param_ranges).any(axis=1)
+        else:
+            outside = np.zeros(len(X), dtype=bool)
+        flags = [{"unknown_category": bool(u), "out_of_range": bool(o)} for u, o in zip(unknown, outside)]
+        return X, flags
+
+    def predict(self, X):
+        pred_mean, pred_std = self.engine.predict_mean_std(X)
+        return [{"pred_mean": float(m), "pred_std": float(s)} for m, s in zip(pred_mean, pred_std)]
+
+    def explain(self, X):
+        if self.explainer is None:
+            import shap  # SHAPは解説が要求されたときだけ読み込む
+            self.explainer = shap.TreeExplainer(self.model)
+
+        pred_mean, pred_std = self.engine.predict_mean_std(X)
+        shap_values = np.asarray(self.explainer.shap_values(X))
+        base_value = float(np.ravel(self.explainer.expected_value)[0])
+
+        # ダミー変数ごとのSHAP値を元の特徴量に集約する（集約行列との積1回）
+        shap_agg = shap_values.reshape(len(X), -1) @ self.aggregation
+
+        # 行ごとに寄与度の絶対値が大きい順に並べる
+        order = np.argsort(-np.abs(shap_agg), axis=1, kind="stable")[:, :EXPLAIN_TOP_N]
+        top_values = np.take_along_axis(shap_agg, order, axis=1)
+        return [
+            {
+                "pred_mean": float(pred_mean[i]),
+                "pred_std": float(pred_std[i]),
+                "base_value": base_value,
+                "contributions": [
+                    {"feature": self.original_features[k], "shap_value": float(v)}
+                    for k, v in zip(order[i], top_values[i])
+                ],
+            }
+            for i in range(len(X))
+        ]
+
+
+class PredictionServer:
+    """ 標準ライブラリの asyncio だけで動く最小限の HTTP/1.1 サーバー """
+
+    def __init__(self, service):
+        self.service = service
+        self.batchers = {
+            "/predict": MicroBatcher(service.predict, BATCH_WINDOW_MS, MAX_BATCH_ROWS),
+            "/explain": MicroBatcher(service.explain, BATCH_WINDOW_MS, MAX_BATCH_ROWS),
+        }
+        self.started_at = time.time()
+        self.tasks = []
+
+    async def handle_request(self, method, path, body):
+        """ (ステータス, 応答JSON) を返す """
+        if method == "GET" and path == "/health":
+            return 200, {"status": "ok"}
+
+        if method == "GET" and path == "/stats":
+            return 200, {
+                "uptime_sec": time.time() - self.started_at,
+                "endpoints": {name: batcher.stats() for name, batcher in self.batchers.items()},
+                "unknown_category_counts": self.service.encoder.unknown_counts,
+            }
+
+        if method == "POST" and path in self.batchers:
+            try:
+                payload = json.loads(body or b"{}")
+                # {"orders": [...]} / [...] / {...}（1件）のいずれも受け付ける
+                orders = payload.get("orders", [payload]) if isinstance(payload, dict) else payload
+                if not orders:
+                    raise ValueError("操業命令が空です")
+                X, flags = self.service.encode(orders)
+            except (ValueError, TypeError) as e:
+                return 400, {"error": str(e)}
+
+            results = await self.batchers[path].submit(X)
+            # 学習時になかったカテゴリ値・学習範囲外の値は、行ごとに結果に含めて返す
+            return 200, {"results": [dict(result, **flag) for result, flag in zip(results, flags)]}
+
+        return 404, {"error": f"{method} {path} は存在しません"}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, _ = request_line.decode("latin-1").split(" ", 2)
+                except ValueError:
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    name, _, value = line.decode("latin-1").partition(":")
+                    headers[name.strip().lower()] = value.strip()
+
+                try:
+                    content_length = int(headers.get("content-length", 0))
+                    if content_length < 0:
+                        raise ValueError
+                except ValueError:
+                    # 本文の長さが分からないと次の要求の区切りも分からないため、応答して接続を閉じる
+                    await self.write_response(writer, 400, {"error": "Content-Length が不正です"}, keep_alive=False)
+                    break
+                if content_length > MAX_BODY_BYTES:
+                    # 本文は読まずに応答し、接続を閉じる
+                    await self.write_response(writer, 413, {"error": f"本文が上限 ({MAX_BODY_BYTES} バイト) を超えています"},
+                                              keep_alive=False)
+                    break
+
+                body = await reader.readexactly(content_length)
+                path = target.split("?", 1)[0]
+
+                try:
+                    status, response = await self.handle_request(method.upper(), path, body)
+                except Exception as e:
+                    status, response = 500, {"error": str(e)}
+
+                keep_alive = headers.get("connection", "").lower() != "close"
+                await self.write_response(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def write_response(writer, status, response, keep_alive):
+        """ JSON の応答を1件書き出す """
+        data = json.dumps(response, ensure_ascii=False).encode("utf-8")
+        writer.write(
+            f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(data)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode("latin-1") + data
+        )
+        await writer.drain()
+
+    @staticmethod
+    def report_task_error(task):
+        """ バッチ処理のタスクが異常終了したら、その場で知らせる（黙って止まらないようにする） """
+        if not task.cancelled() and task.exception() is not None:
+            print(f"エラー: バッチ処理のタスクが停止しました: {task.exception()!r}", file=sys.stderr)
+
+    async def serve(self, host, port):
+        # タスクへの参照を保持しておく（参照がないタスクはガベージコレクションで消えることがある）
+        for batcher in self.batchers.values():
+            task = asyncio.create_task(batcher.run())
+            task.add_done_callback(self.report_task_error)
+            self.tasks.append(task)
+        try:
+            server = await asyncio.start_server(self.handle_connection, host, port)
+            print(f"予測サーバーを起動しました: http://{host}:{port}")
+            print("  POST /predict, POST /explain, GET /stats, GET /health")
+            async with server:
+                await server.serve_forever()
+        finally:
+            # 終了時はバッチ処理のタスクを止め、終わるまで待つ
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+
+def main():
+    print("... 予測モデルを読み込み中 ...")
+    try:
+        model_data = joblib.load(MODEL_FILE_NAME)
+    except FileNotFoundError:
+        print(f"エラー: モデルファイル '{MODEL_FILE_NAME}' が見つかりません。")
+        print("先に `trainmodel.py` を実行してモデルを生成してください。")
+        sys.exit(1)
+
+    service = PredictionService(model_data)
+    print("モデルの読み込み完了。")
+
+    try:
+        asyncio.run(PredictionServer(service).serve(HOST, PORT))
+    except KeyboardInterrupt:
+        print("予測サーバーを終了します。")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,18 @@
 import joblib
-import pandas as pd
 import numpy as np
+import argparse
+import collections
+import concurrent.futures
+import functools
+import os
 import sys
+import time
+import warnings
 import shap # SHAPライブラリをインポート
+from forest_engine import ForestEngine
+from category_encoder import CategoryEncoder
+from predict import read_order_chunks
+from instrumentation import profiler
 
 # ----------------------------------------------------
 # ▼ ユーザー設定項目 ▼
@@ -11,6 +21,16 @@ import shap # SHAPライブラリをインポート
 # 1. 読み込むモデルファイル名
 MODEL_FILE_NAME = "casting_speed_model.joblib"
 
+# 2. 根拠として表示・出力する寄与度の件数（寄与度の絶対値が大きい順）
+EXPLAIN_TOP_N = 3
+
+# 3. 一括解説モードで一度に読み込む行数
+# (SHAPの計算は予測よりずっと重いため、予測の一括モードより小さめにしています)
+BATCH_CHUNK_SIZE = 2000
+
+# 4. 一括解説モードの並列プロセス数（1 なら1プロセスで順番に計算）
+N_WORKERS = 1
+
 # ----------------------------------------------------
 # ▲ ユーザー設定項目はここまで ▲
 # ----------------------------------------------------
@@ -18,13 +38,48 @@ MODEL_FILE_NAME = "casting_speed_model.joblib"
 # SHAP Explainerをグローバルで初期化（起動時に1回だけ）
 explainer = None
 base_value = None
+g_engine = None
+g_aggregation = None
+
+
+def init_explainer(model_data):
+    """ 推論エンジン・SHAP Explainer・ダミー変数の集約行列を作る（プロセスごとに1回だけ） """
+    global explainer, base_value, g_engine, g_aggregation
+    # 全ツリーをフラット配列にまとめた推論エンジン
+    g_engine = ForestEngine.from_model(model_data["model"])
+    # TreeExplainerはRandomForestに高速
+    explainer = shap.TreeExplainer(model_data["model"])
+    # SHAPのベース値（全データの平均予測値）
+    base_value = float(np.ravel(explainer.expected_value)[0])
+    # ダミー変数ごとのSHAP値を元の特徴量に集約する行列（列番号で対応づけ、1回だけ作る）
+    g_aggregation = CategoryEncoder.from_model_data(model_data).aggregation_matrix()
+
+
+def init_explain_worker(model_file_name):
+    """ ワーカープロセスの初期化（モデルは各ワーカーがファイルから読み込む） """
+    warnings.filterwarnings('ignore')
+    init_explainer(joblib.load(model_file_name))
+
+
+def explain_rows(X):
+    """ 各行の予測（平均・シグマ）と、元の特徴量ごとに集約したSHAP値 (n_rows, 元の特徴量の数) を返す """
+    pred_mean, pred_std = g_engine.predict_mean_std(X)
+    shap_values = np.asarray(explainer.shap_values(X)).reshape(len(X), -1)
+    return pred_mean, pred_std, shap_values @ g_aggregation
+
 
-def predict_speed(model, model_columns, numeric_cols, categorical_cols, original_features):
+def top_contributions(shap_agg, top_n):
+    """ 各行で寄与度の絶対値が大きい順に top_n 個の (特徴量番号, SHAP値) を返す """
+    order = np.argsort(-np.abs(shap_agg), axis=1, kind="stable")[:, :top_n]
+    return order, np.take_along_axis(shap_agg, order, axis=1)
+
+
+def predict_speed(encoder, numeric_cols, categorical_cols, original_features):
     """ 対話的に入力を受け取り、予測と「SHAPによる根拠」を実行する関数 """
-    
+
     print("\n--- 鋳造速度 予測 (解説付き) ---")
     print("操業命令を入力してください。(終了する場合は 'exit' と入力)")
-    
+
     input_data = {}
 
     # 1. 数値データの入力
@@ -46,96 +101,161 @@ def predict_speed(model, model_columns, numeric_cols, categorical_cols, original
             return False
         input_data[col] = [val]
 
-    # 3. 入力データをDataFrameに変換
-    df_input = pd.DataFrame(input_data)
-    
-    # 4. 学習時と同様にダミー変数化
-    df_input_processed = pd.get_dummies(df_input, columns=categorical_cols, dummy_na=False)
-    
-    # 5. 学習時の列構成に合わせる
-    df_input_processed = df_input_processed.reindex(columns=model_columns, fill_value=0)
-    
-    X_input = df_input_processed.values
-    
-    # 6. 予測の実行（平均とシグマ）
-    all_trees = model.estimators_
-    predictions = [tree.predict(X_input)[0] for tree in all_trees]
-    pred_mean = np.mean(predictions)
-    pred_std = np.std(predictions)
+    # 3-5. 学習時と同じ列構成の数値行列に変換
+    X_input, unknown = encoder.transform(input_data)
+    if unknown[0]:
+        unknown_cols = [col for col in categorical_cols if input_data[col][0] not in encoder.category_keys[col]]
+        print(f"警告: 学習データに存在しない値が入力されました: {unknown_cols} (この項目の影響は考慮されません)")
+
+    # 6-7. 予測の実行（平均とシグマ）と、SHAPによる「予測根拠」の計算
+    # (SHAP値はダミー変数ごと（例: Steel_Code_A, Steel_Code_B）に出るため、
+    #  集約行列との積で元の変数名（例: Steel_Code）ごとの合計にまとめる)
+    pred_means, pred_stds, shap_agg = explain_rows(X_input)
+    profiler.count("rows_explained", 1)
+    pred_mean = pred_means[0]
+    pred_std = pred_stds[0]
 
     print("\n--- 予測結果 ---")
     print(f"  予測 鋳造速度   : {pred_mean:.4f}")
     print(f"  予測 安定性 (シグマ): {pred_std:.4f}  (この値が小さいほど予測が安定しています)")
 
-    # --- 7. SHAPによる「予測根拠」の計算 ---
-    global explainer, base_value
-    
-    # SHAP値（個々の予測に対する寄与度）を計算
-    # X_input は (1, N_features) の形状
-    shap_values = explainer.shap_values(X_input)
-    
-    # SHAP値を元の特徴量の名前にマッピング
-    shap_df = pd.DataFrame({
-        'feature': model_columns,
-        'shap_value': shap_values[0] # 最初の（唯一の）予測に対するSHAP値
-    })
-    
-    # SHAP値はダミー変数ごと（例: Steel_Code_A, Steel_Code_B）に出るため、
-    # 元の変数名（例: Steel_Code）に集約する
-    shap_agg = {}
-    for original_col in original_features:
-        # この元の特徴量に関連するダミー変数（またはそのままの数値変数）を見つける
-        related_features = [col for col in model_columns if col.startswith(original_col)]
-        if related_features:
-            # 関連するSHAP値の「合計」を、その元の特徴量の寄与度とする
-            total_shap = shap_df[shap_df['feature'].isin(related_features)]['shap_value'].sum()
-            shap_agg[original_col] = total_shap
-
-    # 寄与度の絶対値が大きい順にソート
-    shap_agg_sorted = sorted(shap_agg.items(), key=lambda item: abs(item[1]), reverse=True)
-
     print("\n--- この予測の「根拠」 (SHAP) ---")
-    print(f"  (全パラメータの平均速度: {base_value[0]:.4f})")
-    
-    # 寄与度が大きかったTop 3 (または5) を表示
-    for feature, value in shap_agg_sorted[:3]:
+    print(f"  (全パラメータの平均速度: {base_value:.4f})")
+
+    # 寄与度が大きかった Top N を表示
+    order, values = top_contributions(shap_agg, EXPLAIN_TOP_N)
+    for k, value in zip(order[0], values[0]):
+        feature = original_features[k]
         sign = "+" if value > 0 else "-"
         # 元の入力値も表示
-        original_value = df_input[feature].values[0] if feature in df_input.columns else "N/A"
-        print(f"  {sign} {abs(value):.4f} : {feature} == {original_value}")
-        
+        print(f"  {sign} {abs(value):.4f} : {feature} == {input_data[feature][0]}")
+
     print("-----------------------------------")
-    
+
     return True
 
+
+def explain_batch(encoder, numeric_cols, categorical_cols, original_features,
+                  input_path, output_path, input_format, chunk_size, n_workers, top_n):
+    """ ファイルの操業命令を一括で予測・解説し、行ごとの Top N の寄与度を逐次書き出す関数 """
+    log = functools.partial(print, file=sys.stderr)
+
+    required_cols = numeric_cols + categorical_cols
+    feature_names = np.asarray(original_features, dtype=object)
+    out = sys.stdout if output_path == "-" else open(output_path, "w", encoding="utf-8", newline="")
+
+    executor = None
+    if n_workers > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=n_workers, initializer=init_explain_worker, initargs=(MODEL_FILE_NAME,))
+
+    n_rows = 0
+    n_written_chunks = 0
+    start_time = time.perf_counter()
+
+    def write_chunk(df_chunk, unknown, result):
+        nonlocal n_rows, n_written_chunks
+        pred_mean, pred_std, shap_agg = result
+        order, values = top_contributions(shap_agg, top_n)
+        columns = {"pred_mean": pred_mean, "pred_std": pred_std, "base_value": base_value,
+                   "unknown_category": unknown}
+        for k in range(order.shape[1]):
+            columns[f"top{k + 1}_feature"] = feature_names[order[:, k]]
+            columns[f"top{k + 1}_shap"] = values[:, k]
+        df_chunk.assign(**columns).to_csv(out, index=False, header=(n_written_chunks == 0))
+
+        n_rows += len(df_chunk)
+        n_written_chunks += 1
+        profiler.count("rows_explained", len(df_chunk))
+        elapsed = time.perf_counter() - start_time
+        log(f"  {n_rows} 件を解説しました ({n_rows / max(elapsed, 1e-9):.0f} 件/秒)")
+
+    # 計算中のチャンクは (ワーカー数 × 2) 個までに抑え、入力全体を読み込まないようにする
+    pending = collections.deque()
+    try:
+        for df_chunk in read_order_chunks(input_path, input_format, categorical_cols, chunk_size):
+            missing_cols = [col for col in required_cols if col not in df_chunk.columns]
+            if missing_cols:
+                log(f"エラー: 入力ファイルに必要な列がありません: {missing_cols}")
+                sys.exit(1)
+
+            X_input, unknown = encoder.transform(df_chunk)
+            if executor is None:
+                write_chunk(df_chunk, unknown, explain_rows(X_input))
+                continue
+
+            pending.append((df_chunk, unknown, executor.submit(explain_rows, X_input)))
+            while len(pending) >= n_workers * 2:
+                df_done, unknown_done, future = pending.popleft()
+                write_chunk(df_done, unknown_done, future.result())
+
+        # 入力順に書き出す
+        while pending:
+            df_done, unknown_done, future = pending.popleft()
+            write_chunk(df_done, unknown_done, future.result())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - start_time
+    log(f"一括解説完了: 全 {n_rows} 件, {elapsed:.2f} 秒 ({n_rows / max(elapsed, 1e-9):.0f} 件/秒)")
+    for col, count in encoder.unknown_counts.items():
+        if count:
+            log(f"  警告: '{col}' に学習データに存在しない値が {count} 件ありました (unknown_category 列を参照)")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="鋳造速度 予測・解説プログラム（引数なしで対話モード）")
+    parser.add_argument("--input", "-i", help="一括解説する操業命令ファイル (CSV / JSONL, '-' で標準入力)")
+    parser.add_argument("--output", "-o", default="-", help="解説結果の出力先 CSV ('-' で標準出力, 既定値)")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="入力形式 (省略時は拡張子から判定, 標準入力は csv)")
+    parser.add_argument("--chunk-size", type=int, default=BATCH_CHUNK_SIZE, help="一度に読み込む行数")
+    parser.add_argument("--workers", type=int, default=N_WORKERS, help="一括解説の並列プロセス数")
+    parser.add_argument("--top-n", type=int, default=EXPLAIN_TOP_N, help="出力する寄与度の件数")
+    return parser.parse_args()
+
+
 def main():
-    global explainer, base_value
-    
-    print("... 予測モデルを読み込み中 ...")
+    args = parse_args()
+    # 一括モードでは標準出力を解説結果に使うため、進捗は標準エラーに出す
+    log = functools.partial(print, file=sys.stderr) if args.input else print
+
+    log("... 予測モデルを読み込み中 ...")
+    profiler.stage("モデルの読み込み")
     try:
         model_data = joblib.load(MODEL_FILE_NAME)
     except FileNotFoundError:
-        print(f"エラー: モデルファイル '{MODEL_FILE_NAME}' が見つかりません。")
+        log(f"エラー: モデルファイル '{MODEL_FILE_NAME}' が見つかりません。")
         sys.exit(1)
 
-    model = model_data["model"]
-    model_columns = model_data["model_columns"]
+    encoder = CategoryEncoder.from_model_data(model_data)
     numeric_cols = model_data["original_cols_numeric"]
     categorical_cols = model_data["original_cols_categorical"]
-    original_features = numeric_cols + categorical_cols # 元の特徴量リスト
+    original_features = numeric_cols + categorical_cols # 元の特徴量リスト（集約行列の列の並び）
 
-    print("... SHAP解説モデルを初期化中（初回のみ時間がかかります）...")
-    # TreeExplainerはRandomForestに高速
-    explainer = shap.TreeExplainer(model)
-    # SHAPのベース値（全データの平均予測値）を計算
-    base_value = explainer.expected_value
-    
-    print("モデルの読み込み完了。")
+    log("... SHAP解説モデルを初期化中（初回のみ時間がかかります）...")
+    profiler.stage("SHAP の初期化")
+    init_explainer(model_data)
+
+    log("モデルの読み込み完了。")
+    profiler.stage("予測と解説")
+
+    # 一括（非対話）モード
+    if args.input:
+        input_format = args.format
+        if input_format is None:
+            ext = os.path.splitext(args.input)[1].lower()
+            input_format = "jsonl" if ext in (".jsonl", ".ndjson") else "csv"
+        explain_batch(encoder, numeric_cols, categorical_cols, original_features,
+                      args.input, args.output, input_format, args.chunk_size, args.workers, args.top_n)
+        return
 
     while True:
-        if not predict_speed(model, model_columns, numeric_cols, categorical_cols, original_features):
+        if not predict_speed(encoder, numeric_cols, categorical_cols, original_features):
             break
-            
+
     print("予測プログラムを終了します。")
 
 if __name__ == "__main__":
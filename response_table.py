@@ -0,0 +1,523 @@
+import argparse
+import itertools
+import json
+import mmap
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from model_artifact import load_model
+
+# ----------------------------------------------------
+# 応答曲面テーブル（予測値の事前計算表）
+# ----------------------------------------------------
+# ランダムフォレストの予測は、各数値変数が「どのしきい値の間にあるか」だけで決まる区分的に一定の関数なので、
+# カテゴリ値の組み合わせ（鋼種コード × 操業パターン）ごとに、しきい値で区切った格子の各セルの
+# 予測平均とシグマを表にしておけば、ツリーを辿らずに同じ予測（浮動小数点の丸め誤差の範囲で一致）が引ける。
+#   - 格子の区切りは「その組み合わせで到達しうる分岐」のしきい値だけを使う
+#     (他の鋼種の枝にしか現れないしきい値では予測が変わらないため)
+#   - 1つの数値変数の向きに「同じ予測が続く区間（ラン）」ごとに1件だけ保存する
+#   - 表はメモリマップで直接読める1ファイル（拡張子 ".surface"）に保存する
+# 格子のセル数は、組み合わせごとに「数値変数ごとのしきい値の数 + 1」の積になる。
+# このため表にできるのは、深さを制限したツリーや、ツリー・数値変数の少ない小さなフォレストだけ。
+# 深さを制限しないツリーでは、しきい値の数がツリーの本数とともに増え、セル数が数値変数の数の乗で膨らむ。
+# 作成前に組み合わせごとのセル数を見積もり、上限を超える場合は作業領域を確保する前に中止する。
+# 予測時は各数値変数の区間番号を二分探索で求め、その「行」のランの中から該当するランを二分探索で引くだけで、
+# ツリーの数にも深さにも依存しない（読むのは表のうち数ページだけ）。
+# (学習時に存在しなかったカテゴリ値・欠損値を含む行は表にないため、呼び出し側でツリーを辿る)
+#
+# 使い方:  python response_table.py   （モデルを学習・更新した後に実行）
+#          予測は predict.py がこの表を自動的に使います
+
+# ----------------------------------------------------
+# ▼ ユーザー設定項目 ▼
+# ----------------------------------------------------
+
+# 1. 表にするモデルファイル名（表はこれの拡張子を ".surface" にしたファイルに保存）
+MODEL_FILE_NAME = "casting_speed_model.joblib"
+
+# 2. 表全体の最大ラン数（同じ予測が続く区間の数。超える場合は作成を中止します）
+# (1ランあたり 20 バイト。深さを制限しないツリーや数値変数が多いモデルでは表が大きくなるため)
+MAX_TABLE_RUNS = 50000000
+
+# 2b. 1つの組み合わせの格子の最大セル数（作成前に見積もり、超える場合は作成を中止します）
+# (作成中は1セルあたり約 GRID_BYTES_PER_CELL バイトの作業領域を使います。表は浅いツリーや小さなフォレスト向けです)
+MAX_GRID_CELLS = 5000000
+
+# 3. 作成後に、表とツリーの予測を比較して確認する行数（0 なら確認しない）
+VERIFY_ROWS = 10000
+
+# ----------------------------------------------------
+# ▲ ユーザー設定項目はここまで ▲
+# ----------------------------------------------------
+
+# ファイル形式の識別子と版、各配列の先頭位置をそろえる境界（バイト）
+TABLE_MAGIC = b"RSURFACE"
+TABLE_VERSION = 1
+TABLE_ALIGN = 64
+
+# 保存する配列の名前
+# bounds             -> 組み合わせ・数値変数ごとのしきい値を連結した配列
+# bound_start / count -> (組み合わせ, 数値変数) ごとの bounds の範囲
+# run_axis           -> 組み合わせごとの、ランを作る数値変数の番号
+# row_start          -> 組み合わせごとの、最初の「行」（ランを作る変数以外の区間番号の組）の通し番号
+# row_runs           -> 行の通し番号ごとの、最初のランの番号（末尾に全ラン数）
+# run_cell           -> 各ランの、ランを作る変数の向きの先頭の区間番号（行の中で昇順）
+# mean / std         -> 各ランの予測平均とシグマ
+ARRAY_NAMES = ("bounds", "bound_start", "bound_count", "run_axis", "row_start", "row_runs", "run_cell",
+               "mean", "std")
+PIECE_DTYPES = {"bounds": np.float64, "row_runs": np.int64, "run_cell": np.int32,
+                "mean": np.float64, "std": np.float64}
+
+# ファイルに書き出すときの1回あたりの要素数
+WRITE_CHUNK_SIZE = 1 << 20
+
+# 格子を作るときの1セルあたりの作業領域（バイト）の目安
+# (合計・二乗和の差分配列と累積和の結果、平均・シグマの float64 の配列)
+GRID_BYTES_PER_CELL = 48
+
+
+def response_table_path(model_file_name):
+    """ joblib のモデルファイル名に対応する応答曲面テーブルのファイル名 """
+    return os.path.splitext(model_file_name)[0] + ".surface"
+
+
+def tree_levels(engine):
+    """ 根から順に、深さごとの分岐ノード番号の配列のリストを返す """
+    levels = []
+    frontier = np.asarray(engine.roots, dtype=np.intp)
+    while True:
+        internal = frontier[engine.left[frontier] != frontier]
+        if not len(internal):
+            return levels
+        levels.append(internal)
+        frontier = np.concatenate([engine.left[internal], engine.right[internal]])
+
+
+def node_boxes(engine, levels, axis_features):
+    """
+    各ノードに到達する数値変数の範囲 (下限（含まない）, 上限（含む）) を返す
+    戻り値: lower, upper -> (n_nodes, 数値変数の数) の配列（制約がなければ -inf / inf）
+    """
+    n_nodes = len(engine.left)
+    lower = np.full((n_nodes, len(axis_features)), -np.inf)
+    upper = np.full((n_nodes, len(axis_features)), np.inf)
+    for internal in levels:
+        left, right = engine.left[internal], engine.right[internal]
+        for child in (left, right):
+            lower[child] = lower[internal]
+            upper[child] = upper[internal]
+        feature = engine.feature[internal]
+        threshold = engine.threshold[internal].astype(np.float64)
+        for axis, f in enumerate(axis_features):
+            split = feature == f
+            upper[left[split], axis] = np.minimum(upper[left[split], axis], threshold[split])  # 値 <= しきい値
+            lower[right[split], axis] = np.maximum(lower[right[split], axis], threshold[split]) # 値 >  しきい値
+    return lower, upper
+
+
+def reachable_nodes(engine, levels, category_split, x_fixed):
+    """ カテゴリ列のダミー変数を x_fixed に固定したとき、到達しうるノードの bool 配列 """
+    reach = np.zeros(len(engine.left), dtype=bool)
+    reach[engine.roots] = True
+    for internal, is_category in zip(levels, category_split):
+        # ダミー変数の分岐は apply() と同じく float32 の値で判定し、数値変数の分岐は両方に進む
+        go_left = x_fixed[engine.feature[internal]] <= engine.threshold[internal]
+        reach[engine.left[internal]] = reach[internal] & (~is_category | go_left)
+        reach[engine.right[internal]] = reach[internal] & (~is_category | ~go_left)
+    return reach
+
+
+def grid_bounds(engine, levels, axis_features, reach):
+    """ 到達しうる分岐のしきい値を、数値変数ごとに昇順の配列にして返す（格子の区切り） """
+    internal = np.concatenate(levels) if levels else np.zeros(0, dtype=np.intp)
+    internal = internal[reach[internal]]
+    return [np.unique(engine.threshold[internal[engine.feature[internal] == f]]).astype(np.float64)
+            for f in axis_features]
+
+
+def grid_cells(bounds):
+    """ 格子のセル数（数値変数ごとの「しきい値の数 + 1」の積） """
+    return int(np.prod([len(b) + 1 for b in bounds], dtype=np.int64))
+
+
+def tabulate(engine, lower, upper, axis_features, reach, center, bounds):
+    """
+    1つのカテゴリ値の組み合わせについて、格子の各セルの予測平均とシグマを求める
+    bounds: grid_bounds() の戻り値
+    戻り値: (平均の格子, シグマの格子)
+    格子のセル k は (しきい値[k-1], しきい値[k]] （両端は -inf / inf まで）
+    """
+    leaves = np.nonzero(reach & (engine.left == np.arange(len(engine.left))))[0]
+    # 各葉が覆うセルの範囲 [first, last]
+    first = [np.searchsorted(b, lower[leaves, axis], side="right") for axis, b in enumerate(bounds)]
+    last = [np.searchsorted(b, upper[leaves, axis], side="left") for axis, b in enumerate(bounds)]
+
+    # 葉の値を「覆う範囲の角」に足し引きし、累積和で全セルの合計にする（差分配列）
+    # (平均から遠い値を足し合わせると桁落ちするため、全体の中心からの差で集計する)
+    value = engine.value[leaves].astype(np.float64) - center
+    shape = [len(b) + 2 for b in bounds]
+    total = np.zeros(shape)
+    total_sq = np.zeros(shape)
+    for corner in itertools.product((0, 1), repeat=len(bounds)):
+        index = tuple(last[axis] + 1 if upper_side else first[axis] for axis, upper_side in enumerate(corner))
+        sign = (-1) ** sum(corner)
+        np.add.at(total, index, sign * value)
+        np.add.at(total_sq, index, sign * value ** 2)
+    for axis in range(len(bounds)):
+        total = np.cumsum(total, axis=axis)
+        total_sq = np.cumsum(total_sq, axis=axis)
+    cells = tuple(slice(0, len(b) + 1) for b in bounds)
+
+    n_trees = engine.n_trees
+    diff_mean = total[cells] / n_trees
+    mean = center + diff_mean
+    std = np.sqrt(np.maximum(total_sq[cells] / n_trees - diff_mean ** 2, 0.0))
+    return mean, std
+
+
+def encode_runs(mean, std):
+    """
+    格子を「同じ予測が続く区間（ラン）」に分ける（ランの数が最も少なくなる数値変数の向きに作る）
+    戻り値: (向きの番号, 行番号, 先頭の区間番号, 平均, シグマ)
+    行番号は、その向き以外の区間番号の組の（C順の）通し番号
+    """
+    best = None
+    for axis in range(mean.ndim):
+        m = np.moveaxis(mean, axis, -1).reshape(-1, mean.shape[axis])
+        s = np.moveaxis(std, axis, -1).reshape(-1, mean.shape[axis])
+        starts = np.ones(m.shape, dtype=bool)
+        starts[:, 1:] = (m[:, 1:] != m[:, :-1]) | (s[:, 1:] != s[:, :-1])
+        if best is None or starts.sum() < best[1].sum():
+            best = (axis, starts, m, s)
+    axis, starts, m, s = best
+    rows, cells = np.nonzero(starts)
+    return axis, rows, cells, m[rows, cells], s[rows, cells]
+
+
+def build_response_table(model_data, path, max_runs=MAX_TABLE_RUNS, max_grid_cells=MAX_GRID_CELLS):
+    """
+    読み込んだモデルから、カテゴリ値の全組み合わせの応答曲面テーブルを作って path に保存する
+    (表の本体は一時ファイルに少しずつ書き出すため、表全体をメモリに載せない)
+    戻り値: 集計情報の辞書
+    格子を作る前に組み合わせごとのセル数を見積もり、max_grid_cells を超える組み合わせがあれば ValueError。
+    作成中に表が max_runs を超えた場合も ValueError
+    """
+    engine = model_data["engine"]
+    encoder = model_data["encoder"]
+    numeric_cols = encoder.numeric_cols
+    categorical_cols = encoder.categorical_cols
+    axis_features = list(encoder.numeric_index)
+    if not axis_features:
+        raise ValueError("数値変数のないモデルは表にできません")
+
+    levels = tree_levels(engine)
+    lower, upper = node_boxes(engine, levels, axis_features)
+    is_category = np.zeros(encoder.n_columns, dtype=bool)
+    for col in categorical_cols:
+        is_category[encoder.category_index[col]] = True
+    category_split = [is_category[engine.feature[internal]] for internal in levels]
+    center = float(np.mean(engine.value[engine.roots], dtype=np.float64))
+
+    combos = list(itertools.product(*(range(len(encoder.category_keys[col])) for col in categorical_cols)))
+
+    def combo_reach(combo):
+        x_fixed = np.zeros(encoder.n_columns, dtype=np.float32)
+        for col, code in zip(categorical_cols, combo):
+            x_fixed[encoder.category_index[col][code]] = 1.0
+        return reachable_nodes(engine, levels, category_split, x_fixed)
+
+    # 格子を作る前に、組み合わせごとのセル数を見積もる（しきい値を集めるだけなので軽い）
+    combo_bounds = [grid_bounds(engine, levels, axis_features, combo_reach(combo)) for combo in combos]
+    combo_cells = np.array([grid_cells(bounds) for bounds in combo_bounds], dtype=np.int64)
+    largest = int(np.argmax(combo_cells))
+    if combo_cells[largest] > max_grid_cells:
+        shape = " × ".join(str(len(b) + 1) for b in combo_bounds[largest])
+        raise ValueError(
+            f"格子のセル数が上限 ({max_grid_cells}) を超えます: "
+            f"最大の組み合わせ {shape} = {combo_cells[largest]} セル "
+            f"(作業領域 約 {combo_cells[largest] * GRID_BYTES_PER_CELL / 2**20:.0f} MB), "
+            f"上限を超える組み合わせ {int(np.sum(combo_cells > max_grid_cells))} / {len(combos)} 件, "
+            f"全体 {int(combo_cells.sum())} セル。"
+            "表は深さを制限したツリーや小さなフォレスト向けです")
+
+    bound_count = np.zeros((len(combos), len(axis_features)), dtype=np.int64)
+    run_axis = np.zeros(len(combos), dtype=np.int64)
+    row_start = np.zeros(len(combos), dtype=np.int64)
+    n_rows = n_runs = 0
+
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(path))) as tmp_dir:
+        pieces = {name: open(os.path.join(tmp_dir, name), "wb") for name in PIECE_DTYPES}
+        try:
+            for i, (combo, bounds) in enumerate(zip(combos, combo_bounds)):
+                mean, std = tabulate(engine, lower, upper, axis_features, combo_reach(combo), center, bounds)
+                axis, rows, cells, run_mean, run_std = encode_runs(mean, std)
+
+                n_runs += len(rows)
+                if n_runs > max_runs:
+                    raise ValueError(f"表のラン数が上限 ({max_runs}) を超えました")
+                bound_count[i] = [len(b) for b in bounds]
+                run_axis[i] = axis
+                row_start[i] = n_rows
+                for b in bounds:
+                    pieces["bounds"].write(b.astype(np.float64).tobytes())
+                # 各行の最初のランの番号（ランは行の順に並んでいる）
+                n_combo_rows = mean.size // mean.shape[axis]
+                runs_per_row = np.bincount(rows, minlength=n_combo_rows)
+                first_run = n_runs - len(rows) + np.cumsum(runs_per_row) - runs_per_row
+                pieces["row_runs"].write(first_run.astype(np.int64).tobytes())
+                pieces["run_cell"].write(cells.astype(np.int32).tobytes())
+                pieces["mean"].write(run_mean.astype(np.float64).tobytes())
+                pieces["std"].write(run_std.astype(np.float64).tobytes())
+                n_rows += n_combo_rows
+            pieces["row_runs"].write(np.int64(n_runs).tobytes())
+        finally:
+            for f in pieces.values():
+                f.close()
+
+        arrays = {name: read_piece(os.path.join(tmp_dir, name), dtype) for name, dtype in PIECE_DTYPES.items()}
+        arrays.update({
+            "bound_start": (np.cumsum(bound_count.ravel()) - bound_count.ravel()).reshape(bound_count.shape),
+            "bound_count": bound_count,
+            "run_axis": run_axis,
+            "row_start": row_start,
+        })
+        metadata = {
+            "model_columns": list(encoder.model_columns),
+            "numeric_cols": list(numeric_cols),
+            "categorical_cols": list(categorical_cols),
+            # 組み合わせの番号は、各カテゴリ列の「値のソート順の番号」を並べた多次元の番号
+            "category_keys": {col: encoder.category_keys[col].tolist() for col in categorical_cols},
+            "param_ranges": model_data["param_ranges"],
+            "n_trees": engine.n_trees,
+            "model_source": os.path.basename(model_data["source"]),
+        }
+        save_response_table(path, arrays, metadata)
+        del arrays
+
+    return {"n_combos": len(combos), "n_cells": int(combo_cells.sum()), "max_combo_cells": int(combo_cells[largest]),
+            "n_runs": n_runs}
+
+
+def read_piece(path, dtype):
+    """ 一時ファイルに書き出した配列をメモリマップで開く（空のファイルは空の配列） """
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+def save_response_table(path, arrays, metadata):
+    """ 表をメモリマップで直接読める1つのファイルに書き出す（形式は ForestEngine.save_compact と同じ作り） """
+    layout = {}
+    offset = 0
+    for name in ARRAY_NAMES:
+        array = arrays[name]
+        layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+        offset += -(-array.nbytes // TABLE_ALIGN) * TABLE_ALIGN
+    header = json.dumps({"version": TABLE_VERSION, "arrays": layout, "metadata": metadata},
+                        ensure_ascii=False).encode("utf-8")
+
+    # 書き込み途中のファイルを読まれないよう、一時ファイルに書いてから置き換える
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(TABLE_MAGIC + np.uint64(len(header)).tobytes() + header)
+        f.write(b"\0" * (-f.tell() % TABLE_ALIGN))
+        data_start = f.tell()
+        for name in ARRAY_NAMES:
+            f.write(b"\0" * (data_start + layout[name]["offset"] - f.tell()))
+            flat = arrays[name].reshape(-1)
+            for start in range(0, len(flat), WRITE_CHUNK_SIZE):
+                f.write(np.ascontiguousarray(flat[start:start + WRITE_CHUNK_SIZE]).tobytes())
+    os.replace(tmp_path, path)
+
+
+class ResponseTable:
+    """ 応答曲面テーブルを保持し、学習時と同じ列構成の入力行列から予測平均とシグマを引く """
+
+    def __init__(self, arrays, metadata):
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+        self.metadata = metadata
+        self.model_columns = metadata["model_columns"]
+        self.numeric_cols = metadata["numeric_cols"]
+        self.categorical_cols = metadata["categorical_cols"]
+        self.param_ranges = metadata["param_ranges"]
+        self.n_trees = metadata["n_trees"]
+
+        column_index = {col: i for i, col in enumerate(self.model_columns)}
+        self.numeric_index = [column_index[col] for col in self.numeric_cols]
+        self.category_index = {col: np.array([column_index[f"{col}_{value}"] for value in keys], dtype=np.intp)
+                               for col, keys in metadata["category_keys"].items()}
+        self.combo_shape = tuple(len(self.category_index[col]) for col in self.categorical_cols)
+
+    @classmethod
+    def load(cls, path):
+        """ save_response_table() のファイルをメモリマップで開く（ファイル全体は読み込まない） """
+        with open(path, "rb") as f:
+            if f.read(len(TABLE_MAGIC)) != TABLE_MAGIC:
+                raise ValueError(f"'{path}' は応答曲面テーブルのファイルではありません")
+            header_len = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+            header = json.loads(f.read(header_len).decode("utf-8"))
+        if header.get("version") != TABLE_VERSION:
+            raise ValueError(f"'{path}' の形式の版 ({header.get('version')}) には対応していません")
+        data_start = -(-(len(TABLE_MAGIC) + 8 + header_len) // TABLE_ALIGN) * TABLE_ALIGN
+
+        with open(path, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if hasattr(mmap, "MADV_RANDOM"):
+            # 1回の予測で読むのは二分探索で辿る数ページだけなので、OSの先読みを止める
+            # (先読みがあると、数百件の予測でも表のほぼ全体を読み込んでしまう)
+            mapped.madvise(mmap.MADV_RANDOM)
+        buffer = np.frombuffer(mapped, dtype=np.uint8)
+        arrays = {}
+        for name, info in header["arrays"].items():
+            dtype = np.dtype(info["dtype"])
+            start = data_start + info["offset"]
+            n_bytes = int(np.prod(info["shape"], dtype=np.int64)) * dtype.itemsize
+            arrays[name] = buffer[start:start + n_bytes].view(dtype).reshape(info["shape"])
+        return cls(arrays, header["metadata"])
+
+    def matches(self, model_data):
+        """ 表が読み込んだモデルと同じ列構成・ツリー数・学習範囲から作られたか """
+        return (self.model_columns == list(model_data["model_columns"])
+                and self.n_trees == model_data["engine"].n_trees
+                and self.param_ranges == model_data["param_ranges"])
+
+    def lookup(self, X):
+        """
+        X: 学習時と同じ列構成の行列（CategoryEncoder.transform の出力）
+        戻り値: (予測平均, シグマ, 表から引けた行の bool 配列)
+        未知のカテゴリ値・欠損値を含む行は表になく、平均・シグマは NaN になる
+        """
+        # ツリーと同じく float32 に変換した値で、しきい値と比較する
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        n_rows = X.shape[0]
+        found = ~np.any(np.isnan(X[:, self.numeric_index]), axis=1)
+
+        # カテゴリ列ごとに「1 が立っているダミー列」の番号を求める（ちょうど1つでなければ未知の値）
+        codes = []
+        for col in self.categorical_cols:
+            block = X[:, self.category_index[col]]
+            found &= np.sum(block == 1.0, axis=1) == 1
+            codes.append(np.argmax(block, axis=1))
+        combo = np.ravel_multi_index(codes, self.combo_shape) if codes else np.zeros(n_rows, dtype=np.intp)
+
+        # 同じ組み合わせの行をまとめ、数値変数ごとに区間番号を二分探索で求める
+        row_index = np.zeros(n_rows, dtype=np.int64)
+        cell_index = np.zeros(n_rows, dtype=np.int64)
+        for c in np.unique(combo[found]):
+            rows = np.nonzero(found & (combo == c))[0]
+            run_axis = self.run_axis[c]
+            row = np.zeros(len(rows), dtype=np.int64)
+            cell = None
+            for axis, index in enumerate(self.numeric_index):
+                start, count = self.bound_start[c, axis], self.bound_count[c, axis]
+                code = np.searchsorted(self.bounds[start:start + count], X[rows, index], side="left")
+                if axis == run_axis:
+                    cell = code
+                else:
+                    row = row * (count + 1) + code
+            row_index[rows] = self.row_start[c] + row
+            cell_index[rows] = cell
+
+        # セルを含むラン（先頭がセル以下の最後のラン）を、その行のランの範囲 [lo, hi) の中で二分探索する
+        # (行の最初のランは必ず区間番号 0 から始まる)
+        row_index, cell_index = row_index[found], cell_index[found]
+        lo = self.row_runs[row_index]
+        hi = self.row_runs[row_index + 1]
+        if len(row_index) == 1:
+            # 1件の予測（対話・1件予測）は、その行のランをそのまま二分探索する
+            run = lo + np.searchsorted(self.run_cell[lo[0]:hi[0]], cell_index, side="right") - 1
+        else:
+            while True:
+                active = hi - lo > 1
+                if not active.any():
+                    break
+                mid = (lo + hi) // 2
+                right = self.run_cell[mid] <= cell_index
+                lo = np.where(active & right, mid, lo)
+                hi = np.where(active & ~right, mid, hi)
+            run = lo
+
+        pred_mean = np.full(n_rows, np.nan)
+        pred_std = np.full(n_rows, np.nan)
+        pred_mean[found] = self.mean[run]
+        pred_std[found] = self.std[run]
+        return pred_mean, pred_std, found
+
+
+def verify(table, model_data, n_rows, seed=0):
+    """ 学習範囲内のランダムな入力（しきい値ちょうどの値を含む）で、表とツリーの予測の最大差を返す """
+    engine = model_data["engine"]
+    encoder = model_data["encoder"]
+    rng = np.random.default_rng(seed)
+    orders = {}
+    for col in encoder.numeric_cols:
+        r = model_data["param_ranges"][col]
+        values = rng.uniform(r["min"], r["max"], n_rows)
+        # 半分の行は分岐のしきい値ちょうどの値にする（境界の扱いの確認）
+        thresholds = engine.split_points().get(encoder.numeric_index[encoder.numeric_cols.index(col)])
+        if thresholds is not None and len(thresholds):
+            on_split = rng.random(n_rows) < 0.5
+            values[on_split] = rng.choice(thresholds, int(on_split.sum()))
+        orders[col] = values
+    for col in encoder.categorical_cols:
+        orders[col] = rng.choice(encoder.category_keys[col], n_rows)
+    X, _ = encoder.transform(orders)
+
+    table_mean, table_std, found = table.lookup(X)
+    engine_mean, engine_std = engine.predict_mean_std(X)
+    return (int(np.sum(~found)),
+            float(np.max(np.abs(table_mean - engine_mean), initial=0.0)),
+            float(np.max(np.abs(table_std - engine_std), initial=0.0)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="応答曲面テーブル（予測値の事前計算表）の作成")
+    parser.add_argument("--model", default=MODEL_FILE_NAME, help="表にするモデルファイル名")
+    parser.add_argument("--verify-rows", type=int, default=VERIFY_ROWS, help="作成後に確認する行数 (0 で確認しない)")
+    args = parser.parse_args()
+
+    print("--- 応答曲面テーブル作成プログラム 開始 ---")
+
+    print(f"\n[ステップ1: モデル '{args.model}' を読み込み中...]")
+    try:
+        model_data = load_model(args.model)
+    except FileNotFoundError:
+        print(f"エラー: モデルファイル '{args.model}' が見つかりません。")
+        print("先に `trainmodel.py` を実行してモデルを生成してください。")
+        sys.exit(1)
+    encoder = model_data["encoder"]
+    print(f"モデルの読み込み完了。({model_data['source']}, ツリー {model_data['engine'].n_trees} 本)")
+    print(f"  表の軸: 数値変数 {encoder.numeric_cols} × カテゴリ変数 "
+          + " × ".join(f"{col} ({len(encoder.category_keys[col])} 種類)" for col in encoder.categorical_cols))
+
+    print("\n[ステップ2: カテゴリ値の組み合わせごとに予測を表にしています...]")
+    path = response_table_path(args.model)
+    start_time = time.perf_counter()
+    try:
+        stats = build_response_table(model_data, path)
+    except ValueError as e:
+        print(f"エラー: {e}")
+        print("MAX_GRID_CELLS / MAX_TABLE_RUNS を大きくするか、表を使わずに予測してください。")
+        sys.exit(1)
+    elapsed = time.perf_counter() - start_time
+    print(f"  {stats['n_combos']} 組み合わせ, 格子 {stats['n_cells']} セル "
+          f"(最大の組み合わせ {stats['max_combo_cells']} セル) -> {stats['n_runs']} ラン, {elapsed:.2f} 秒")
+    print(f"応答曲面テーブルを '{path}' に保存しました。({os.path.getsize(path) / 2**20:.2f} MB)")
+
+    if args.verify_rows > 0:
+        print(f"\n[ステップ3: ツリーの予測と比較しています ({args.verify_rows} 行)...]")
+        n_missing, mean_diff, std_diff = verify(ResponseTable.load(path), model_data, args.verify_rows)
+        print(f"  最大差: 平均 {mean_diff:.2e}, シグマ {std_diff:.2e} (表にない行: {n_missing} 件)")
+
+    print("\n--- 応答曲面テーブル作成プログラム 終了 ---")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,377 @@
+import pandas as pd
+import numpy as np
+import argparse
+import functools
+import sys
+import time
+
+# ----------------------------------------------------
+# 基準速度ルールテーブル（決定木のコンパイル版）
+# ----------------------------------------------------
+# maketable.py の決定木を「葉1つ = ルール1行」の表に変換する。
+#   数値の列     -> {列名}_min < 値 <= {列名}_max  （制約がなければ -inf / inf）
+#                   {列名}_missing （値が欠損(NaN)の行もこのルールに入るなら 1）
+#   カテゴリの列 -> {列名}_in （この値のどれか。空なら制約なし）
+#                   {列名}_not_in （この値以外。空なら制約なし）  値は "|" 区切り
+# 表だけあれば（scikit-learn なしで）大量の操業命令を一括でルールに割り当てられる。
+# 割り当ては各列の「しきい値の区間番号」から格子状の対応表を引くため、
+# 決定木の predict と完全に同じ結果を、行数に比例する計算量で返す。
+# (欠損値は決定木と同じく、分岐ごとに学習時に決まった側 (missing_go_to_left) に進める)
+
+# ----------------------------------------------------
+# ▼ ユーザー設定項目 ▼
+# ----------------------------------------------------
+
+# 1. 一括割り当てで一度に読み込む行数
+ASSIGN_CHUNK_SIZE = 1000000
+
+# 2. 格子状の対応表の最大セル数（超える場合はルールごとの条件判定で割り当てます）
+MAX_LOOKUP_CELLS = 10000000
+
+# ----------------------------------------------------
+# ▲ ユーザー設定項目はここまで ▲
+# ----------------------------------------------------
+
+# カテゴリの値の区切り文字
+VALUE_SEP = "|"
+
+
+def split_values(text):
+    """ "A|B" 形式の文字列を値のリストにする（空・欠損なら空のリスト） """
+    if not isinstance(text, str) or text == "":
+        return []
+    return text.split(VALUE_SEP)
+
+
+class RuleTable:
+    """ 決定木の葉ごとのルール（数値の区間・カテゴリの集合・基準速度・シグマ）を保持し、一括で割り当てる """
+
+    def __init__(self, numeric_cols, categorical_cols, lower, upper, include, exclude,
+                 base_speed, leaf_sigma, n_rows, leaf_ids=None, missing=None):
+        """
+        lower / upper: {数値列: (n_rules,) の下限（含まない）/ 上限（含む）}
+        include / exclude: {カテゴリ列: ルールごとの値の集合のリスト}
+        missing: {数値列: (n_rules,) の bool（値が欠損した行もこのルールに入るか）}
+                 None なら欠損した行はどのルールにも入らない（ルール番号 -1）
+        """
+        self.numeric_cols = list(numeric_cols)
+        self.categorical_cols = list(categorical_cols)
+        self.lower = {col: np.asarray(lower[col], dtype=np.float64) for col in self.numeric_cols}
+        self.upper = {col: np.asarray(upper[col], dtype=np.float64) for col in self.numeric_cols}
+        self.include = {col: [set(values) for values in include[col]] for col in self.categorical_cols}
+        self.exclude = {col: [set(values) for values in exclude[col]] for col in self.categorical_cols}
+        self.base_speed = np.asarray(base_speed, dtype=np.float64)
+        self.leaf_sigma = np.asarray(leaf_sigma, dtype=np.float64)
+        self.n_rows = np.asarray(n_rows, dtype=np.int64)
+        self.leaf_ids = np.arange(len(self.base_speed)) if leaf_ids is None else np.asarray(leaf_ids)
+        self.missing = {col: np.zeros(len(self.base_speed), dtype=bool) if missing is None
+                        else np.asarray(missing[col], dtype=bool) for col in self.numeric_cols}
+        self._compile()
+
+    @property
+    def n_rules(self):
+        return len(self.base_speed)
+
+    @classmethod
+    def from_tree(cls, tree_model, feature_names, numeric_cols, categorical_cols):
+        """ 学習済みの DecisionTreeRegressor（ダミー変数化した列で学習）からルール表を作る """
+        tree = tree_model.tree_
+        numeric_cols = [col for col in numeric_cols if col in feature_names]
+
+        # 各列が「数値の列」か「カテゴリ列のダミー変数（列名, 値）」かを決めておく
+        # (接頭辞が最も長く一致するカテゴリ列に割り当て、"Pattern" と "Pattern_X" の混同を防ぐ)
+        feature_info = []
+        for name in feature_names:
+            owners = [col for col in categorical_cols if name.startswith(f"{col}_")]
+            if name in numeric_cols or not owners:
+                feature_info.append((name, None))
+            else:
+                owner = max(owners, key=len)
+                feature_info.append((owner, name[len(owner) + 1:]))
+        # 学習に使われなかったカテゴリ列は表に含めない
+        categorical_cols = [col for col in categorical_cols
+                            if any(owner == col and value is not None for owner, value in feature_info)]
+
+        lower = {col: [] for col in numeric_cols}
+        upper = {col: [] for col in numeric_cols}
+        include = {col: [] for col in categorical_cols}
+        exclude = {col: [] for col in categorical_cols}
+        missing = {col: [] for col in numeric_cols}
+        leaf_ids = []
+        # 欠損値が進む側（古い scikit-learn には属性がなく、欠損値は予測できない）
+        missing_go_to_left = getattr(tree, "missing_go_to_left", None)
+
+        # 根から葉まで辿りながら、区間と集合と「欠損値が届くか」を絞り込む
+        start = ({col: -np.inf for col in numeric_cols}, {col: np.inf for col in numeric_cols},
+                 {col: None for col in categorical_cols}, {col: frozenset() for col in categorical_cols},
+                 {col: missing_go_to_left is not None for col in numeric_cols})
+        stack = [(0, start)]
+        while stack:
+            node, (lo, hi, inc, exc, nan) = stack.pop()
+            if tree.children_left[node] == -1:
+                leaf_ids.append(node)
+                for col in numeric_cols:
+                    lower[col].append(lo[col])
+                    upper[col].append(hi[col])
+                    missing[col].append(nan[col])
+                for col in categorical_cols:
+                    include[col].append(sorted(inc[col] or []))
+                    # 値が1つに決まっていれば「以外」の条件は不要
+                    exclude[col].append([] if inc[col] else sorted(exc[col]))
+                continue
+
+            col, value = feature_info[tree.feature[node]]
+            threshold = tree.threshold[node]
+            left = (dict(lo), dict(hi), dict(inc), dict(exc), dict(nan))
+            right = (dict(lo), dict(hi), dict(inc), dict(exc), dict(nan))
+            if value is None:
+                left[1][col] = min(hi[col], threshold)    # 値 <= しきい値
+                right[0][col] = max(lo[col], threshold)   # 値 >  しきい値
+                if missing_go_to_left is not None:
+                    # 欠損値は片側にだけ進む
+                    (right if missing_go_to_left[node] else left)[4][col] = False
+            else:
+                left[3][col] = exc[col] | {value}         # ダミー変数 = 0 -> この値ではない
+                right[2][col] = frozenset({value})        # ダミー変数 = 1 -> この値
+            stack.append((tree.children_right[node], right))
+            stack.append((tree.children_left[node], left))
+
+        order = np.argsort(leaf_ids, kind="stable")
+        leaf_ids = np.asarray(leaf_ids)[order]
+        return cls(
+            numeric_cols, categorical_cols,
+            lower={col: np.asarray(values)[order] for col, values in lower.items()},
+            upper={col: np.asarray(values)[order] for col, values in upper.items()},
+            include={col: [values[i] for i in order] for col, values in include.items()},
+            exclude={col: [values[i] for i in order] for col, values in exclude.items()},
+            base_speed=tree.value[leaf_ids, 0, 0],
+            leaf_sigma=np.sqrt(tree.impurity[leaf_ids]),
+            n_rows=tree.n_node_samples[leaf_ids],
+            leaf_ids=leaf_ids,
+            missing={col: np.asarray(values, dtype=bool)[order] for col, values in missing.items()},
+        )
+
+    def to_frame(self):
+        """ ルール表を DataFrame（1ルール1行）にする """
+        table = pd.DataFrame({"Rule_ID": np.arange(self.n_rules), "Leaf_ID": self.leaf_ids})
+        for col in self.numeric_cols:
+            table[f"{col}_min"] = self.lower[col]
+            table[f"{col}_max"] = self.upper[col]
+            table[f"{col}_missing"] = self.missing[col].astype(int)
+        for col in self.categorical_cols:
+            table[f"{col}_in"] = [VALUE_SEP.join(sorted(values)) for values in self.include[col]]
+            table[f"{col}_not_in"] = [VALUE_SEP.join(sorted(values)) for values in self.exclude[col]]
+        table["Rule"] = [self.describe(i) for i in range(self.n_rules)]
+        table["N_Rows"] = self.n_rows
+        table["Base_Speed"] = self.base_speed
+        table["Leaf_Sigma"] = self.leaf_sigma
+        return table
+
+    @classmethod
+    def from_frame(cls, table):
+        """ to_frame() の表（CSV から読み込んだものを含む）からルール表を復元する """
+        numeric_cols = [col[:-len("_min")] for col in table.columns
+                        if col.endswith("_min") and f"{col[:-len('_min')]}_max" in table.columns]
+        categorical_cols = [col[:-len("_in")] for col in table.columns
+                            if col.endswith("_in") and not col.endswith("_not_in")]
+        # pd.to_numeric は最後の桁が丸められることがあるため、NumPy で文字列から変換する
+        number = lambda col: np.asarray(table[col], dtype=np.float64)
+        # 欠損値の列がない古い表では、欠損した行はどのルールにも入らない
+        has_missing = all(f"{col}_missing" in table.columns for col in numeric_cols)
+        return cls(
+            numeric_cols, categorical_cols,
+            lower={col: number(f"{col}_min") for col in numeric_cols},
+            upper={col: number(f"{col}_max") for col in numeric_cols},
+            include={col: [split_values(v) for v in table[f"{col}_in"]] for col in categorical_cols},
+            exclude={col: [split_values(v) for v in table[f"{col}_not_in"]] for col in categorical_cols},
+            base_speed=number("Base_Speed"),
+            leaf_sigma=number("Leaf_Sigma"),
+            n_rows=number("N_Rows").astype(np.int64),
+            leaf_ids=number("Leaf_ID").astype(np.int64) if "Leaf_ID" in table.columns else None,
+            missing={col: number(f"{col}_missing") != 0 for col in numeric_cols} if has_missing else None,
+        )
+
+    def to_csv(self, path, extra_columns=None):
+        """ ルール表を CSV に保存する（しきい値・速度は読み戻したときに同じ値になる桁数で書く） """
+        table = self.to_frame()
+        for name, values in (extra_columns or {}).items():
+            table[name] = values
+        table.to_csv(path, index=False, encoding='utf-8-sig', float_format="%.17g")
+        return table
+
+    @classmethod
+    def read_csv(cls, path):
+        """ to_frame() を保存した CSV から読み込む（カテゴリの値は数字に見えても文字列のまま扱う） """
+        return cls.from_frame(pd.read_csv(path, dtype=str, keep_default_na=False, encoding="utf-8-sig"))
+
+    def describe(self, i):
+        """ i 番目のルールの条件を読みやすい文字列にする """
+        conditions = []
+        for col in self.numeric_cols:
+            lo, hi = self.lower[col][i], self.upper[col][i]
+            if np.isfinite(lo) and np.isfinite(hi):
+                condition = f"{lo:.2f} < {col} <= {hi:.2f}"
+            elif np.isfinite(lo):
+                condition = f"{col} > {lo:.2f}"
+            elif np.isfinite(hi):
+                condition = f"{col} <= {hi:.2f}"
+            else:
+                continue
+            # 区間の制約がある列で欠損値もこのルールに入る場合は、その旨を書き添える
+            if self.missing[col][i]:
+                condition = f"({condition} or {col} is NaN)"
+            conditions.append(condition)
+        for col in self.categorical_cols:
+            if self.include[col][i]:
+                conditions.append(f"{col} in {{{', '.join(sorted(self.include[col][i]))}}}")
+            elif self.exclude[col][i]:
+                conditions.append(f"{col} not in {{{', '.join(sorted(self.exclude[col][i]))}}}")
+        return " and ".join(conditions) or "(全件)"
+
+    def _compile(self):
+        """ 割り当て用の対応表を作る（列ごとの区間番号の組 -> ルール番号） """
+        # 数値の列: ルールに現れるしきい値のソート済み配列。区間 k は (T[k-1], T[k]]、
+        #           最後の番号 len(T) + 1 は欠損値
+        self.thresholds = {}
+        for col in self.numeric_cols:
+            values = np.concatenate([self.lower[col], self.upper[col]])
+            self.thresholds[col] = np.unique(values[np.isfinite(values)])
+        # カテゴリの列: ルールに現れる値（番号 0..n-1）と「その他の値」（番号 n）
+        self.category_keys = {}
+        for col in self.categorical_cols:
+            mentioned = set().union(*self.include[col], *self.exclude[col])
+            self.category_keys[col] = np.array(sorted(mentioned), dtype=str)
+
+        shape = [len(self.thresholds[col]) + 2 for col in self.numeric_cols] + \
+                [len(self.category_keys[col]) + 1 for col in self.categorical_cols]
+        self.lookup = None
+        if int(np.prod(shape, dtype=np.int64)) > MAX_LOOKUP_CELLS:
+            return
+
+        lookup = np.full(shape, -1, dtype=np.int32)
+        for i in range(self.n_rules):
+            index = []
+            for col in self.numeric_cols:
+                index.append(np.nonzero(self._interval_allowed(col, i))[0])
+            for col in self.categorical_cols:
+                index.append(np.nonzero(self._category_allowed(col, i))[0])
+            lookup[np.ix_(*index)] = i
+        self.lookup = lookup
+
+    def _interval_allowed(self, col, i):
+        """ i 番目のルールで許される区間番号（最後が欠損値）の bool 配列 """
+        thresholds = self.thresholds[col]
+        first = np.searchsorted(thresholds, self.lower[col][i], side="right")
+        last = np.searchsorted(thresholds, self.upper[col][i], side="left")
+        allowed = np.zeros(len(thresholds) + 2, dtype=bool)
+        allowed[first:last + 1] = True
+        allowed[-1] = self.missing[col][i]
+        return allowed
+
+    def _category_allowed(self, col, i):
+        """ i 番目のルールで許される値の番号（最後が「その他の値」）の bool 配列 """
+        keys = self.category_keys[col]
+        if self.include[col][i]:
+            allowed = np.isin(keys, list(self.include[col][i]))
+            return np.append(allowed, False)
+        allowed = ~np.isin(keys, list(self.exclude[col][i]))
+        return np.append(allowed, True)
+
+    def _encode(self, data):
+        """ 各列の値を区間番号（欠損値は最後の番号）・カテゴリ番号にする。戻り値: 番号の配列のリスト """
+        codes = []
+        for col in self.numeric_cols:
+            # 決定木は入力を float32 に変換してから比較するため、それに合わせる
+            values = np.asarray(data[col], dtype=np.float32)
+            thresholds = self.thresholds[col]
+            codes.append(np.where(np.isnan(values), len(thresholds) + 1,
+                                  np.searchsorted(thresholds, values, side="left")))
+        for col in self.categorical_cols:
+            keys = self.category_keys[col]
+            # 行ごとに文字列を比較せず、出現する値の種類ごとに1回だけ番号を引く
+            value_codes, uniques = pd.factorize(pd.Series(data[col]), use_na_sentinel=False)
+            uniques = np.asarray(uniques).astype(str)
+            if len(keys):
+                pos = np.minimum(np.searchsorted(keys, uniques), len(keys) - 1)
+                unique_codes = np.where(keys[pos] == uniques, pos, len(keys))
+            else:
+                unique_codes = np.zeros(len(uniques), dtype=np.intp)
+            codes.append(unique_codes[value_codes])
+        return codes
+
+    def assign(self, data):
+        """
+        data: 列名 -> 値の配列 を持つ辞書または DataFrame
+        戻り値: (ルール番号, 基準速度, シグマ) の配列
+        (数値が欠損した行は決定木と同じルールに入る。欠損値の情報がない表ではルール番号 -1, 速度・シグマは NaN)
+        """
+        codes = self._encode(data)
+        n_rows = len(codes[0]) if codes else 0
+        if self.lookup is not None:
+            rule_index = self.lookup[tuple(codes)] if codes else np.zeros(n_rows, dtype=np.int32)
+        else:
+            # 対応表が大きすぎる場合は、ルールごとに条件を一括判定する
+            rule_index = np.full(n_rows, -1, dtype=np.int32)
+            for i in range(self.n_rules):
+                match = np.ones(n_rows, dtype=bool)
+                for j, col in enumerate(self.numeric_cols):
+                    match &= self._interval_allowed(col, i)[codes[j]]
+                for j, col in enumerate(self.categorical_cols, start=len(self.numeric_cols)):
+                    match &= self._category_allowed(col, i)[codes[j]]
+                rule_index[match] = i
+
+        valid = rule_index >= 0
+        base_speed = np.where(valid, self.base_speed[np.maximum(rule_index, 0)], np.nan)
+        leaf_sigma = np.where(valid, self.leaf_sigma[np.maximum(rule_index, 0)], np.nan)
+        return rule_index, base_speed, leaf_sigma
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="基準速度ルールテーブルによる一括割り当て")
+    parser.add_argument("--table", required=True, help="maketable.py が出力したルールテーブル (CSV)")
+    parser.add_argument("--input", "-i", required=True, help="割り当てる操業命令ファイル (CSV, '-' で標準入力)")
+    parser.add_argument("--output", "-o", default="-", help="割り当て結果の出力先 CSV ('-' で標準出力, 既定値)")
+    parser.add_argument("--chunk-size", type=int, default=ASSIGN_CHUNK_SIZE, help="一度に読み込む行数")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    log = functools.partial(print, file=sys.stderr)
+
+    try:
+        rule_table = RuleTable.read_csv(args.table)
+    except FileNotFoundError:
+        log(f"エラー: ルールテーブル '{args.table}' が見つかりません。")
+        log("先に `maketable.py` を実行してルールテーブルを生成してください。")
+        sys.exit(1)
+    log(f"ルールテーブルを読み込みました: {rule_table.n_rules} ルール")
+
+    required_cols = rule_table.numeric_cols + rule_table.categorical_cols
+    source = sys.stdin if args.input == "-" else args.input
+    out = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="")
+
+    n_rows = 0
+    start_time = time.perf_counter()
+    try:
+        reader = pd.read_csv(source, chunksize=args.chunk_size,
+                             dtype={col: str for col in rule_table.categorical_cols})
+        for i, df_chunk in enumerate(reader):
+            missing_cols = [col for col in required_cols if col not in df_chunk.columns]
+            if missing_cols:
+                log(f"エラー: 入力ファイルに必要な列がありません: {missing_cols}")
+                sys.exit(1)
+            rule_index, base_speed, leaf_sigma = rule_table.assign(df_chunk)
+            df_chunk.assign(Rule_ID=rule_index, Standard_Speed=base_speed, Leaf_Sigma=leaf_sigma).to_csv(
+                out, index=False, header=(i == 0))
+            n_rows += len(df_chunk)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = time.perf_counter() - start_time
+    log(f"割り当て完了: 全 {n_rows} 件, {elapsed:.2f} 秒 ({n_rows / max(elapsed, 1e-9):.0f} 件/秒)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import joblib
+import pandas as pd
+import numpy as np
+import argparse
+import collections
+import concurrent.futures
+import sys
+import time
+import warnings
+import predictshap
+from category_encoder import CategoryEncoder
+
+warnings.filterwarnings('ignore')
+
+# ----------------------------------------------------
+# 全履歴データの SHAP 集計（グローバルな説明）
+# ----------------------------------------------------
+# 全行の SHAP 値の行列は作らず、チャンクごとに計算して
+# 「グループ（鋼種コード）× 特徴量」ごとの件数・平均・分散だけを足し込んでいく。
+# 必要なら鋼種ごとに件数をそろえた層別サンプルで計算し、推定誤差（95%信頼区間の幅）を併記する。
+
+# ----------------------------------------------------
+# ▼ ユーザー設定項目 ▼
+# ----------------------------------------------------
+
+# 1. 集計する元データ（CSV）と、モデルファイル名
+CSV_FILE_PATH = "your_data.csv"
+MODEL_FILE_NAME = "casting_speed_model.joblib"
+
+# 2. 重要度を分けて集計する列
+GROUP_COL = "Steel_Code"
+
+# 3. 鋼種ごとに SHAP を計算する最大行数（None なら全行を計算）
+# (行数の多い鋼種は、この件数程度になるよう無作為に抽出します。誤差は出力の CI95 列を参照)
+SAMPLE_ROWS_PER_GROUP = 2000
+
+# 4. 一度に読み込む行数と、並列プロセス数
+CHUNK_SIZE = 2000
+N_WORKERS = 1
+
+# 5. 乱数シード（抽出する行はこの値とチャンク番号から決まります）
+RANDOM_SEED = 42
+
+# 6. 出力ファイル名
+OUTPUT_CSV = "shap_global_summary.csv"
+
+# ----------------------------------------------------
+# ▲ ユーザー設定項目はここまで ▲
+# ----------------------------------------------------
+
+# 95%信頼区間の係数
+CI_Z = 1.96
+# 全体の集計行のグループ名
+ALL_GROUPS_LABEL = "(全体)"
+
+
+class GroupStats:
+    """ グループ × 特徴量ごとの件数・平均・分散を、行列を保持せずに集計する（Chan の並列アルゴリズム） """
+
+    def __init__(self, n_groups, n_features):
+        self.count = np.zeros(n_groups, dtype=np.int64)
+        self.mean = np.zeros((n_groups, n_features))
+        self.m2 = np.zeros((n_groups, n_features))
+
+    @classmethod
+    def from_values(cls, values, group_codes, n_groups):
+        """ values (n_rows, n_features) を group_codes ごとに集計する """
+        stats = cls(n_groups, values.shape[1])
+        stats.count = np.bincount(group_codes, minlength=n_groups)
+        safe_count = np.maximum(stats.count, 1)[:, None]
+        for j in range(values.shape[1]):
+            stats.mean[:, j] = np.bincount(group_codes, weights=values[:, j], minlength=n_groups)
+        stats.mean /= safe_count
+        deviation = values - stats.mean[group_codes]
+        for j in range(values.shape[1]):
+            stats.m2[:, j] = np.bincount(group_codes, weights=deviation[:, j] ** 2, minlength=n_groups)
+        return stats
+
+    def merge(self, other):
+        """ 別の集計結果を取り込む """
+        count = self.count + other.count
+        safe_count = np.maximum(count, 1)[:, None]
+        delta = other.mean - self.mean
+        self.mean += delta * other.count[:, None] / safe_count
+        self.m2 += other.m2 + delta ** 2 * (self.count * other.count)[:, None] / safe_count
+        self.count = count
+
+    @property
+    def variance(self):
+        """ 不偏分散（件数が1以下のグループは 0） """
+        return self.m2 / np.maximum(self.count - 1, 1)[:, None]
+
+
+def summarize_chunk(X, group_codes, n_groups):
+    """ チャンクの SHAP 値を計算し、|SHAP| と符号付き SHAP のグループ別集計を返す（ワーカーで実行） """
+    _, _, shap_agg = predictshap.explain_rows(X)
+    return (GroupStats.from_values(np.abs(shap_agg), group_codes, n_groups),
+            GroupStats.from_values(shap_agg, group_codes, n_groups))
+
+
+def iter_chunks(columns, categorical_cols):
+    """ CSV を CHUNK_SIZE 行ずつ、必要な列だけ読み込む（カテゴリ変数は文字列として） """
+    return pd.read_csv(CSV_FILE_PATH, usecols=columns, chunksize=CHUNK_SIZE,
+                       dtype={col: str for col in categorical_cols})
+
+
+def build_summary(abs_stats, signed_stats, population, groups, original_features):
+    """ グループ別と全体（層別推定）の重要度テーブルを作る """
+    n_sampled = abs_stats.count
+    # 抽出率を考慮した（有限母集団修正つきの）平均の標準誤差
+    fpc = np.clip(1.0 - n_sampled / np.maximum(population, 1), 0.0, 1.0)
+    se2 = abs_stats.variance / np.maximum(n_sampled, 1)[:, None] * fpc[:, None]
+
+    rows = []
+    for g, group in enumerate(groups):
+        if n_sampled[g] == 0:
+            continue
+        for k, feature in enumerate(original_features):
+            rows.append({GROUP_COL: group, "Feature": feature,
+                         "N_Rows": int(population[g]), "N_Sampled": int(n_sampled[g]),
+                         "Mean_Abs_SHAP": abs_stats.mean[g, k], "CI95": CI_Z * np.sqrt(se2[g, k]),
+                         "Mean_SHAP": signed_stats.mean[g, k]})
+
+    # 全体は鋼種ごとの平均を行数で重み付けした層別推定（抽出率が鋼種ごとに違っても偏らない）
+    observed = n_sampled > 0
+    weights = np.where(observed, population, 0) / max(population[observed].sum(), 1)
+    for k, feature in enumerate(original_features):
+        rows.append({GROUP_COL: ALL_GROUPS_LABEL, "Feature": feature,
+                     "N_Rows": int(population.sum()), "N_Sampled": int(n_sampled.sum()),
+                     "Mean_Abs_SHAP": float(weights @ abs_stats.mean[:, k]),
+                     "CI95": CI_Z * float(np.sqrt(weights ** 2 @ se2[:, k])),
+                     "Mean_SHAP": float(weights @ signed_stats.mean[:, k])})
+
+    summary = pd.DataFrame(rows)
+    summary["Rank"] = summary.groupby(GROUP_COL, sort=False)["Mean_Abs_SHAP"].rank(
+        ascending=False, method="first").astype(int)
+    return summary.sort_values([GROUP_COL, "Rank"], kind="stable").reset_index(drop=True)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="全履歴データの SHAP 重要度集計")
+    parser.add_argument("--workers", type=int, default=N_WORKERS, help="並列プロセス数")
+    parser.add_argument("--sample-per-group", type=int, default=SAMPLE_ROWS_PER_GROUP,
+                        help="鋼種ごとに計算する最大行数 (0 で全行)")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    sample_per_group = args.sample_per_group or None
+
+    print("--- SHAP 重要度集計プログラム開始 ---")
+
+    # --- ステップ1: モデルの読み込み ---
+    print(f"\n[ステップ1: モデル '{MODEL_FILE_NAME}' を読み込み中...]")
+    try:
+        model_data = joblib.load(MODEL_FILE_NAME)
+    except FileNotFoundError:
+        print(f"エラー: モデルファイル '{MODEL_FILE_NAME}' が見つかりません。")
+        sys.exit(1)
+    encoder = CategoryEncoder.from_model_data(model_data)
+    numeric_cols = model_data["original_cols_numeric"]
+    categorical_cols = model_data["original_cols_categorical"]
+    original_features = numeric_cols + categorical_cols
+    read_cols = list(dict.fromkeys(numeric_cols + categorical_cols + [GROUP_COL]))
+
+    # --- ステップ2: 鋼種ごとの行数を数える（抽出率を決めるため） ---
+    print(f"\n[ステップ2: '{GROUP_COL}' ごとの行数を集計中...]")
+    try:
+        header = pd.read_csv(CSV_FILE_PATH, nrows=0).columns
+    except FileNotFoundError:
+        print(f"エラー: ファイル '{CSV_FILE_PATH}' が見つかりません。")
+        sys.exit(1)
+    missing_cols = [col for col in read_cols if col not in header]
+    if missing_cols:
+        print(f"エラー: CSVファイルに必要な列がありません: {missing_cols}")
+        sys.exit(1)
+
+    counts = collections.Counter()
+    for chunk in pd.read_csv(CSV_FILE_PATH, usecols=[GROUP_COL], chunksize=max(CHUNK_SIZE, 100000),
+                             dtype={GROUP_COL: str}):
+        counts.update(chunk[GROUP_COL].fillna("").to_numpy())
+    groups = sorted(counts)
+    population = np.array([counts[g] for g in groups], dtype=np.int64)
+    keep_prob = np.ones(len(groups)) if sample_per_group is None else np.minimum(1.0, sample_per_group / population)
+    expected = int(np.round(np.minimum(population, sample_per_group or np.inf).sum()))
+    print(f"  全 {population.sum()} 行, {len(groups)} グループ。SHAP を計算する行数: 約 {expected} 行")
+
+    # --- ステップ3: チャンクごとに SHAP を計算して集計 ---
+    print(f"\n[ステップ3: SHAP の計算と集計 ({args.workers} プロセス)]")
+    n_features = len(original_features)
+    abs_stats = GroupStats(len(groups), n_features)
+    signed_stats = GroupStats(len(groups), n_features)
+
+    executor = None
+    if args.workers > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=args.workers, initializer=predictshap.init_explain_worker, initargs=(MODEL_FILE_NAME,))
+    else:
+        predictshap.init_explainer(model_data)
+
+    n_done = 0
+    start_time = time.perf_counter()
+
+    def collect(result, n_rows):
+        nonlocal n_done
+        abs_stats.merge(result[0])
+        signed_stats.merge(result[1])
+        n_done += n_rows
+        elapsed = time.perf_counter() - start_time
+        print(f"  {n_done} / 約 {expected} 行 ({n_done / max(elapsed, 1e-9):.0f} 行/秒)")
+
+    # 計算中のチャンクは (ワーカー数 × 2) 個までに抑え、入力全体を読み込まないようにする
+    pending = collections.deque()
+    try:
+        for i, chunk in enumerate(iter_chunks(read_cols, list(dict.fromkeys(categorical_cols + [GROUP_COL])))):
+            group_codes = np.searchsorted(groups, chunk[GROUP_COL].fillna("").to_numpy().astype(str))
+            # 鋼種ごとの抽出率で行を選ぶ（チャンク番号から決まる乱数なので、再実行しても同じ行になる）
+            keep = np.random.default_rng([RANDOM_SEED, i]).random(len(chunk)) < keep_prob[group_codes]
+            if not keep.any():
+                continue
+            X, _ = encoder.transform(chunk[keep])
+            if executor is None:
+                collect(summarize_chunk(X, group_codes[keep], len(groups)), len(X))
+                continue
+            pending.append((executor.submit(summarize_chunk, X, group_codes[keep], len(groups)), len(X)))
+            while len(pending) >= args.workers * 2:
+                future, n_rows = pending.popleft()
+                collect(future.result(), n_rows)
+        while pending:
+            future, n_rows = pending.popleft()
+            collect(future.result(), n_rows)
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    elapsed = time.perf_counter() - start_time
+    print(f"  完了: {n_done} 行, {elapsed:.2f} 秒")
+
+    # --- ステップ4: 重要度テーブルの保存 ---
+    print(f"\n[ステップ4: 重要度テーブルの保存]")
+    summary = build_summary(abs_stats, signed_stats, population, groups, original_features)
+    summary.to_csv(OUTPUT_CSV, index=False, encoding='utf-8-sig')
+    print(f"重要度テーブルを '{OUTPUT_CSV}' に保存しました。")
+
+    print(f"\n  全体の重要度 (平均 |SHAP| ± 95%信頼区間):")
+    overall = summary[summary[GROUP_COL] == ALL_GROUPS_LABEL]
+    for _, row in overall.iterrows():
+        print(f"    {row['Rank']}. {row['Feature']:<12} {row['Mean_Abs_SHAP']:.4f} ± {row['CI95']:.4f}")
+
+    print("\n--- SHAP 重要度集計プログラム終了 ---")
+
+
+if __name__ == "__main__":
+    main()
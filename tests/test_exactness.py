@@ -0,0 +1,209 @@
+import os
+import sys
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.tree import DecisionTreeRegressor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from category_encoder import CategoryEncoder
+from forest_engine import SKLEARN_MIN_ROWS, ForestEngine
+from model_artifact import compact_model_path, load_model, save_compact_model
+from response_table import ResponseTable, build_response_table, verify
+from rule_table import RuleTable
+
+# ----------------------------------------------------
+# 推論の高速化が「学習済みモデルと同じ結果」を返すことの回帰テスト
+# ----------------------------------------------------
+# 小さな合成データでモデルを学習し、エンジン・コンパクト形式・応答曲面テーブル・ルール表の出力を
+# scikit-learn の apply / predict と比較する。
+# 実行方法:  python -m pytest -q tests
+
+NUMERIC_COLS = ["Temp", "Pressure"]
+CATEGORICAL_COLS = ["Pattern", "Steel_Code"]
+
+
+def make_orders(n_rows, seed, nan_fraction=0.0):
+    """ 鋳造データを模した操業命令（数値の欠損値を nan_fraction の割合で含む） """
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        "Temp": rng.uniform(1500, 1600, n_rows).round(1),
+        "Pressure": rng.uniform(1.0, 3.0, n_rows).round(2),
+        "Pattern": rng.choice(["P1", "P2", "P3"], n_rows),
+        "Steel_Code": rng.choice([f"S{i:02d}" for i in range(6)], n_rows),
+    })
+    for col in NUMERIC_COLS:
+        df.loc[rng.random(n_rows) < nan_fraction, col] = np.nan
+    return df
+
+
+def make_target(df, seed):
+    rng = np.random.default_rng(seed)
+    speed = (2.0 - 0.004 * (df["Temp"].fillna(1550) - 1500) + 0.1 * df["Pressure"].fillna(2.0)
+             + 0.05 * (df["Pattern"] == "P2") + 0.02 * df["Steel_Code"].str[1:].astype(int))
+    return speed + rng.normal(0, 0.02, len(df))
+
+
+def fit_bundle(max_depth, nan_fraction):
+    """ trainmodel.py と同じ形の model_data（joblib のモデルファイルの中身）を作る """
+    df = make_orders(3000, seed=0, nan_fraction=nan_fraction)
+    X = pd.get_dummies(df, columns=CATEGORICAL_COLS, dummy_na=False, dtype=float)
+    model_columns = list(X.columns)
+    model = RandomForestRegressor(n_estimators=20, max_depth=max_depth, random_state=42, max_features=1.0)
+    model.fit(X, make_target(df, seed=1))
+
+    encoder = CategoryEncoder.fit(df, model_columns, NUMERIC_COLS, CATEGORICAL_COLS)
+    param_ranges = {col: {"min": float(df[col].min()), "max": float(df[col].max())} for col in NUMERIC_COLS}
+    param_ranges.update({col: {"values": sorted(df[col].unique().tolist())} for col in CATEGORICAL_COLS})
+    return {
+        "model": model,
+        "model_columns": model_columns,
+        "original_cols_numeric": NUMERIC_COLS,
+        "original_cols_categorical": CATEGORICAL_COLS,
+        "encoder": encoder,
+        "param_ranges": param_ranges,
+        "training_info": {"mode": "test"},
+    }
+
+
+@pytest.fixture(scope="module")
+def deep_bundle():
+    """ 深さを制限しないフォレスト（学習データに欠損値を含む） """
+    return fit_bundle(max_depth=None, nan_fraction=0.05)
+
+
+@pytest.fixture(scope="module")
+def shallow_bundle():
+    """ 応答曲面テーブル向けの浅いフォレスト """
+    return fit_bundle(max_depth=5, nan_fraction=0.0)
+
+
+def tree_predictions(model, X):
+    """ 従来の予測方法（ツリーごとの predict）による (n_rows, n_trees) の予測値 """
+    return np.column_stack([tree.predict(X.astype(np.float32)) for tree in model.estimators_])
+
+
+def test_encoder_matches_get_dummies(deep_bundle):
+    df = make_orders(500, seed=2)
+    df.loc[:9, "Steel_Code"] = "S99"  # 学習時に存在しない値
+    X, unknown = deep_bundle["encoder"].transform(df)
+    expected = pd.get_dummies(df, columns=CATEGORICAL_COLS, dtype=float).reindex(
+        columns=deep_bundle["model_columns"], fill_value=0.0)
+    assert np.array_equal(X, expected.to_numpy(), equal_nan=True)
+    assert unknown.tolist() == [True] * 10 + [False] * 490
+
+
+@pytest.mark.parametrize("n_rows", [1, SKLEARN_MIN_ROWS - 1, SKLEARN_MIN_ROWS, 2000])
+def test_engine_matches_trees(deep_bundle, n_rows):
+    model = deep_bundle["model"]
+    X, _ = deep_bundle["encoder"].transform(make_orders(n_rows, seed=3, nan_fraction=0.1))
+    engine = ForestEngine.from_model(model)
+
+    leaves = np.column_stack([tree.apply(X.astype(np.float32)) for tree in model.estimators_]) + engine.roots
+    assert np.array_equal(engine.apply(X), leaves)
+
+    # 少ない行はエンジンで辿り、多い行はツリーごとの predict で求める（どちらも同じ値）
+    predictions = tree_predictions(model, X)
+    pred_mean, pred_std = engine.predict_mean_std(X)
+    assert np.array_equal(pred_mean, predictions.mean(axis=1))
+    assert np.array_equal(pred_std, predictions.std(axis=1))
+    X_frame = pd.DataFrame(X, columns=deep_bundle["model_columns"])
+    assert np.allclose(pred_mean, model.predict(X_frame), rtol=0, atol=1e-12)
+
+
+def test_engine_save_load_round_trip(deep_bundle, tmp_path):
+    engine = ForestEngine.from_model(deep_bundle["model"])
+    engine.save(tmp_path / "engine")
+    loaded = ForestEngine.load(tmp_path / "engine")
+    X, _ = deep_bundle["encoder"].transform(make_orders(200, seed=4, nan_fraction=0.1))
+    assert np.array_equal(loaded.apply(X), engine.apply(X))
+    assert np.array_equal(loaded.predict_mean_std(X)[0], engine.predict_mean_std(X)[0])
+
+
+def test_compact_model_round_trip(deep_bundle, tmp_path):
+    model_path = str(tmp_path / "model.joblib")
+    joblib.dump(deep_bundle, model_path)
+    save_compact_model(compact_model_path(model_path), deep_bundle["model"], deep_bundle["model_columns"],
+                       NUMERIC_COLS, CATEGORICAL_COLS, deep_bundle["encoder"], deep_bundle["param_ranges"])
+
+    # 既定では joblib のモデルを使い、コンパクト形式は指定したときだけ使う
+    exact = load_model(model_path)
+    compact = load_model(model_path, prefer_compact=True)
+    assert exact["source"] == model_path
+    assert compact["source"] == compact_model_path(model_path)
+    assert "model" not in compact
+
+    X, _ = deep_bundle["encoder"].transform(make_orders(2000, seed=5, nan_fraction=0.1))
+    # しきい値は float32 に切り下げて保存するため、到達する葉は同じ
+    assert np.array_equal(compact["engine"].apply(X), exact["engine"].apply(X))
+    exact_mean, exact_std = exact["engine"].predict_mean_std(X)
+    compact_mean, compact_std = compact["engine"].predict_mean_std(X)
+    # 葉の値が float32 に丸められる分だけ異なる（予測値の大きさに対する相対誤差）
+    assert np.allclose(compact_mean, exact_mean, rtol=1e-6, atol=0)
+    assert np.allclose(compact_std, exact_std, rtol=1e-4, atol=1e-6)
+
+
+def test_response_table_matches_engine(shallow_bundle, tmp_path):
+    model_data = dict(shallow_bundle, engine=ForestEngine.from_model(shallow_bundle["model"]),
+                      source="model.joblib")
+    path = str(tmp_path / "model.surface")
+    stats = build_response_table(model_data, path)
+    assert stats["n_combos"] == 3 * 6
+    table = ResponseTable.load(path)
+    assert table.matches(model_data)
+
+    # しきい値ちょうどの値を含むランダムな入力で、ツリーとの差は丸め誤差の範囲
+    n_missing, mean_diff, std_diff = verify(table, model_data, 5000)
+    assert n_missing == 0
+    assert mean_diff < 1e-12
+    assert std_diff < 1e-12
+
+    # 未知のカテゴリ値・欠損値を含む行は表にない
+    df = make_orders(4, seed=6)
+    df.loc[0, "Steel_Code"] = "S99"
+    df.loc[1, "Temp"] = np.nan
+    X, _ = shallow_bundle["encoder"].transform(df)
+    pred_mean, _, found = table.lookup(X)
+    assert found.tolist() == [False, False, True, True]
+    assert np.isnan(pred_mean[:2]).all()
+
+
+def test_response_table_rejects_large_grid(shallow_bundle, tmp_path):
+    model_data = dict(shallow_bundle, engine=ForestEngine.from_model(shallow_bundle["model"]),
+                      source="model.joblib")
+    with pytest.raises(ValueError, match="格子のセル数が上限"):
+        build_response_table(model_data, str(tmp_path / "model.surface"), max_grid_cells=10)
+    assert not os.path.exists(tmp_path / "model.surface")
+
+
+@pytest.mark.parametrize("train_nan", [False, True])
+def test_rule_table_matches_tree(train_nan, tmp_path):
+    df = make_orders(5000, seed=7, nan_fraction=0.1 if train_nan else 0.0)
+    X = pd.get_dummies(df, columns=CATEGORICAL_COLS, dtype=float)
+    feature_names = list(X.columns)
+    tree = DecisionTreeRegressor(max_depth=6, min_samples_leaf=20).fit(X, make_target(df, seed=8))
+
+    orders = make_orders(3000, seed=9, nan_fraction=0.2)
+    orders.loc[:99, "Pattern"] = "P9"  # 学習時に存在しない値
+    X_orders = pd.get_dummies(orders, columns=CATEGORICAL_COLS, dtype=float).reindex(
+        columns=feature_names, fill_value=0.0)
+    leaves = tree.apply(X_orders)
+    speeds = tree.predict(X_orders)
+
+    rule_table = RuleTable.from_tree(tree, feature_names, NUMERIC_COLS, CATEGORICAL_COLS)
+    rule_table.to_csv(tmp_path / "rules.csv")
+    for table in (rule_table, RuleTable.read_csv(tmp_path / "rules.csv")):
+        # 格子状の対応表と、ルールごとの条件判定の両方を確かめる
+        for use_lookup in (True, False):
+            lookup = table.lookup
+            if not use_lookup:
+                table.lookup = None
+            rule_index, base_speed, _ = table.assign(orders)
+            table.lookup = lookup
+            assert (rule_index >= 0).all()
+            assert np.array_equal(table.leaf_ids[rule_index], leaves)
+            assert np.array_equal(base_speed, speeds)
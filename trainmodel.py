@@ -1,24 +1,22 @@
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 from sklearn.ensemble import RandomForestRegressor
+from sklearn.tree import DecisionTreeRegressor
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_squared_error
 import joblib # モデル保存用ライブラリ
+import argparse
 import warnings
 import sys
+import time
+from data_cache import read_dataset
+from model_artifact import compact_model_path, save_compact_model
+from category_encoder import CategoryEncoder
+from instrumentation import profiler
 
 # 警告を非表示
 warnings.filterwarnings('ignore')
 
-# Matplotlibの日本語フォント設定
-try:
-    plt.rcParams['font.family'] = 'IPAexGothic'
-    plt.rcParams['axes.unicode_minus'] = False
-except Exception:
-    pass
-
 # ----------------------------------------------------
 # ▼ ユーザー設定項目 ▼
 # ----------------------------------------------------
@@ -38,29 +36,166 @@ X_COLS_CATEGORICAL = ["Pattern", "Steel_Code"] # 例: ["操業パターン", "
 # 4. 生成するモデルファイル名
 MODEL_FILE_NAME = "casting_speed_model.joblib"
 
+# 5. 木の数（多いほど精度が上がるが時間もかかる）
+N_ESTIMATORS = 100
+
+# 6. 学習方法
+# "memory"    -> CSVを全件メモリに読み込んで学習（従来どおり）
+# "streaming" -> CSVをチャンク単位で読み、ツリーごとに抽出したサンプルで学習
+#                (メモリに乗らない大きさのデータ向け。使用メモリはデータ全体の大きさに依存しません)
+TRAIN_MODE = "memory"
+
+# 7. (streaming) 一度に読み込む行数と、1本のツリーが学習に使う行数
+STREAM_CHUNK_SIZE = 100000
+STREAM_ROWS_PER_TREE = 100000
+# (streaming) 1回のデータ読み込みでまとめて学習するツリーの数
+# (メモリ使用量 ≒ この値 × STREAM_ROWS_PER_TREE × 説明変数の数 × 4バイト)
+STREAM_TREES_PER_PASS = 10
+# (streaming) 精度評価用に抽出するテストデータの行数
+STREAM_TEST_ROWS = 100000
+
+# 8. (memory) 木の数を自動で決める場合の設定（--grow で有効）
+# warm_start で GROW_STEP 本ずつ木を追加し、誤差の改善率が GROW_MIN_IMPROVEMENT 未満の追加が
+# GROW_PATIENCE 回続いたら止める（最後に改善した時点の本数まで木を減らして保存します）
+GROW_STEP = 10
+GROW_MAX_TREES = 500
+GROW_MIN_IMPROVEMENT = 0.002
+GROW_PATIENCE = 2
+# 止める判断に使う誤差: "oob" -> OOB誤差（学習に使わなかった行での誤差）, "validation" -> テストデータの RMSE
+GROW_METRIC = "oob"
+
 # ----------------------------------------------------
 # ▲ ユーザー設定項目はここまで ▲
 # ----------------------------------------------------
 
 
-def main():
+def print_feature_importance(model, model_columns):
+    """ 特徴量の重要度 Top 10 を表示する """
+    importances = model.feature_importances_
+    feature_importance_df = pd.DataFrame({'Feature': model_columns, 'Importance': importances})
+    feature_importance_df = feature_importance_df.sort_values(by='Importance', ascending=False)
+    print("\n  特徴量の重要度（予測への影響度）Top 10:")
+    print(feature_importance_df.head(10))
+
+
+def save_model_bundle(model, model_columns, encoder, param_ranges, training_info):
+    """ 予測時に必要な情報をすべて辞書にまとめて保存する """
+    model_data = {
+        "model": model, # 学習済みモデル本体
+        "model_columns": model_columns, # 学習時に使った列名リスト（ダミー変数含む）
+        "original_cols_numeric": X_COLS_NUMERIC, # 予測時に入力を促すため
+        "original_cols_categorical": X_COLS_CATEGORICAL, # 予測時に入力を促すため
+        "encoder": encoder, # 事前コンパイル済みのカテゴリ変数エンコーダー
+        "param_ranges": param_ranges, # 最適化の探索範囲
+        "training_info": training_info # 学習方法・木の数・学習時間・学習曲線
+    }
+    
+    # joblibを使ってファイルに保存
+    joblib.dump(model_data, MODEL_FILE_NAME)
+    
+    print(f"モデルと関連情報を '{MODEL_FILE_NAME}' に保存しました。")
+
+    # 推論専用のコンパクト形式（メモリマップで一瞬で読み込める）も書き出す
+    compact_path = compact_model_path(MODEL_FILE_NAME)
+    save_compact_model(compact_path, model, model_columns, X_COLS_NUMERIC, X_COLS_CATEGORICAL, encoder, param_ranges)
+    print(f"推論用のコンパクト形式を '{compact_path}' に保存しました。")
+    print("\n--- モデル学習プログラム終了 ---")
+
+
+def grow_forest(X_train, y_train, X_val, y_val):
+    """ warm_start で GROW_STEP 本ずつ木を増やし、誤差が下がらなくなったら止める """
+    X_fit = X_train.to_numpy(dtype=np.float32) # ツリーは float32 で学習・予測するため
+    X_eval = X_val.to_numpy(dtype=np.float32)
+    y_fit = y_train.to_numpy(dtype=np.float64)
+    y_eval = y_val.to_numpy(dtype=np.float64)
+
+    # OOB・テストデータの予測値の合計を、追加した木の分だけ足し込んでいく（毎回全ての木で予測し直さない）
+    oob_sum = np.zeros(len(y_fit))
+    oob_count = np.zeros(len(y_fit), dtype=np.int64)
+    val_sum = np.zeros(len(y_eval))
+
+    # random_state が同じなら、最後に残った本数で最初から学習した森と同じ木になる
+    model = RandomForestRegressor(
+        n_estimators=0,
+        random_state=42,
+        n_jobs=-1, # CPUの全コアを使用
+        max_features=1.0,
+        warm_start=True
+    )
+    learning_curve = []
+    best_error = np.inf
+    best_n_trees = 0
+    n_stalled = 0
+    fit_time = 0.0
+
+    print(f"  {GROW_STEP} 本ずつ木を追加します (最大 {GROW_MAX_TREES} 本, 判定: {GROW_METRIC}, "
+          f"改善率 {GROW_MIN_IMPROVEMENT:.1%} 未満が {GROW_PATIENCE} 回続いたら停止)")
+    while model.n_estimators < GROW_MAX_TREES:
+        n_before = model.n_estimators
+        model.set_params(n_estimators=min(n_before + GROW_STEP, GROW_MAX_TREES))
+        start_time = time.perf_counter()
+        model.fit(X_fit, y_fit)
+        fit_time += time.perf_counter() - start_time
+
+        in_bag = model.estimators_samples_
+        for i in range(n_before, model.n_estimators):
+            tree = model.estimators_[i]
+            oob = np.ones(len(y_fit), dtype=bool)
+            oob[in_bag[i]] = False
+            oob_sum[oob] += tree.predict(X_fit[oob])
+            oob_count[oob] += 1
+            val_sum += tree.predict(X_eval)
+
+        # OOB誤差は「その行を学習に使わなかった木」が1本以上ある行だけで計算する
+        has_oob = oob_count > 0
+        oob_rmse = float(np.sqrt(np.mean((oob_sum[has_oob] / oob_count[has_oob] - y_fit[has_oob]) ** 2)))
+        val_rmse = float(np.sqrt(np.mean((val_sum / model.n_estimators - y_eval) ** 2)))
+        error = oob_rmse if GROW_METRIC == "oob" else val_rmse
+        learning_curve.append({"n_trees": model.n_estimators, "oob_rmse": oob_rmse, "val_rmse": val_rmse,
+                               "fit_time_sec": fit_time})
+        print(f"    木 {model.n_estimators:4d} 本: OOB RMSE {oob_rmse:.5f} / テスト RMSE {val_rmse:.5f}"
+              f"  (累計 {fit_time:.1f} 秒)")
+
+        if error < best_error * (1.0 - GROW_MIN_IMPROVEMENT):
+            best_error = error
+            best_n_trees = model.n_estimators
+            n_stalled = 0
+        else:
+            n_stalled += 1
+            if n_stalled >= GROW_PATIENCE:
+                print(f"  改善が {GROW_PATIENCE} 回続けて {GROW_MIN_IMPROVEMENT:.1%} 未満だったため停止します。")
+                break
+
+    # 最後に改善した時点の本数まで減らす（以降の木は精度にほとんど効かず、予測を遅くするだけ）
+    if best_n_trees < model.n_estimators:
+        print(f"  木の数を {model.n_estimators} 本から {best_n_trees} 本に減らします。")
+        model.estimators_ = model.estimators_[:best_n_trees]
+        model.set_params(n_estimators=best_n_trees, warm_start=False)
+
+    training_info = {"mode": "memory-grow", "n_estimators": best_n_trees, "fit_time_sec": fit_time,
+                     "metric": GROW_METRIC, "learning_curve": learning_curve}
+    return model, training_info
+
+
+def train_in_memory(grow=False):
     print("--- モデル学習プログラム開始 ---")
 
     # --- ステップ1: データの読み込みと確認 ---
     print(f"\n[ステップ1: データの読み込みと確認]")
+    profiler.stage("ステップ1: データの読み込みと確認")
     try:
-        df = pd.read_csv(CSV_FILE_PATH)
+        # 必要な列だけを、列指向キャッシュから読み込む（2回目以降はCSVを解析しない）
+        required_cols = X_COLS_NUMERIC + X_COLS_CATEGORICAL + [Y_COL]
+        df = read_dataset(CSV_FILE_PATH, columns=required_cols)
     except FileNotFoundError:
         print(f"エラー: ファイル '{CSV_FILE_PATH}' が見つかりません。")
         sys.exit(1)
-
-    required_cols = X_COLS_NUMERIC + X_COLS_CATEGORICAL + [Y_COL]
-    missing_cols = [col for col in required_cols if col not in df.columns]
-    if missing_cols:
-        print(f"エラー: CSVファイルに必要な列がありません: {missing_cols}")
+    except KeyError as e:
+        print(f"エラー: CSVファイルに必要な列がありません: {e.args[0]}")
         sys.exit(1)
 
     print(f"{CSV_FILE_PATH} (全 {len(df)} 件) を読み込みました。")
+    profiler.count("rows_loaded", len(df))
     for col in X_COLS_CATEGORICAL:
         nunique = df[col].nunique()
         print(f"  カテゴリ変数 '{col}' のユニークな値の数: {nunique} 件")
@@ -68,6 +203,7 @@ def main():
 
     # --- ステップ2: カテゴリカル変数の前処理 (One-Hotエンコーディング) ---
     print(f"\n[ステップ2: カテゴリカル変数の前処理]")
+    profiler.stage("ステップ2: カテゴリカル変数の前処理")
     
     df_processed = df.copy()
     
@@ -85,6 +221,7 @@ def main():
 
     # --- ステップ3: 機械学習モデルの学習 ---
     print(f"\n[ステップ3: 機械学習モデルの学習]")
+    profiler.stage("ステップ3: 機械学習モデルの学習")
     
     X = df_processed[all_x_cols_processed]
     y = df_processed[Y_COL]
@@ -93,19 +230,30 @@ def main():
     X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
 
     print("モデルの学習を開始します...（データが多い場合、時間がかかります）")
-    # n_estimators: 木の数（多いほど精度が上がるが時間もかかる）
-    # max_depth: 木の深さ（Noneだと深くなる。過学習を防ぐため 10 などに制限する手もある）
-    model = RandomForestRegressor(
-        n_estimators=100, 
-        random_state=42, 
-        n_jobs=-1, # CPUの全コアを使用
-        max_features=1.0
-    )
-    model.fit(X_train, y_train)
-    print("モデルの学習が完了しました。")
+    if grow:
+        model, training_info = grow_forest(X_train, y_train, X_test, y_test)
+    else:
+        # n_estimators: 木の数（多いほど精度が上がるが時間もかかる）
+        # max_depth: 木の深さ（Noneだと深くなる。過学習を防ぐため 10 などに制限する手もある）
+        model = RandomForestRegressor(
+            n_estimators=N_ESTIMATORS, 
+            random_state=42, 
+            n_jobs=-1, # CPUの全コアを使用
+            max_features=1.0
+        )
+        start_time = time.perf_counter()
+        model.fit(X_train, y_train)
+        training_info = {"mode": "memory", "n_estimators": N_ESTIMATORS,
+                         "fit_time_sec": time.perf_counter() - start_time, "learning_curve": []}
+    # 木を増やしながら学習した場合は、削った木も学習した本数に含める
+    curve = training_info["learning_curve"]
+    profiler.count("trees_trained", curve[-1]["n_trees"] if curve else training_info["n_estimators"])
+    print(f"モデルの学習が完了しました。(木の数: {training_info['n_estimators']} 本, "
+          f"学習時間: {training_info['fit_time_sec']:.1f} 秒)")
 
     # --- ステップ4: モデルの精度評価 ---
     print(f"\n[ステップ4: モデルの精度評価]")
+    profiler.stage("ステップ4: モデルの精度評価")
     y_pred = model.predict(X_test)
     rmse = np.sqrt(mean_squared_error(y_test, y_pred))
     y_mean = df[Y_COL].mean()
@@ -114,29 +262,189 @@ def main():
     print(f"  -> 平均値に対してRMSEが十分に小さければ、良いモデルと言えます。")
 
     # 特徴量の重要度も表示
-    importances = model.feature_importances_
-    feature_importance_df = pd.DataFrame({'Feature': all_x_cols_processed, 'Importance': importances})
-    feature_importance_df = feature_importance_df.sort_values(by='Importance', ascending=False)
-    print("\n  特徴量の重要度（予測への影響度）Top 10:")
-    print(feature_importance_df.head(10))
-    
+    print_feature_importance(model, all_x_cols_processed)
 
     # --- ステップ5: モデルの保存 ---
     print(f"\n[ステップ5: モデルの保存]")
+    profiler.stage("ステップ5: モデルの保存")
     
-    # 予測時に必要な情報をすべて辞書にまとめる
-    model_data = {
-        "model": model, # 学習済みモデル本体
-        "model_columns": all_x_cols_processed, # 学習時に使った列名リスト（ダミー変数含む）
-        "original_cols_numeric": X_COLS_NUMERIC, # 予測時に入力を促すため
-        "original_cols_categorical": X_COLS_CATEGORICAL # 予測時に入力を促すため
-    }
-    
-    # joblibを使ってファイルに保存
-    joblib.dump(model_data, MODEL_FILE_NAME)
-    
-    print(f"モデルと関連情報を '{MODEL_FILE_NAME}' に保存しました。")
-    print("\n--- モデル学習プログラム終了 ---")
+    # カテゴリ値 → 列番号 の対応表（予測時に pd.get_dummies を使わずに済むようにする）
+    encoder = CategoryEncoder.fit(df, all_x_cols_processed, X_COLS_NUMERIC, X_COLS_CATEGORICAL)
+
+    # 各パラメータの学習範囲（最適化・シミュレーションの探索範囲に使う）
+    param_ranges = {}
+    for col in X_COLS_NUMERIC:
+        param_ranges[col] = {"min": float(df[col].min()), "max": float(df[col].max())}
+    for col in X_COLS_CATEGORICAL:
+        param_ranges[col] = {"values": sorted(df[col].dropna().unique().tolist())}
+
+    save_model_bundle(model, all_x_cols_processed, encoder, param_ranges, training_info)
+
+
+class Reservoir:
+    """ 件数の分からないデータ列から、一定件数を一様に抽出する（Algorithm R のチャンク版） """
+
+    def __init__(self, size, n_features, seed):
+        self.size = size
+        self.X = np.empty((size, n_features), dtype=np.float32) # ツリーは float32 で学習するため
+        self.y = np.empty(size, dtype=np.float64)
+        self.n_seen = 0
+        self.rng = np.random.default_rng(seed)
+
+    def add(self, X, y):
+        positions = np.arange(self.n_seen, self.n_seen + len(X))
+        # i 件目の行は、先頭 size 件なら必ず、それ以降は確率 size / (i+1) でランダムな枠に入る
+        slots = np.where(positions < self.size, positions, self.rng.integers(0, positions + 1))
+        rows = np.nonzero(slots < self.size)[0]
+        slots = slots[rows]
+        # 同じ枠が複数回選ばれた場合は、後の行が残る（1行ずつ処理した場合と同じ結果）
+        last = len(slots) - 1 - np.unique(slots[::-1], return_index=True)[1]
+        self.X[slots[last]] = X[rows[last]]
+        self.y[slots[last]] = y[rows[last]]
+        self.n_seen += len(X)
+
+    def data(self):
+        n = min(self.size, self.n_seen)
+        return self.X[:n], self.y[:n]
+
+
+def iter_training_chunks():
+    """ CSV を STREAM_CHUNK_SIZE 行ずつ、必要な列だけ読み込む（カテゴリ変数は文字列として） """
+    required_cols = X_COLS_NUMERIC + X_COLS_CATEGORICAL + [Y_COL]
+    reader = pd.read_csv(CSV_FILE_PATH, usecols=required_cols, chunksize=STREAM_CHUNK_SIZE,
+                         dtype={col: str for col in X_COLS_CATEGORICAL})
+    for i, chunk in enumerate(reader):
+        # テストデータ（約20%）はチャンク番号から決まる乱数で選ぶため、何回読み直しても同じ行になる
+        is_test = np.random.default_rng([42, i]).random(len(chunk)) < 0.2
+        yield chunk, is_test
+
+
+def train_streaming():
+    """ データ全体をメモリに載せずに学習する（ツリーごとの抽出サンプルによるバギング） """
+    print("--- モデル学習プログラム開始 (ストリーミング学習) ---")
+
+    # --- ステップ1: データの走査（件数・カテゴリ・範囲の確認） ---
+    print(f"\n[ステップ1: データの走査]")
+    profiler.stage("ステップ1: データの走査")
+    required_cols = X_COLS_NUMERIC + X_COLS_CATEGORICAL + [Y_COL]
+    try:
+        header = pd.read_csv(CSV_FILE_PATH, nrows=0).columns
+    except FileNotFoundError:
+        print(f"エラー: ファイル '{CSV_FILE_PATH}' が見つかりません。")
+        sys.exit(1)
+    missing_cols = [col for col in required_cols if col not in header]
+    if missing_cols:
+        print(f"エラー: CSVファイルに必要な列がありません: {missing_cols}")
+        sys.exit(1)
+
+    n_rows = 0
+    y_sum = 0.0
+    categories = {col: set() for col in X_COLS_CATEGORICAL}
+    param_ranges = {col: {"min": np.inf, "max": -np.inf} for col in X_COLS_NUMERIC}
+    for chunk, _ in iter_training_chunks():
+        n_rows += len(chunk)
+        y_sum += float(chunk[Y_COL].sum())
+        for col in X_COLS_CATEGORICAL:
+            categories[col].update(chunk[col].dropna().unique())
+        for col in X_COLS_NUMERIC:
+            param_ranges[col]["min"] = min(param_ranges[col]["min"], float(chunk[col].min()))
+            param_ranges[col]["max"] = max(param_ranges[col]["max"], float(chunk[col].max()))
+    for col in X_COLS_CATEGORICAL:
+        param_ranges[col] = {"values": sorted(categories[col])}
+
+    print(f"{CSV_FILE_PATH} (全 {n_rows} 件) を走査しました。")
+    profiler.count("rows_scanned", n_rows)
+    for col in X_COLS_CATEGORICAL:
+        print(f"  カテゴリ変数 '{col}' のユニークな値の数: {len(categories[col])} 件")
+
+    # --- ステップ2: 説明変数の列構成（pd.get_dummies と同じ列名・並び順） ---
+    print(f"\n[ステップ2: カテゴリカル変数の前処理]")
+    profiler.stage("ステップ2: カテゴリカル変数の前処理")
+    dummy_cols = [f"{col}_{value}" for col in X_COLS_CATEGORICAL for value in categories[col]]
+    all_x_cols_processed = sorted(set(X_COLS_NUMERIC + dummy_cols))
+    encoder = CategoryEncoder(all_x_cols_processed, X_COLS_NUMERIC, X_COLS_CATEGORICAL,
+                              {col: sorted(categories[col]) for col in X_COLS_CATEGORICAL})
+    n_features = len(all_x_cols_processed)
+    print(f"モデルが学習する全ての説明変数 (X): {n_features} 個")
+
+    # --- ステップ3: ツリーごとに抽出したサンプルで学習 ---
+    print(f"\n[ステップ3: 機械学習モデルの学習]")
+    profiler.stage("ステップ3: 機械学習モデルの学習")
+    n_passes = -(-N_ESTIMATORS // STREAM_TREES_PER_PASS)
+    print(f"{N_ESTIMATORS} 本のツリーを、{STREAM_TREES_PER_PASS} 本ずつ {n_passes} 回のデータ読み込みで学習します。"
+          f" (1本あたり最大 {STREAM_ROWS_PER_TREE} 件)")
+
+    trees = []
+    start_time = time.perf_counter()
+    test_reservoir = Reservoir(STREAM_TEST_ROWS, n_features, seed=[42, 0])
+    for pass_i in range(n_passes):
+        tree_ids = range(pass_i * STREAM_TREES_PER_PASS, min((pass_i + 1) * STREAM_TREES_PER_PASS, N_ESTIMATORS))
+        reservoirs = [Reservoir(STREAM_ROWS_PER_TREE, n_features, seed=[42, 1, t]) for t in tree_ids]
+
+        for chunk, is_test in iter_training_chunks():
+            X_chunk, _ = encoder.transform(chunk)
+            y_chunk = chunk[Y_COL].to_numpy(dtype=np.float64)
+            if pass_i == 0:
+                test_reservoir.add(X_chunk[is_test], y_chunk[is_test])
+            X_train, y_train = X_chunk[~is_test], y_chunk[~is_test]
+            for reservoir in reservoirs:
+                reservoir.add(X_train, y_train)
+            profiler.count("rows_scanned", len(chunk))
+
+        def fit_tree(tree_id, reservoir):
+            X_sample, y_sample = reservoir.data()
+            # 抽出サンプルからさらにブートストラップ（重複を許す復元抽出）した重みで学習する
+            # (データが STREAM_ROWS_PER_TREE 以下でも、ツリーごとにばらつきが出るようにする)
+            rng = np.random.default_rng([42, 2, tree_id])
+            weights = np.bincount(rng.integers(0, len(y_sample), len(y_sample)), minlength=len(y_sample))
+            tree = DecisionTreeRegressor(max_features=1.0, random_state=42 + tree_id)
+            return tree.fit(X_sample, y_sample, sample_weight=weights.astype(np.float64))
+
+        # ツリーの学習は GIL を解放するため、スレッドで並列に行う
+        trees += joblib.Parallel(n_jobs=-1, prefer="threads")(
+            joblib.delayed(fit_tree)(t, r) for t, r in zip(tree_ids, reservoirs))
+        profiler.count("trees_trained", len(tree_ids))
+        print(f"  {len(trees)} / {N_ESTIMATORS} 本のツリーを学習しました。")
+
+    # 抽出サンプルで学習したツリーを、通常の RandomForestRegressor として組み立てる
+    # (predict.py / optimize_standards.py / SHAP からはそのまま読み込める)
+    model = RandomForestRegressor(n_estimators=N_ESTIMATORS, random_state=42, max_features=1.0)
+    model.estimator_ = DecisionTreeRegressor(max_features=1.0)
+    model.estimators_ = trees
+    model.n_features_in_ = n_features
+    model.n_outputs_ = 1
+    training_info = {"mode": "streaming", "n_estimators": N_ESTIMATORS,
+                     "fit_time_sec": time.perf_counter() - start_time, "learning_curve": []}
+    print(f"モデルの学習が完了しました。(学習時間: {training_info['fit_time_sec']:.1f} 秒)")
+
+    # --- ステップ4: モデルの精度評価 ---
+    print(f"\n[ステップ4: モデルの精度評価]")
+    profiler.stage("ステップ4: モデルの精度評価")
+    X_test, y_test = test_reservoir.data()
+    rmse = np.sqrt(mean_squared_error(y_test, model.predict(X_test)))
+    print(f"  モデルの予測精度 (RMSE): {rmse:.4f}  (テストデータから抽出した {len(y_test)} 件で評価)")
+    print(f"  (参考) 全データの平均値: {y_sum / n_rows:.4f}")
+    print(f"  -> 平均値に対してRMSEが十分に小さければ、良いモデルと言えます。")
+
+    print_feature_importance(model, all_x_cols_processed)
+
+    # --- ステップ5: モデルの保存 ---
+    print(f"\n[ステップ5: モデルの保存]")
+    profiler.stage("ステップ5: モデルの保存")
+    save_model_bundle(model, all_x_cols_processed, encoder, param_ranges, training_info)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="モデル学習プログラム")
+    parser.add_argument("--mode", choices=["memory", "streaming"], default=TRAIN_MODE, help="学習方法")
+    parser.add_argument("--grow", action="store_true",
+                        help="(memory) 木を少しずつ増やし、誤差が下がらなくなった本数で止める")
+    args = parser.parse_args()
+
+    if args.mode == "streaming":
+        train_streaming()
+    else:
+        train_in_memory(grow=args.grow)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,328 @@
+import pandas as pd
+import numpy as np
+import joblib
+import argparse
+import os
+import sys
+import time
+import warnings
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.tree import DecisionTreeRegressor
+from sklearn.tree._tree import Tree
+from sklearn.metrics import mean_squared_error
+from data_cache import read_dataset
+from model_artifact import compact_model_path, save_compact_model
+from category_encoder import CategoryEncoder
+
+warnings.filterwarnings('ignore')
+
+# ----------------------------------------------------
+# 新しい操業データによるモデルの差分更新（日次更新用）
+# ----------------------------------------------------
+# 全履歴で学習し直す代わりに、新しい行だけを読み込み、
+# 「直近の行のバッファ（スライディングウィンドウ）」からブートストラップした木を追加し、
+# 木が MAX_TREES 本を超えたら古い木から置き換える。
+# 新しい鋼種コードなどは列を末尾に追加し、既存の木はそのまま使う（既存の木はその列で分岐しない）。
+# 処理時間は新しい行数（とウィンドウの大きさ）で決まり、履歴全体の行数には依存しない。
+# 更新のたびに版番号つきのモデルファイルを MODEL_VERSION_DIR に残す。
+
+# ----------------------------------------------------
+# ▼ ユーザー設定項目 ▼
+# ----------------------------------------------------
+
+# 1. 新しい操業データ（CSV）。前回の更新以降に追加された行だけを入れる
+NEW_DATA_CSV = "new_data.csv"
+
+# 2. 更新するモデルファイル名と、版番号つきのモデルを保存するフォルダ
+MODEL_FILE_NAME = "casting_speed_model.joblib"
+MODEL_VERSION_DIR = "model_versions"
+
+# 3. 目的変数（予測したい値）の「列名」
+Y_COL = "Casting_Speed"
+
+# 4. 1回の更新で追加する木の数と、森全体の木の上限（超えた分は古い木から削除）
+UPDATE_N_TREES = 10
+MAX_TREES = 100
+
+# 5. 新しい木の学習に使う「直近の行」の件数（スライディングウィンドウ）
+WINDOW_ROWS = 200000
+
+# 6. 全履歴データ（CSV）。ウィンドウの初回作成と、--compare での全件再学習に使う
+# (NEW_DATA_CSV の行はまだ含まれていないものとします)
+HISTORY_CSV_PATH = "your_data.csv"
+
+# 7. (--compare) 新しい行のうち精度評価用に取り分ける割合
+COMPARE_HOLDOUT = 0.2
+
+# ----------------------------------------------------
+# ▲ ユーザー設定項目はここまで ▲
+# ----------------------------------------------------
+
+
+def window_path(model_file_name):
+    """ モデルファイルに対応するウィンドウ（直近の行のバッファ）のファイル名 """
+    return os.path.splitext(model_file_name)[0] + ".window.npz"
+
+
+def version_path(model_file_name, version):
+    """ 版番号つきのモデルファイル名 """
+    stem, ext = os.path.splitext(os.path.basename(model_file_name))
+    return os.path.join(MODEL_VERSION_DIR, f"{stem}.v{version:04d}{ext}")
+
+
+def extend_categories(model_data, df_new):
+    """
+    新しい行に含まれる未知のカテゴリ値の列をモデルの列構成の末尾に追加する
+    戻り値: (新しい列構成, 新しいエンコーダー, 追加した列名のリスト)
+    """
+    encoder = CategoryEncoder.from_model_data(model_data)
+    model_columns = list(model_data["model_columns"])
+    categories = {col: encoder.category_keys[col].tolist() for col in encoder.categorical_cols}
+    added = []
+    for col in encoder.categorical_cols:
+        known = set(categories[col])
+        for value in sorted(df_new[col].dropna().astype(str).unique()):
+            if value not in known:
+                categories[col].append(value)
+                model_columns.append(f"{col}_{value}")
+                added.append(f"{col}_{value}")
+    if not added:
+        return model_columns, encoder, added
+    encoder = CategoryEncoder(model_columns, encoder.numeric_cols, encoder.categorical_cols, categories)
+    return model_columns, encoder, added
+
+
+def widen_tree(tree, n_features):
+    """ 学習済みの木を、列が増えた入力（追加列は末尾）をそのまま受け取れるようにする """
+    if tree.n_features_in_ == n_features:
+        return tree
+    # ノード配列はそのまま、特徴量の数だけを増やした Tree に載せ替える（pickle と同じ手順）
+    widened = Tree(n_features, tree.tree_.n_classes, tree.tree_.n_outputs)
+    widened.__setstate__(tree.tree_.__getstate__())
+    tree.tree_ = widened
+    tree.n_features_in_ = n_features
+    tree.max_features_ = n_features
+    return tree
+
+
+def load_window(path, model_columns):
+    """ 保存済みのウィンドウを読み込み、列構成を現在のモデルに合わせる（なければ None） """
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as saved:
+        X_saved, y_saved, columns = saved["X"], saved["y"], saved["model_columns"].tolist()
+    X = np.zeros((len(y_saved), len(model_columns)), dtype=np.float32)
+    column_index = {col: i for i, col in enumerate(model_columns)}
+    for j, col in enumerate(columns):
+        X[:, column_index[col]] = X_saved[:, j]
+    return X, y_saved
+
+
+def read_history_tail(encoder, n_rows):
+    """ 全履歴データの末尾 n_rows 行を変換する（ウィンドウの初回作成用） """
+    required_cols = encoder.numeric_cols + encoder.categorical_cols + [Y_COL]
+    df = read_dataset(HISTORY_CSV_PATH, columns=required_cols).dropna(subset=required_cols).tail(n_rows)
+    X, _ = encoder.transform(df)
+    return X.astype(np.float32), df[Y_COL].to_numpy(dtype=np.float64)
+
+
+def fit_window_trees(X_window, y_window, n_trees, seed):
+    """ ウィンドウの行からブートストラップした重みで、新しい木を n_trees 本学習する """
+    def fit_tree(i):
+        rng = np.random.default_rng([42, 3, seed, i])
+        weights = np.bincount(rng.integers(0, len(y_window), len(y_window)), minlength=len(y_window))
+        tree = DecisionTreeRegressor(max_features=1.0, random_state=int(rng.integers(2 ** 31)))
+        return tree.fit(X_window, y_window, sample_weight=weights.astype(np.float64))
+
+    # ツリーの学習は GIL を解放するため、スレッドで並列に行う
+    return joblib.Parallel(n_jobs=-1, prefer="threads")(joblib.delayed(fit_tree)(i) for i in range(n_trees))
+
+
+def update_forest(model, model_columns, new_trees):
+    """ 既存の森に新しい木を追加し、MAX_TREES 本を超えた分は古い木から削除する """
+    n_features = len(model_columns)
+    trees = [widen_tree(tree, n_features) for tree in model.estimators_] + list(new_trees)
+    n_removed = max(len(trees) - MAX_TREES, 0)
+    model.estimators_ = trees[n_removed:]
+    model.n_estimators = len(model.estimators_)
+    model.n_features_in_ = n_features
+    if hasattr(model, "feature_names_in_"):
+        model.feature_names_in_ = np.asarray(model_columns, dtype=object)
+    return n_removed
+
+
+def extend_param_ranges(param_ranges, df_new, numeric_cols, categorical_cols):
+    """ 最適化の探索範囲を新しい行の値まで広げる """
+    ranges = {col: dict(value) for col, value in param_ranges.items()}
+    for col in numeric_cols:
+        ranges[col]["min"] = min(ranges[col]["min"], float(df_new[col].min()))
+        ranges[col]["max"] = max(ranges[col]["max"], float(df_new[col].max()))
+    for col in categorical_cols:
+        ranges[col]["values"] = sorted(set(ranges[col]["values"]) | set(df_new[col].dropna().astype(str)))
+    return ranges
+
+
+def save_bundle(model_data, model_file_name):
+    """ 一時ファイルに書いてから置き換える（書き込み中に予測プログラムが壊れたファイルを読まないように） """
+    tmp_path = model_file_name + ".tmp"
+    joblib.dump(model_data, tmp_path)
+    os.replace(tmp_path, model_file_name)
+
+
+def compare_with_full_retrain(model_data, df_new, model_columns, encoder, window, n_trees):
+    """ 新しい行の一部を取り分け、差分更新と全件再学習の精度・時間を比べる（モデルは保存しない） """
+    required_cols = encoder.numeric_cols + encoder.categorical_cols + [Y_COL]
+    holdout = np.random.default_rng([42, 4]).random(len(df_new)) < COMPARE_HOLDOUT
+    X_new, _ = encoder.transform(df_new)
+    X_new = X_new.astype(np.float32)
+    y_new = df_new[Y_COL].to_numpy(dtype=np.float64)
+    X_eval, y_eval = X_new[holdout], y_new[holdout]
+    print(f"  新しい行 {len(df_new)} 件のうち {int(holdout.sum())} 件を評価用に取り分けます。")
+
+    # 差分更新（評価用の行を除いて）
+    model = model_data["model"]
+    X_window = np.concatenate([window[0], X_new[~holdout]])[-WINDOW_ROWS:]
+    y_window = np.concatenate([window[1], y_new[~holdout]])[-WINDOW_ROWS:]
+    start_time = time.perf_counter()
+    new_trees = fit_window_trees(X_window, y_window, n_trees, seed=model_data.get("model_version", 0) + 1)
+    update_forest(model, model_columns, new_trees)
+    update_sec = time.perf_counter() - start_time
+    update_rmse = np.sqrt(mean_squared_error(y_eval, model.predict(X_eval)))
+
+    # 全履歴 + 新しい行（評価用の行を除く）で、同じ本数の森を最初から学習
+    start_time = time.perf_counter()
+    history = read_dataset(HISTORY_CSV_PATH, columns=required_cols).dropna(subset=required_cols)
+    X_history, _ = encoder.transform(history)
+    X_full = np.concatenate([X_history.astype(np.float32), X_new[~holdout]])
+    y_full = np.concatenate([history[Y_COL].to_numpy(dtype=np.float64), y_new[~holdout]])
+    full_model = RandomForestRegressor(n_estimators=model.n_estimators, random_state=42, n_jobs=-1, max_features=1.0)
+    full_model.fit(X_full, y_full)
+    full_sec = time.perf_counter() - start_time
+    full_rmse = np.sqrt(mean_squared_error(y_eval, full_model.predict(X_eval)))
+
+    print(f"\n  {'方法':<12} {'学習行数':>10} {'時間(秒)':>9} {'RMSE':>8}")
+    print(f"  {'差分更新':<12} {len(y_window):>10} {update_sec:>9.2f} {update_rmse:>8.4f}")
+    print(f"  {'全件再学習':<12} {len(y_full):>10} {full_sec:>9.2f} {full_rmse:>8.4f}")
+    print(f"  -> 差分更新の RMSE は全件再学習の {update_rmse / full_rmse:.1%}、時間は {update_sec / full_sec:.1%} です。")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="新しい操業データによるモデルの差分更新")
+    parser.add_argument("--new", default=NEW_DATA_CSV, help="新しい操業データの CSV")
+    parser.add_argument("--trees", type=int, default=UPDATE_N_TREES, help="追加する木の数")
+    parser.add_argument("--compare", action="store_true",
+                        help="全件再学習と精度・時間を比べる（モデルは保存しない）")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    print("--- モデル差分更新プログラム開始 ---")
+
+    # --- ステップ1: 現在のモデルの読み込み ---
+    print(f"\n[ステップ1: モデル '{MODEL_FILE_NAME}' を読み込み中...]")
+    try:
+        model_data = joblib.load(MODEL_FILE_NAME)
+    except FileNotFoundError:
+        print(f"エラー: モデルファイル '{MODEL_FILE_NAME}' が見つかりません。先に trainmodel.py を実行してください。")
+        sys.exit(1)
+    numeric_cols = model_data["original_cols_numeric"]
+    categorical_cols = model_data["original_cols_categorical"]
+    version = model_data.get("model_version", 0)
+    print(f"  版 {version}, 木の数: {len(model_data['model'].estimators_)} 本")
+
+    # --- ステップ2: 新しい行の読み込み ---
+    print(f"\n[ステップ2: 新しいデータ '{args.new}' の読み込み]")
+    required_cols = numeric_cols + categorical_cols + [Y_COL]
+    try:
+        df_new = pd.read_csv(args.new, dtype={col: str for col in categorical_cols})
+    except FileNotFoundError:
+        print(f"エラー: ファイル '{args.new}' が見つかりません。")
+        sys.exit(1)
+    missing_cols = [col for col in required_cols if col not in df_new.columns]
+    if missing_cols:
+        print(f"エラー: CSVファイルに必要な列がありません: {missing_cols}")
+        sys.exit(1)
+    n_read = len(df_new)
+    df_new = df_new.dropna(subset=required_cols)
+    if df_new.empty:
+        print("エラー: 学習に使える新しい行がありません。")
+        sys.exit(1)
+    print(f"  {len(df_new)} 件を読み込みました。(欠損のある {n_read - len(df_new)} 件は除外)")
+
+    # --- ステップ3: カテゴリ値の追加 ---
+    print(f"\n[ステップ3: 新しいカテゴリ値の確認]")
+    model_columns, encoder, added_columns = extend_categories(model_data, df_new)
+    if added_columns:
+        print(f"  新しい列を追加します: {added_columns}")
+    else:
+        print("  新しいカテゴリ値はありません。")
+
+    # ウィンドウ（直近の行）の読み込み。初回だけ全履歴の末尾から作る
+    window = load_window(window_path(MODEL_FILE_NAME), model_columns)
+    if window is None:
+        print(f"  ウィンドウがないため、'{HISTORY_CSV_PATH}' の末尾 {WINDOW_ROWS} 行から作ります。（初回のみ）")
+        window = read_history_tail(encoder, WINDOW_ROWS)
+
+    if args.compare:
+        print(f"\n[ステップ4: 差分更新と全件再学習の比較]")
+        compare_with_full_retrain(model_data, df_new, model_columns, encoder, window, args.trees)
+        print("\n--- モデル差分更新プログラム終了 (比較のみ。モデルは保存していません) ---")
+        return
+
+    # --- ステップ4: 木の追加・置き換え ---
+    print(f"\n[ステップ4: 木の追加・置き換え]")
+    start_time = time.perf_counter()
+    X_new, _ = encoder.transform(df_new)
+    X_window = np.concatenate([window[0], X_new.astype(np.float32)])[-WINDOW_ROWS:]
+    y_window = np.concatenate([window[1], df_new[Y_COL].to_numpy(dtype=np.float64)])[-WINDOW_ROWS:]
+    new_trees = fit_window_trees(X_window, y_window, args.trees, seed=version + 1)
+    model = model_data["model"]
+    n_removed = update_forest(model, model_columns, new_trees)
+    update_sec = time.perf_counter() - start_time
+    print(f"  直近 {len(y_window)} 行から {len(new_trees)} 本を追加し、古い木を {n_removed} 本削除しました。"
+          f" (木の数: {model.n_estimators} 本, {update_sec:.2f} 秒)")
+
+    # --- ステップ5: 版番号つきモデルの保存 ---
+    print(f"\n[ステップ5: モデルの保存]")
+    version += 1
+    param_ranges = extend_param_ranges(model_data["param_ranges"], df_new, numeric_cols, categorical_cols)
+    model_data.update({
+        "model": model,
+        "model_columns": model_columns,
+        "encoder": encoder,
+        "param_ranges": param_ranges,
+        "model_version": version,
+    })
+    model_data.setdefault("update_history", []).append({
+        "version": version,
+        "updated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "source": os.path.abspath(args.new),
+        "n_new_rows": len(df_new),
+        "n_window_rows": len(y_window),
+        "n_trees_added": len(new_trees),
+        "n_trees_removed": n_removed,
+        "added_columns": added_columns,
+        "update_time_sec": update_sec,
+    })
+
+    os.makedirs(MODEL_VERSION_DIR, exist_ok=True)
+    versioned = version_path(MODEL_FILE_NAME, version)
+    save_bundle(model_data, versioned)
+    print(f"版 {version} のモデルを '{versioned}' に保存しました。")
+
+    # 予測プログラムが読み込む現在のモデル（joblib とコンパクト形式）とウィンドウを置き換える
+    save_bundle(model_data, MODEL_FILE_NAME)
+    compact_path = compact_model_path(MODEL_FILE_NAME)
+    save_compact_model(compact_path, model, model_columns, numeric_cols, categorical_cols, encoder, param_ranges)
+    tmp_window = window_path(MODEL_FILE_NAME) + ".tmp.npz"
+    np.savez(tmp_window, X=X_window, y=y_window, model_columns=np.asarray(model_columns, dtype=str))
+    os.replace(tmp_window, window_path(MODEL_FILE_NAME))
+    print(f"現在のモデル '{MODEL_FILE_NAME}' / '{compact_path}' を更新しました。")
+
+    print("\n--- モデル差分更新プログラム終了 ---")
+
+
+if __name__ == "__main__":
+    main()